@@ -4,6 +4,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_socketio import SocketIO
 from flask_cors import CORS
+from .serialization import JSONProvider, socket_json
 import os
 import logging
 
@@ -12,17 +13,18 @@ logging.basicConfig(level=logging.DEBUG)
 db = SQLAlchemy()
 migrate = Migrate()
 
-# Windows-safe socket.io mode
+# The async mode is chosen per app in create_app (SOCKETIO_ASYNC_MODE)
 socketio = SocketIO(
-    async_mode="threading",
     cors_allowed_origins="*",
     ping_timeout=60,
-    ping_interval=25
+    ping_interval=25,
+    json=socket_json
 )
 
 
 def create_app(config_object=None):
     app = Flask(__name__, static_folder=None)
+    app.json = JSONProvider(app)
 
     # Load config
     if config_object:
@@ -34,10 +36,72 @@ def create_app(config_object=None):
         app.config['JWT_ALGORITHM'] = os.environ.get('JWT_ALGORITHM', 'HS256')
         app.config['ACCESS_TOKEN_EXPIRE_MINUTES'] = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
         app.config['REFRESH_TOKEN_EXPIRE_DAYS'] = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
+        app.config['SOCKETIO_MESSAGE_QUEUE_URL'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE_URL')
+        app.config['SOCKETIO_ASYNC_MODE'] = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+        app.config['SOCKETIO_CHANNEL'] = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio')
+        app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', '10'))
+        app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+        app.config['PRESENCE_STORE_URL'] = os.environ.get('PRESENCE_STORE_URL', 'memory://')
+        app.config['PRESENCE_TTL'] = int(os.environ.get('PRESENCE_TTL', '90'))
+        app.config['PRESENCE_HEARTBEAT_INTERVAL'] = int(os.environ.get('PRESENCE_HEARTBEAT_INTERVAL', '30'))
+        app.config['TYPING_COALESCE_INTERVAL_MS'] = int(os.environ.get('TYPING_COALESCE_INTERVAL_MS', '0'))
+        app.config['TYPING_EXPIRY_SECONDS'] = int(os.environ.get('TYPING_EXPIRY_SECONDS', '5'))
+        app.config['BROADCAST_BATCH_ENABLED'] = os.environ.get('BROADCAST_BATCH_ENABLED', '0') == '1'
+        app.config['BROADCAST_BATCH_INTERVAL_MS'] = int(os.environ.get('BROADCAST_BATCH_INTERVAL_MS', '20'))
+        app.config['BROADCAST_BATCH_MAX'] = int(os.environ.get('BROADCAST_BATCH_MAX', '50'))
+        app.config['BROADCAST_BATCH_MIN_RATE'] = float(os.environ.get('BROADCAST_BATCH_MIN_RATE', '5'))
+        app.config['PROFILE_CACHE_SIZE'] = int(os.environ.get('PROFILE_CACHE_SIZE', '10000'))
+        app.config['PROFILE_CACHE_TTL'] = int(os.environ.get('PROFILE_CACHE_TTL', '300'))
+        app.config['MEMBERSHIP_CACHE_SIZE'] = int(os.environ.get('MEMBERSHIP_CACHE_SIZE', '50000'))
+        app.config['MEMBERSHIP_CACHE_TTL'] = int(os.environ.get('MEMBERSHIP_CACHE_TTL', '60'))
+        app.config['MESSAGE_JSON_CACHE_SIZE'] = int(os.environ.get('MESSAGE_JSON_CACHE_SIZE', '20000'))
+        app.config['MESSAGE_JSON_CACHE_TTL'] = int(os.environ.get('MESSAGE_JSON_CACHE_TTL', '300'))
+        app.config['CHANNEL_CATALOG_CACHE_TTL'] = int(os.environ.get('CHANNEL_CATALOG_CACHE_TTL', '300'))
+        app.config['GROUP_COMMIT_ENABLED'] = os.environ.get('GROUP_COMMIT_ENABLED', '0') == '1'
+        app.config['GROUP_COMMIT_INTERVAL_MS'] = int(os.environ.get('GROUP_COMMIT_INTERVAL_MS', '5'))
+        app.config['GROUP_COMMIT_MAX_BATCH'] = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', '100'))
+        app.config['GROUP_COMMIT_ACK'] = os.environ.get('GROUP_COMMIT_ACK', 'flush')
+        app.config['GROUP_COMMIT_ACK_TIMEOUT'] = float(os.environ.get('GROUP_COMMIT_ACK_TIMEOUT', '5'))
+        app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR')
+        app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+        app.config['ARCHIVE_SEGMENT_SIZE'] = int(os.environ.get('ARCHIVE_SEGMENT_SIZE', '5000'))
+        app.config['CHANNEL_PURGE_WORKER'] = os.environ.get('CHANNEL_PURGE_WORKER', '1') == '1'
+        app.config['CHANNEL_PURGE_BATCH_SIZE'] = int(os.environ.get('CHANNEL_PURGE_BATCH_SIZE', '1000'))
+        app.config['CHANNEL_PURGE_INTERVAL'] = int(os.environ.get('CHANNEL_PURGE_INTERVAL', '30'))
+        app.config['REFRESH_TOKENS_PER_USER'] = int(os.environ.get('REFRESH_TOKENS_PER_USER', '10'))
+        app.config['REFRESH_TOKEN_SWEEPER'] = os.environ.get('REFRESH_TOKEN_SWEEPER', '1') == '1'
+        app.config['REFRESH_TOKEN_SWEEP_INTERVAL'] = int(os.environ.get('REFRESH_TOKEN_SWEEP_INTERVAL', '3600'))
+        app.config['REFRESH_TOKEN_SWEEP_BATCH_SIZE'] = int(os.environ.get('REFRESH_TOKEN_SWEEP_BATCH_SIZE', '1000'))
+        app.config['BCRYPT_ROUNDS'] = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+        app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+        app.config['PASSWORD_HASH_QUEUE_LIMIT'] = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', '32'))
+        app.config['PASSWORD_HASH_TIMEOUT'] = int(os.environ.get('PASSWORD_HASH_TIMEOUT', '10'))
+        app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '0') == '1'
+        app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+        app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', '200'))
+        app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', '5'))
+
+    from .async_mode import check_async_mode, configure_database
+    async_mode = check_async_mode(app.config.get('SOCKETIO_ASYNC_MODE', 'threading'))
+    configure_database(app, async_mode)
 
     db.init_app(app)
     migrate.init_app(app, db)
 
+    # Size the in-process caches from config
+    from . import profiles, memberships  # noqa: registers cache invalidation hooks
+    from . import search  # noqa: registers the full-text index DDL and hooks
+    from . import access_tokens  # noqa: registers token revocation hooks
+    from . import etags  # noqa: registers version counter hooks
+    from .cache import configure_caches
+    configure_caches(app.config)
+    from .presence import configure_presence
+    configure_presence(app.config)
+    from .querylog import init_querylog
+    init_querylog(app)
+    from .metrics import init_metrics
+    init_metrics(app, db)
+
     # FULL FIXED CORS (WORKS WITH VITE FRONTEND)
     CORS(
         app,
@@ -60,13 +124,23 @@ def create_app(config_object=None):
         app.register_blueprint(messages_bp, url_prefix='/api/channels')
     app.register_blueprint(health_bp, url_prefix='/')
 
-    # Initialize socket.io
-    socketio.init_app(app)
+    from .commands import register_commands
+    register_commands(app)
 
-    # Load socket handlers
+    # Load socket handlers before init_app so that every app instance (one
+    # per test, too) gets them registered on its server
     try:
         from . import socketio_events  # noqa
     except Exception as e:
         logging.warning(f"SocketIO events import failed: {e}")
 
+    # Initialize socket.io; with a message queue, emits fan out to every
+    # worker (see app/socket_queue.py). The manager is always passed so a
+    # later init_app never inherits the previous app's queue.
+    from .socket_queue import client_manager_for
+    socketio.init_app(app, async_mode=async_mode, client_manager=client_manager_for(
+        app.config.get('SOCKETIO_MESSAGE_QUEUE_URL'),
+        channel=app.config.get('SOCKETIO_CHANNEL', 'flask-socketio'),
+    ))
+
     return app
@@ -0,0 +1,100 @@
+"""Verified access-token cache for require_auth and socket connect.
+
+Clients present the same access token on every request for its whole
+lifetime, so once a token has been verified its (user_id, exp, iat) is
+cached under a digest of the token until it expires. Later calls skip
+decoding and signature checks. The digest covers JWT_SECRET too, so a
+secret change never serves a token verified under the old one.
+
+Revocation is checked on every call, cached or not: `revoke_token`
+rejects one token until it expires, and `revoke_user` rejects every
+token issued to a user before now. Both are process-local, like the
+other caches.
+"""
+from flask import current_app
+from sqlalchemy import event
+from .cache import TTLCache
+from .models import User
+import hashlib
+import threading
+import time
+import jwt
+
+token_cache = TTLCache('token', maxsize=100000, ttl=900)
+revoked_tokens = TTLCache('revoked_token', maxsize=100000, ttl=900)
+
+_revoked_users = {}
+_revoked_lock = threading.Lock()
+
+
+class RevokedToken(jwt.InvalidTokenError):
+    pass
+
+
+def _digest(token):
+    secret = current_app.config['JWT_SECRET']
+    return hashlib.sha256(f'{secret}\0{token}'.encode()).digest()
+
+
+def verify_access_token(token):
+    """Return the user id for a valid access token.
+
+    Raises jwt.ExpiredSignatureError / jwt.InvalidTokenError like jwt.decode.
+    """
+    key = _digest(token)
+    now = time.time()
+    entry = token_cache.get(key)
+    if entry is None:
+        payload = jwt.decode(token, current_app.config['JWT_SECRET'],
+                             algorithms=[current_app.config.get('JWT_ALGORITHM', 'HS256')])
+        user_id = payload.get('sub')
+        if not user_id:
+            raise jwt.InvalidTokenError('token has no subject')
+        entry = (user_id, payload.get('exp'), payload.get('iat'))
+        ttl = None if entry[1] is None else min(entry[1] - now, token_cache.ttl)
+        token_cache.set(key, entry, ttl=ttl)
+    elif entry[1] is not None and entry[1] <= now:
+        # The TTL runs on the monotonic clock; exp is wall-clock time
+        token_cache.pop(key)
+        raise jwt.ExpiredSignatureError('Signature has expired')
+
+    user_id, _, issued_at = entry
+    if revoked_tokens.get(key):
+        raise RevokedToken('token revoked')
+    revoked_at = _revoked_users.get(user_id)
+    if revoked_at is not None and (issued_at is None or issued_at < revoked_at):
+        raise RevokedToken('token revoked')
+    return user_id
+
+
+def revoke_token(token):
+    """Reject `token` from now on (until it would have expired anyway)."""
+    key = _digest(token)
+    token_cache.pop(key)
+    revoked_tokens.set(key, True, ttl=_max_lifetime())
+
+
+def revoke_user(user_id):
+    """Reject every access token issued to `user_id` before now."""
+    now = time.time()
+    horizon = now - _max_lifetime()
+    with _revoked_lock:
+        # Older cut-offs cannot matter once all tokens they cover expired
+        for uid in [uid for uid, at in _revoked_users.items() if at < horizon]:
+            del _revoked_users[uid]
+        _revoked_users[user_id] = now
+
+
+def clear_revocations():
+    with _revoked_lock:
+        _revoked_users.clear()
+    revoked_tokens.clear()
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    revoke_user(target.id)
+
+
+def _max_lifetime():
+    return current_app.config.get('ACCESS_TOKEN_EXPIRE_MINUTES', 15) * 60
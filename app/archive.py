@@ -0,0 +1,226 @@
+"""Cold-history tiering for the messages table.
+
+`archive_channel` moves a channel's messages older than a cutoff out of
+the hot table into append-only, gzip-compressed segment files:
+
+    <ARCHIVE_DIR>/<channel_id>/index.json        segment manifest
+    <ARCHIVE_DIR>/<channel_id>/00000001.seg.gz   JSON lines, oldest first
+
+Each manifest entry records the (created_at, id) range of its segment, so
+readers only decompress the segments a page actually touches. Segments
+are never rewritten; the manifest is replaced atomically after a segment
+is fully on disk, and rows are deleted from the hot table only after the
+manifest names them, so an interrupted run can simply be repeated.
+
+get_messages continues into the archive through `read_before` and
+`read_after` once the hot table is exhausted. Channel.archived_segments
+counts the segments whose rows have left the hot table; it is updated in
+the same transaction that deletes them. Readers skip the archive without
+touching the filesystem while it is 0, and cache each channel's manifest
+per count, so they open index.json only after a new segment lands.
+Archived messages leave the full-text search index.
+"""
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import tuple_
+from . import db, search
+from .cache import TTLCache
+from .models import Channel, Message
+import gzip
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+# Decoded segments, keyed by path; segments are immutable once written
+segment_cache = TTLCache('archive_segment', maxsize=64, ttl=600)
+# Manifests, keyed by (channel_id, archived_segments)
+index_cache = TTLCache('archive_index', maxsize=1024, ttl=600)
+
+_FIELDS = ('id', 'channel_id', 'user_id', 'content', 'created_at', 'edited_at', 'is_deleted')
+
+
+def archive_dir():
+    return current_app.config.get('ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'archive')
+
+
+def _channel_dir(channel_id):
+    return os.path.join(archive_dir(), channel_id)
+
+
+def load_index(channel_id):
+    """Return the channel's segment manifest (oldest segment first)."""
+    path = os.path.join(_channel_dir(channel_id), INDEX_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)['segments']
+    except FileNotFoundError:
+        return []
+
+
+def _archived_segments(channel_id, count=None):
+    """The manifest entries whose rows are no longer in the hot table.
+
+    `count` is the channel's archived_segments when the caller already has it.
+    """
+    if count is None:
+        count = db.session.query(Channel.archived_segments).filter_by(id=channel_id).scalar()
+    if not count:
+        return []
+    segments = index_cache.get((channel_id, count))
+    if segments is None:
+        # A run in progress may have listed a segment whose rows are still hot
+        segments = load_index(channel_id)[:count]
+        index_cache.set((channel_id, count), segments)
+    return segments
+
+
+def _record_segments(channel_id, count):
+    Channel.query.filter_by(id=channel_id).update(
+        {Channel.archived_segments: count}, synchronize_session=False)
+
+
+def _write_index(channel_id, segments):
+    path = os.path.join(_channel_dir(channel_id), INDEX_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'segments': segments}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _key(entry_key):
+    ts, row_id = entry_key
+    return datetime.fromisoformat(ts), row_id
+
+
+def _row(message):
+    return {
+        'id': message.id,
+        'channel_id': message.channel_id,
+        'user_id': message.user_id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+        'is_deleted': bool(message.is_deleted),
+    }
+
+
+def _message(row):
+    """Rebuild a transient (never added to the session) Message from a row."""
+    values = {field: row.get(field) for field in _FIELDS}
+    values['created_at'] = datetime.fromisoformat(row['created_at'])
+    if row.get('edited_at'):
+        values['edited_at'] = datetime.fromisoformat(row['edited_at'])
+    return Message(**values)
+
+
+def _read_segment(channel_id, filename):
+    path = os.path.join(_channel_dir(channel_id), filename)
+    rows = segment_cache.get(path)
+    if rows is None:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        segment_cache.set(path, rows)
+    return rows
+
+
+def archive_channel(channel_id, cutoff, segment_size=None):
+    """Move messages created before `cutoff` into archive segments.
+
+    Returns the number of messages archived.
+    """
+    segment_size = segment_size or current_app.config.get('ARCHIVE_SEGMENT_SIZE', 5000)
+    os.makedirs(_channel_dir(channel_id), exist_ok=True)
+    segments = load_index(channel_id)
+    position = tuple_(Message.created_at, Message.id)
+
+    # Finish a previous run that wrote its segment but died before deleting
+    if segments:
+        last_key = _key(segments[-1]['last'])
+        leftover = Message.query.filter(Message.channel_id == channel_id, position <= tuple_(*last_key))
+        leftover_ids = [m.id for m in leftover.with_entities(Message.id)]
+        if leftover_ids:
+            leftover.delete(synchronize_session=False)
+            search.remove_messages(db.session.connection(), leftover_ids)
+        _record_segments(channel_id, len(segments))
+        db.session.commit()
+
+    archived = 0
+    while True:
+        batch = Message.query.filter(Message.channel_id == channel_id, Message.created_at < cutoff) \
+            .order_by(Message.created_at.asc(), Message.id.asc()).limit(segment_size).all()
+        if not batch:
+            break
+        # Soft-deleted messages are dropped rather than archived
+        rows = [_row(m) for m in batch if not m.is_deleted]
+        if rows:
+            filename = f'{len(segments) + 1:08d}.seg.gz'
+            path = os.path.join(_channel_dir(channel_id), filename)
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, separators=(',', ':')) + '\n')
+            segments.append({
+                'file': filename,
+                'first': [rows[0]['created_at'], rows[0]['id']],
+                'last': [rows[-1]['created_at'], rows[-1]['id']],
+                'count': len(rows),
+            })
+            _write_index(channel_id, segments)
+        batch_ids = [m.id for m in batch]
+        Message.query.filter(Message.id.in_(batch_ids)).delete(synchronize_session=False)
+        search.remove_messages(db.session.connection(), batch_ids)
+        _record_segments(channel_id, len(segments))
+        db.session.commit()
+        archived += len(rows)
+        logger.info(f'Archived {len(rows)} messages from channel {channel_id}')
+    return archived
+
+
+def read_before(channel_id, before_key, limit, archived_segments=None):
+    """Archived messages older than `before_key` (or the newest), newest first."""
+    found = []
+    for segment in reversed(_archived_segments(channel_id, archived_segments)):
+        if before_key and _key(segment['first']) >= before_key:
+            continue
+        rows = _read_segment(channel_id, segment['file'])
+        for row in reversed(rows):
+            message = _message(row)
+            if before_key and (message.created_at, message.id) >= before_key:
+                continue
+            found.append(message)
+            if len(found) >= limit:
+                return found
+    return found
+
+
+def read_after(channel_id, after_key, limit):
+    """Archived messages newer than `after_key`, oldest first."""
+    found = []
+    for segment in _archived_segments(channel_id):
+        if _key(segment['last']) <= after_key:
+            continue
+        for row in _read_segment(channel_id, segment['file']):
+            message = _message(row)
+            if (message.created_at, message.id) <= after_key:
+                continue
+            found.append(message)
+            if len(found) >= limit:
+                return found
+    return found
+
+
+def remove_channel(channel_id):
+    """Delete every archived segment of a channel."""
+    directory = _channel_dir(channel_id)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        segment_cache.pop(path)
+        os.remove(path)
+    os.rmdir(directory)
@@ -0,0 +1,51 @@
+"""Socket.IO async mode selection and the matching database setup.
+
+SOCKETIO_ASYNC_MODE picks how connections are served:
+
+    threading  one OS thread per connection (the default; works everywhere)
+    eventlet   green threads; thousands of idle sockets per worker
+    gevent     green threads through gevent
+
+Green modes need the standard library monkey-patched before anything else
+is imported: gunicorn's eventlet/gevent workers do it themselves, and
+run.py does it when started directly. Blocking database drivers are then
+made cooperative where possible (psycopg2 through psycogreen, if it is
+installed), and the SQLAlchemy pool is sized so that many green threads
+share DB_POOL_SIZE connections instead of each holding one.
+
+Flask-SocketIO has no asyncio server, so there is no asgi/aiohttp mode;
+green threads are this app's path to high connection counts.
+"""
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+GREEN_MODES = ('eventlet', 'gevent')
+
+
+def check_async_mode(mode):
+    if mode not in ASYNC_MODES:
+        raise ValueError(f'Unsupported SOCKETIO_ASYNC_MODE {mode!r}; use one of {", ".join(ASYNC_MODES)}')
+    return mode
+
+
+def configure_database(app, mode):
+    """Make database access safe for the green modes."""
+    if mode not in GREEN_MODES:
+        return
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    if uri.startswith('postgres'):
+        try:
+            green = importlib.import_module(f'psycogreen.{mode}')
+        except ImportError:
+            logger.warning('psycogreen is not installed; psycopg2 calls will block '
+                           f'the {mode} hub while they wait on the database')
+        else:
+            green.patch_psycopg()
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        options.setdefault('pool_size', app.config.get('DB_POOL_SIZE', 10))
+        options.setdefault('max_overflow', app.config.get('DB_MAX_OVERFLOW', 20))
+        options.setdefault('pool_timeout', app.config.get('DB_POOL_TIMEOUT', 30))
+        options.setdefault('pool_pre_ping', True)
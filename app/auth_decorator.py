@@ -1,5 +1,6 @@
 from functools import wraps
 from flask import request, current_app, jsonify
+from .access_tokens import verify_access_token
 import jwt
 
 def require_auth(f):
@@ -14,10 +15,8 @@ def require_auth(f):
             if scheme.lower() != 'bearer':
                 return jsonify({'error': 'invalid authorization scheme'}), 401
             
-            payload = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=[current_app.config.get('JWT_ALGORITHM', 'HS256')])
-            user_id = payload.get('sub')
-            if not user_id:
-                return jsonify({'error': 'invalid token'}), 401
+            # Verified once, then served from the token cache until expiry
+            user_id = verify_access_token(token)
             
             # Attach user_id to request for the route handler
             request.user_id = user_id
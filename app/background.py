@@ -0,0 +1,90 @@
+"""Process-local background workers for deferred maintenance jobs."""
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTask:
+    """Thread-like handle for a task run by the Socket.IO server's async mode.
+
+    Tasks are started through socketio.start_background_task, so they are
+    OS threads under threading and green threads under eventlet/gevent.
+    """
+
+    def __init__(self, target):
+        from . import socketio
+        self._done = threading.Event()
+        if socketio.server is not None:
+            socketio.start_background_task(self._run, target)
+        else:
+            threading.Thread(target=self._run, args=(target,), daemon=True).start()
+
+    def _run(self, target):
+        try:
+            target()
+        finally:
+            self._done.set()
+
+    def is_alive(self):
+        return not self._done.is_set()
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+
+class BackgroundWorker:
+    """Runs `job()` in an app context until it reports no work left.
+
+    `job` returns a truthy value while it made progress and falsy once it
+    is idle, after which the worker sleeps for `interval` seconds or until
+    kick() is called. Each job invocation should commit its own work so
+    that a restarted process simply resumes where the last one stopped.
+    """
+
+    def __init__(self, name, job, interval=30.0):
+        self.name = name
+        self.job = job
+        self.interval = interval
+        self._app = None
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, app, interval=None):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._app = app
+            if interval is not None:
+                self.interval = interval
+            self._stopping = False
+            self._thread = BackgroundTask(self._run)
+
+    def kick(self):
+        """Wake the worker now instead of at the next interval."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        from . import db
+        while not self._stopping:
+            busy = False
+            with self._app.app_context():
+                try:
+                    busy = self.job()
+                except Exception as e:
+                    logger.error(f'{self.name} failed: {str(e)}')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if not busy:
+                self._wake.wait(self.interval)
+                self._wake.clear()
@@ -0,0 +1,125 @@
+"""Batched room broadcasts for high-volume channels.
+
+With BROADCAST_BATCH_ENABLED, handle_send_message hands each message
+payload to `room_batcher` instead of emitting it on its own. Messages for
+a room are collected and sent as one 'messages' frame ({'messages': [...]},
+oldest first), which is encoded once and delivered once per client. A
+room's batch goes out BROADCAST_BATCH_INTERVAL_MS after its first
+message, or as soon as BROADCAST_BATCH_MAX messages are waiting.
+
+Only rooms busier than BROADCAST_BATCH_MIN_RATE messages/second (5 by
+default) are batched; quieter rooms keep getting one 'message' frame per
+message with no added latency.
+"""
+from . import socketio
+from .background import BackgroundTask
+import atexit
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RoomBatcher:
+
+    def __init__(self, interval=0.02, max_batch=50, min_rate=5, clock=time.monotonic):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.min_rate = min_rate
+        self.clock = clock
+        self.frames = 0
+        self.messages = 0
+        self._buffers = {}
+        self._deadlines = {}
+        self._rates = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def start(self, app):
+        """Start the flusher using `app`'s settings unless it is already running."""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self.interval = app.config.get('BROADCAST_BATCH_INTERVAL_MS', 20) / 1000.0
+            self.max_batch = int(app.config.get('BROADCAST_BATCH_MAX', 50))
+            self.min_rate = float(app.config.get('BROADCAST_BATCH_MIN_RATE', 5))
+            self._stopping = False
+            self._thread = BackgroundTask(self._run)
+
+    def submit(self, room, payload):
+        """Queue `payload` for `room`; False means the room is quiet, emit it directly."""
+        now = self.clock()
+        with self._cond:
+            if not self._hot(room, now) and room not in self._buffers:
+                return False
+            buffer = self._buffers.setdefault(room, [])
+            if not buffer:
+                self._deadlines[room] = now + self.interval
+            buffer.append(payload)
+            if len(buffer) >= self.max_batch:
+                self._deadlines[room] = now
+                self._cond.notify()
+            elif len(self._deadlines) == 1:
+                self._cond.notify()
+            return True
+
+    def _hot(self, room, now):
+        # Messages per one-second window, compared with the previous window
+        window, count, previous = self._rates.get(room, (int(now), 0, 0))
+        if int(now) != window:
+            previous = count if int(now) == window + 1 else 0
+            window, count = int(now), 0
+        count += 1
+        self._rates[room] = (window, count, previous)
+        return max(count, previous) > self.min_rate
+
+    def stop(self):
+        """Send whatever is buffered and stop the background thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _take_due(self):
+        with self._cond:
+            while True:
+                now = self.clock()
+                due = [room for room, deadline in self._deadlines.items()
+                       if deadline <= now or self._stopping]
+                if due or self._stopping:
+                    break
+                timeout = min(self._deadlines.values()) - now if self._deadlines else None
+                self._cond.wait(timeout)
+            batches = []
+            for room in due:
+                del self._deadlines[room]
+                batches.append((room, self._buffers.pop(room)))
+            # Forget rates of rooms that went quiet so the map stays bounded
+            if len(self._rates) > 10000:
+                cutoff = int(now) - 1
+                self._rates = {r: v for r, v in self._rates.items() if v[0] >= cutoff}
+            return batches
+
+    def _run(self):
+        while True:
+            batches = self._take_due()
+            for room, messages in batches:
+                try:
+                    socketio.emit('messages', {'messages': messages}, room=room)
+                except Exception as e:
+                    logger.error(f'Batched broadcast to {room} failed: {str(e)}')
+                self.frames += 1
+                self.messages += len(messages)
+            if not batches and self._stopping:
+                return
+
+    def stats(self):
+        return {'frames': self.frames, 'messages': self.messages, 'rooms_buffered': len(self._buffers)}
+
+
+room_batcher = RoomBatcher()
+atexit.register(room_batcher.stop)
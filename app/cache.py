@@ -0,0 +1,104 @@
+"""Small in-process caches shared by the request and socket paths."""
+from collections import OrderedDict
+import threading
+import time
+
+_MISSING = object()
+
+# All caches created through TTLCache, keyed by name, so they can be
+# configured from app.config and cleared together.
+_caches = {}
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, name, maxsize=1024, ttl=300.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _caches[name] = self
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = int(maxsize)
+            if ttl is not None:
+                self.ttl = float(ttl)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] <= now:
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are cached and fresh."""
+        found = {}
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def configure_caches(config):
+    """Apply <NAME>_CACHE_SIZE / <NAME>_CACHE_TTL settings to every cache."""
+    for name, cache in _caches.items():
+        prefix = name.upper()
+        cache.configure(
+            maxsize=config.get(f'{prefix}_CACHE_SIZE'),
+            ttl=config.get(f'{prefix}_CACHE_TTL'),
+        )
+
+
+def clear_caches():
+    for cache in _caches.values():
+        cache.clear()
+
+
+def cache_stats():
+    """Return {name: stats()} for every registered cache."""
+    return {name: cache.stats() for name, cache in _caches.items()}
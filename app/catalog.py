@@ -0,0 +1,83 @@
+"""Paginated channel listing on top of a cached catalog of public channels.
+
+Every user belongs to every public channel they have not left, so most of
+any listing is the public catalog: the (name, id) of every live public
+channel, sorted. Each worker caches that catalog under the 'channels'
+version counter (app/etags.py). Creating or deleting a channel, or
+renaming it or changing its privacy, bumps the counter in the same
+transaction. The next listing on any worker then misses the cache and
+reloads it once. Joins and leaves leave the counter alone.
+
+A page is ordered by (name, id). With the catalog cached it costs two
+statements however many channels exist, the route's counter read
+(app/etags.py) and the page query below; a cold catalog adds the query
+that loads it. To build the page:
+
+    1. take the next `limit + 1` public channels after the cursor whose
+       name contains `q` from the cached catalog;
+    2. select those channels and the caller's private channels, LEFT
+       JOINed to the caller's membership rows for is_member;
+    3. filter the private channels by cursor and `q`, merge and cut.
+
+Private channels are loaded in full each time. A user only sees the
+private channels they belong to, so that list stays small.
+"""
+from sqlalchemy import and_, or_
+from . import db
+from .cache import TTLCache
+from .models import Channel, ChannelMembership
+from bisect import bisect_right
+
+# ([(name, id)], [casefolded name]) per 'channels' counter value
+catalog_cache = TTLCache('channel_catalog', maxsize=4, ttl=300)
+
+
+def public_catalog(version):
+    """The sorted live public channels as of counter value `version`."""
+    catalog = catalog_cache.get(version)
+    if catalog is None:
+        rows = db.session.query(Channel.name, Channel.id).filter(
+            Channel.deleted_at.is_(None), Channel.is_private.isnot(True)).all()
+        keys = sorted((name, channel_id) for name, channel_id in rows)
+        catalog = (keys, [name.casefold() for name, _ in keys])
+        catalog_cache.set(version, catalog)
+    return catalog
+
+
+def channel_page(user_id, version, users_total, limit, after=None, q=None):
+    """Up to `limit + 1` channel dicts for `user_id` after the (name, id) `after`.
+
+    Each dict is Channel.to_dict(users_total) plus 'is_member'. A result longer than
+    `limit` means there is another page; `limit` None returns every channel.
+    """
+    needle = q.casefold() if q else None
+    keys, folded = public_catalog(version)
+    public_ids = []
+    for index in range(bisect_right(keys, after) if after else 0, len(keys)):
+        if needle is None or needle in folded[index]:
+            public_ids.append(keys[index][1])
+            if limit is not None and len(public_ids) > limit:
+                break
+
+    not_left = or_(ChannelMembership.role.is_(None), ChannelMembership.role != ChannelMembership.ROLE_LEFT)
+    rows = db.session.query(Channel, ChannelMembership.role).outerjoin(
+        ChannelMembership,
+        and_(ChannelMembership.channel_id == Channel.id, ChannelMembership.user_id == user_id),
+    ).filter(Channel.deleted_at.is_(None), or_(
+        and_(Channel.is_private.isnot(True), Channel.id.in_(public_ids)),
+        and_(Channel.is_private.is_(True), ChannelMembership.id.isnot(None), not_left),
+    )).all()
+
+    entries = {}
+    for channel, role in rows:
+        key = (channel.name, channel.id)
+        if channel.is_private and ((after and key <= after) or
+                                   (needle is not None and needle not in channel.name.casefold())):
+            continue
+        is_member = role != ChannelMembership.ROLE_LEFT
+        if key in entries:
+            # More than one membership row; any row that is not 'left' counts
+            is_member = is_member or entries[key]['is_member']
+        entries[key] = dict(channel.to_dict(users_total), is_member=is_member)
+    ordered = sorted(entries)
+    return [entries[key] for key in (ordered if limit is None else ordered[:limit + 1])]
@@ -0,0 +1,99 @@
+"""Maintenance commands, available as `flask <command>`."""
+from datetime import datetime, timedelta
+from flask import current_app
+import click
+from sqlalchemy import func, select
+from . import db
+from .models import Channel, ChannelMembership, Message, User, VersionCounter
+
+
+@click.command('reconcile-member-counts')
+@click.option('--dry-run', is_flag=True, help='Report drift without fixing it.')
+def reconcile_member_counts(dry_run):
+    """Recompute member counts from users and channel_memberships."""
+    def count_rows(*criteria):
+        return (
+            select(func.count(ChannelMembership.id))
+            .where(ChannelMembership.channel_id == Channel.id, *criteria)
+            .correlate(Channel)
+            .scalar_subquery()
+        )
+
+    # Private channels count their members; public ones count who left and
+    # take everyone else from the 'users' counter
+    left = ChannelMembership.role == ChannelMembership.ROLE_LEFT
+    checks = (
+        (Channel.member_count, Channel.is_private.is_(True), count_rows(~left)),
+        (Channel.left_count, Channel.is_private.isnot(True), count_rows(left)),
+    )
+    drifted = 0
+    for column, kind, actual in checks:
+        rows = db.session.query(Channel.id, column, actual).filter(kind, column != actual).all()
+        for channel_id, stored, counted in rows:
+            click.echo(f'{channel_id}: {column.key} {stored} -> {counted}')
+        if rows and not dry_run:
+            Channel.query.filter(Channel.id.in_([row[0] for row in rows])).update(
+                {column: actual}, synchronize_session=False
+            )
+        drifted += len(rows)
+
+    stored_users = VersionCounter.value_of(VersionCounter.USERS)
+    counted_users = User.query.count()
+    if stored_users != counted_users:
+        click.echo(f'users: {stored_users} -> {counted_users}')
+    if not dry_run:
+        if stored_users != counted_users:
+            VersionCounter.add(VersionCounter.USERS, counted_users - stored_users)
+        if drifted:
+            # A bulk UPDATE skips the flush hooks; bump so channel-list ETags change
+            VersionCounter.bump(VersionCounter.CATALOG)
+        db.session.commit()
+    click.echo(f'{drifted} channel(s) {"drifted" if dry_run else "reconciled"}')
+
+
+@click.command('archive-messages')
+@click.option('--older-than-days', type=int, default=None,
+              help='Archive messages older than this (default: ARCHIVE_AFTER_DAYS).')
+@click.option('--channel', 'channel_ids', multiple=True, help='Only archive these channel ids.')
+def archive_messages(older_than_days, channel_ids):
+    """Move old messages into compressed archive segments."""
+    from .archive import archive_channel
+    days = older_than_days if older_than_days is not None else current_app.config.get('ARCHIVE_AFTER_DAYS', 90)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    if not channel_ids:
+        channel_ids = [c for (c,) in db.session.query(Message.channel_id).filter(
+            Message.created_at < cutoff).distinct()]
+    total = 0
+    for channel_id in channel_ids:
+        total += archive_channel(channel_id, cutoff)
+    click.echo(f'Archived {total} message(s) older than {days} day(s) from {len(channel_ids)} channel(s)')
+
+
+@click.command('purge-channels')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction.')
+def purge_channels(batch_size):
+    """Finish purging deleted channels in the foreground."""
+    from .purge import purge_all
+    purge_all(batch_size)
+    click.echo('All deleted channels purged')
+
+
+@click.command('sweep-refresh-tokens')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction.')
+def sweep_refresh_tokens(batch_size):
+    """Delete every expired refresh token."""
+    from .tokens import sweep_step
+    total = 0
+    while True:
+        deleted = sweep_step(batch_size)
+        if not deleted:
+            break
+        total += deleted
+    click.echo(f'Deleted {total} expired refresh token(s)')
+
+
+def register_commands(app):
+    app.cli.add_command(reconcile_member_counts)
+    app.cli.add_command(archive_messages)
+    app.cli.add_command(purge_channels)
+    app.cli.add_command(sweep_refresh_tokens)
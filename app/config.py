@@ -8,5 +8,63 @@ class Config:
     ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
     REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*')
+    # threading, eventlet or gevent (see app/async_mode.py)
+    SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+    # redis://, kafka://, zmq, kombu or local://host:port (see app/socket_queue.py)
     SOCKETIO_MESSAGE_QUEUE_URL = os.getenv('SOCKETIO_MESSAGE_QUEUE_URL', None)
-
+    SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'flask-socketio')
+    # Shared presence store: memory://, redis://... or local://host:port (see app/presence.py)
+    PRESENCE_STORE_URL = os.getenv('PRESENCE_STORE_URL', 'memory://')
+    PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', '90'))
+    PRESENCE_HEARTBEAT_INTERVAL = int(os.getenv('PRESENCE_HEARTBEAT_INTERVAL', '30'))
+    # Typing indicators (see app/typing_indicators.py); 0 relays every event as before
+    TYPING_COALESCE_INTERVAL_MS = int(os.getenv('TYPING_COALESCE_INTERVAL_MS', '0'))
+    TYPING_EXPIRY_SECONDS = int(os.getenv('TYPING_EXPIRY_SECONDS', '5'))
+    # Batched 'messages' frames for busy rooms (see app/broadcast.py)
+    BROADCAST_BATCH_ENABLED = os.getenv('BROADCAST_BATCH_ENABLED', '0') == '1'
+    BROADCAST_BATCH_INTERVAL_MS = int(os.getenv('BROADCAST_BATCH_INTERVAL_MS', '20'))
+    BROADCAST_BATCH_MAX = int(os.getenv('BROADCAST_BATCH_MAX', '50'))
+    BROADCAST_BATCH_MIN_RATE = float(os.getenv('BROADCAST_BATCH_MIN_RATE', '5'))
+    PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '10000'))
+    PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', '300'))
+    MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', '50000'))
+    MEMBERSHIP_CACHE_TTL = int(os.getenv('MEMBERSHIP_CACHE_TTL', '60'))
+    # Encoded message JSON shared by broadcasts and history (see app/serialization.py)
+    MESSAGE_JSON_CACHE_SIZE = int(os.getenv('MESSAGE_JSON_CACHE_SIZE', '20000'))
+    MESSAGE_JSON_CACHE_TTL = int(os.getenv('MESSAGE_JSON_CACHE_TTL', '300'))
+    # Public channel catalog per 'channels' version (see app/catalog.py)
+    CHANNEL_CATALOG_CACHE_TTL = int(os.getenv('CHANNEL_CATALOG_CACHE_TTL', '300'))
+    # Group commit for socket send_message (see app/message_writer.py)
+    GROUP_COMMIT_ENABLED = os.getenv('GROUP_COMMIT_ENABLED', '0') == '1'
+    GROUP_COMMIT_INTERVAL_MS = int(os.getenv('GROUP_COMMIT_INTERVAL_MS', '5'))
+    GROUP_COMMIT_MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', '100'))
+    GROUP_COMMIT_ACK = os.getenv('GROUP_COMMIT_ACK', 'flush')  # 'flush' or 'enqueue'
+    # Seconds a 'flush' ack waits before answering pending instead
+    GROUP_COMMIT_ACK_TIMEOUT = float(os.getenv('GROUP_COMMIT_ACK_TIMEOUT', '5'))
+    # Cold-history archive (see app/archive.py); defaults to <instance>/archive
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', None)
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+    ARCHIVE_SEGMENT_SIZE = int(os.getenv('ARCHIVE_SEGMENT_SIZE', '5000'))
+    # Background purge of deleted channels (see app/purge.py)
+    CHANNEL_PURGE_WORKER = os.getenv('CHANNEL_PURGE_WORKER', '1') == '1'
+    CHANNEL_PURGE_BATCH_SIZE = int(os.getenv('CHANNEL_PURGE_BATCH_SIZE', '1000'))
+    CHANNEL_PURGE_INTERVAL = int(os.getenv('CHANNEL_PURGE_INTERVAL', '30'))
+    # Refresh-token store (see app/tokens.py)
+    REFRESH_TOKENS_PER_USER = int(os.getenv('REFRESH_TOKENS_PER_USER', '10'))
+    REFRESH_TOKEN_SWEEPER = os.getenv('REFRESH_TOKEN_SWEEPER', '1') == '1'
+    REFRESH_TOKEN_SWEEP_INTERVAL = int(os.getenv('REFRESH_TOKEN_SWEEP_INTERVAL', '3600'))
+    REFRESH_TOKEN_SWEEP_BATCH_SIZE = int(os.getenv('REFRESH_TOKEN_SWEEP_BATCH_SIZE', '1000'))
+    # Password hashing pool (see app/passwords.py); 0 workers hashes inline
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', '32'))
+    PASSWORD_HASH_TIMEOUT = int(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+    # Prometheus metrics at /metrics (see app/metrics.py); off unless asked for,
+    # and when METRICS_TOKEN is set scrapers must send it as a Bearer token
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    # Query accounting (see app/querylog.py); 0 turns a check off
+    SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '200'))
+    N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
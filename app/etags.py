@@ -0,0 +1,145 @@
+"""Strong ETags for the channel list and the first page of channel history.
+
+Both endpoints are polled constantly and usually return the same body.
+Each ETag is computed from version data that can be read with a single
+cheap statement, read before the body is built. If the client's
+If-None-Match matches, the route answers 304 without listing channels,
+checking memberships or serializing messages.
+
+    GET /api/channels                  user, query string and the 'catalog'
+                                       and 'users' counters
+    GET /api/channels/<id>/messages    channel, limit, the newest message id
+    (no cursor)                        and the channel's history_version
+
+The catalog counters live in the version_counters table. Bumps are
+collected during the transaction and applied just before it commits
+(below), so every worker sees the same versions and the shared counter
+row is locked only briefly. The 'catalog' counter moves with channel and
+membership rows (checked before each flush, below) and with member
+counts (Channel.adjust_member_count). Public member counts also move with
+the 'users' counter, which signup adds to without touching the catalog. The 'channels' counter, which keys
+the cached public catalog in app/catalog.py, moves only when a channel
+is created or deleted or its name or privacy changes, so joins and
+leaves do not invalidate that cache. Each counter is bumped at most once
+per transaction. Bulk UPDATE/DELETE statements skip the flush hooks, so
+code that changes these rows in bulk calls VersionCounter.bump itself
+(see reconcile-member-counts).
+
+Channel.history_version moves with message updates and deletes in that
+channel and with renames of authors who posted there, so an edit
+invalidates only its own channel's ETag. A new message changes the
+newest message id instead.
+"""
+from flask import current_app, request
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.orm import Session
+from . import db
+from .models import Channel, ChannelMembership, Message, User, VersionCounter
+import hashlib
+
+
+def _etag(*parts):
+    return hashlib.sha256('\x1f'.join(str(p) for p in parts).encode()).hexdigest()[:32]
+
+
+def _counter(name):
+    return select(VersionCounter.value).where(VersionCounter.name == name).scalar_subquery()
+
+
+def catalog_versions():
+    """(catalog, channels, users) counter values, read in one statement."""
+    values = db.session.execute(select(
+        _counter(VersionCounter.CATALOG), _counter(VersionCounter.CHANNELS), _counter(VersionCounter.USERS),
+    )).one()
+    return tuple(value or 0 for value in values)
+
+
+def catalog_etag(user_id, version, users_total):
+    return _etag('channels', user_id, version, users_total, request.query_string.decode())
+
+
+def history_etag(channel_id, limit):
+    """(ETag, Channel.archived_segments) for the newest history page.
+
+    The segment count rides along in the same statement so that page can
+    skip app/archive.py's own lookup.
+    """
+    newest = (select(Message.id)
+              .where(Message.channel_id == channel_id, Message.is_deleted.is_(False))
+              .order_by(Message.created_at.desc(), Message.id.desc())
+              .limit(1).scalar_subquery())
+    version = select(Channel.history_version).where(Channel.id == channel_id).scalar_subquery()
+    archived = select(Channel.archived_segments).where(Channel.id == channel_id).scalar_subquery()
+    newest_id, version, archived = db.session.execute(select(newest, version, archived)).one()
+    return _etag('history', channel_id, limit, newest_id, version or 0), archived or 0
+
+
+def not_modified(etag):
+    """A 304 response if the request's If-None-Match matches `etag`, else None."""
+    if not request.if_none_match.contains(etag):
+        return None
+    return tag_response(current_app.response_class(status=304), etag)
+
+
+def tag_response(response, etag):
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate before reusing it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_versions(session, flush_context, instances):
+    changed = [o for o in session.dirty if session.is_modified(o)] + list(session.deleted)
+    if any(isinstance(o, (Channel, ChannelMembership)) for o in list(session.new) + changed):
+        VersionCounter.bump(VersionCounter.CATALOG, session)
+    if any(isinstance(o, Channel) and _listing_changed(session, o) for o in list(session.new) + changed):
+        VersionCounter.bump(VersionCounter.CHANNELS, session)
+    # New messages change the newest message id; edits, deletes and author renames bump
+    bumped = _bumped_this_transaction(session)
+    channel_ids = {o.channel_id for o in changed if isinstance(o, Message)} - bumped
+    if channel_ids:
+        bumped.update(channel_ids)
+        session.execute(_history_bump(Channel.id.in_(sorted(channel_ids))))
+    for user in changed:
+        if isinstance(user, User) and _renamed_or_deleted(session, user):
+            posted_in = select(Message.channel_id).where(Message.user_id == user.id).distinct()
+            session.execute(_history_bump(Channel.id.in_(posted_in)))
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_version_bumps(session):
+    # Flush first: the flush hooks above may still add bumps
+    session.flush()
+    VersionCounter.apply_bumps(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_version_bumps(session):
+    session.info.pop('version_bumps', None)
+    session.info.pop('history_bumped', None)
+
+
+def _history_bump(criterion):
+    return (update(Channel.__table__).where(criterion)
+            .values(history_version=Channel.__table__.c.history_version + 1))
+
+
+def _bumped_this_transaction(session):
+    transaction = session.get_transaction()
+    entry = session.info.get('history_bumped')
+    if entry is None or entry[0] is not transaction:
+        entry = session.info['history_bumped'] = (transaction, set())
+    return entry[1]
+
+
+def _renamed_or_deleted(session, user):
+    return user in session.deleted or inspect(user).attrs.display_name.history.has_changes()
+
+
+def _listing_changed(session, channel):
+    if channel in session.new or channel in session.deleted:
+        return True
+    attrs = inspect(channel).attrs
+    return any(attrs[name].history.has_changes() for name in ('name', 'is_private', 'deleted_at'))
@@ -0,0 +1,60 @@
+"""In-process index of which channels each user belongs to.
+
+A user belongs to every public channel they have not left, plus every
+private channel they have a membership row for (see ChannelMembership).
+Only a user's explicit rows are cached, as {channel_id: role} with 'left'
+included, so an entry's size follows the user's own rows rather than the
+number of public channels. Writers in routes/channels.py invalidate the
+affected users; the TTL bounds how long another worker process can serve
+a stale role.
+
+Whether the channel exists, is live and is private is read fresh on every
+check (one primary-key lookup), so a deleted channel is hidden from every
+worker as soon as delete_channel commits.
+"""
+from sqlalchemy import and_, or_
+from . import db
+from .cache import TTLCache
+from .models import Channel, ChannelMembership
+
+membership_cache = TTLCache('membership', maxsize=50000, ttl=60)
+
+
+def roles_for(user_id):
+    """{channel_id: role} for every membership row of `user_id`."""
+    roles = membership_cache.get(user_id)
+    if roles is None:
+        rows = db.session.query(ChannelMembership.channel_id, ChannelMembership.role).filter(
+            ChannelMembership.user_id == user_id).all()
+        roles = dict(rows)
+        membership_cache.set(user_id, roles)
+    return roles
+
+
+def member_clause():
+    """SQL condition for "the joined membership row makes this a member".
+
+    Expects channels LEFT OUTER JOIN channel_memberships for a single user.
+    """
+    not_left = or_(ChannelMembership.role.is_(None), ChannelMembership.role != ChannelMembership.ROLE_LEFT)
+    return or_(
+        and_(Channel.is_private.isnot(True), not_left),
+        and_(Channel.is_private.is_(True), ChannelMembership.id.isnot(None), not_left),
+    )
+
+
+def is_member(user_id, channel_id):
+    if not user_id or not channel_id:
+        return False
+    live = db.session.query(Channel.is_private).filter(
+        Channel.id == channel_id, Channel.deleted_at.is_(None)).first()
+    if live is None:
+        return False
+    role = roles_for(user_id).get(channel_id)
+    if live.is_private and role is None:
+        return False
+    return role != ChannelMembership.ROLE_LEFT
+
+
+def invalidate_user(user_id):
+    membership_cache.pop(user_id)
@@ -0,0 +1,161 @@
+"""Group-commit write path for socket messages.
+
+When GROUP_COMMIT_ENABLED is set, handle_send_message hands fully formed
+message rows (id and created_at already assigned) to `message_writer`
+instead of committing them one by one. A background thread flushes the
+queue as a single multi-row INSERT every GROUP_COMMIT_INTERVAL_MS or as
+soon as GROUP_COMMIT_MAX_BATCH rows are waiting.
+
+GROUP_COMMIT_ACK controls durability: 'flush' (default) makes the sender
+wait until its batch has committed before the message is broadcast and
+acked; 'enqueue' acks immediately and accepts losing the unflushed tail
+if the process dies. A 'flush' sender that waits longer than
+GROUP_COMMIT_ACK_TIMEOUT is acked with `pending: true` instead; the row
+stays queued and is broadcast once its batch commits, so a client never
+retries a message that is about to be saved.
+"""
+from sqlalchemy import insert
+from . import db, search
+from .background import BackgroundTask
+from .models import Message
+import atexit
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PendingWrite:
+    """Handle returned by submit(); wait() blocks until the row is durable."""
+
+    def __init__(self, row):
+        self.row = row
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def resolve(self, error=None):
+        with self._lock:
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(error)
+            except Exception as e:
+                logger.error(f'Group commit callback failed: {str(e)}')
+
+    def on_done(self, callback):
+        """Call `callback(error)` once the write resolves (now, if it already has)."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self.error)
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError('message was not flushed in time')
+        if self.error is not None:
+            raise self.error
+        return self.row
+
+
+class GroupCommitWriter:
+    def __init__(self, interval=0.005, max_batch=100):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.batches = 0
+        self.rows_written = 0
+        self._app = None
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def start(self, app):
+        """Start the flusher for `app` unless it is already running."""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._app = app
+            self.interval = app.config.get('GROUP_COMMIT_INTERVAL_MS', 5) / 1000.0
+            self.max_batch = int(app.config.get('GROUP_COMMIT_MAX_BATCH', 100))
+            self._stopping = False
+            self._thread = BackgroundTask(self._run)
+
+    def submit(self, row):
+        pending = PendingWrite(row)
+        with self._cond:
+            self._pending.append(pending)
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        return pending
+
+    def stop(self):
+        """Flush whatever is queued and stop the background thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _take_batch(self):
+        with self._cond:
+            deadline = time.monotonic() + self.interval
+            while len(self._pending) < self.max_batch and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopping:
+                return
+
+    def _flush(self, batch):
+        with self._app.app_context():
+            try:
+                try:
+                    self._insert([p.row for p in batch])
+                    errors = [None] * len(batch)
+                except Exception as e:
+                    # Retry row by row so one bad message does not fail its whole batch
+                    logger.warning(f'Group commit of {len(batch)} messages failed, '
+                                   f'retrying one at a time: {str(e)}')
+                    db.session.rollback()
+                    errors = [self._insert_one(p.row) for p in batch]
+            finally:
+                db.session.remove()
+        self.batches += 1
+        self.rows_written += errors.count(None)
+        for pending, error in zip(batch, errors):
+            pending.resolve(error)
+
+    def _insert(self, rows):
+        db.session.execute(insert(Message), rows)
+        # Bulk inserts skip the ORM hooks that maintain the search index
+        search.index_rows(db.session.connection(), rows)
+        db.session.commit()
+
+    def _insert_one(self, row):
+        try:
+            self._insert([row])
+        except Exception as e:
+            logger.error(f'Group commit of message {row["id"]} failed: {str(e)}')
+            db.session.rollback()
+            return e
+        return None
+
+message_writer = GroupCommitWriter()
+atexit.register(message_writer.stop)
@@ -0,0 +1,277 @@
+"""Process metrics in the Prometheus text format, served at /metrics.
+
+Recorded as they happen:
+
+    http_request_duration_seconds    per endpoint, method and status
+    http_request_queries             SQL statements per request, per endpoint
+    socketio_event_duration_seconds  per event name (handlers use @timed_event)
+    socketio_event_queries           SQL statements per socket event
+    socketio_event_errors_total      handlers that raised
+    db_pool_checkout_seconds         time to get a connection from the pool
+
+Read when scraped: connected sockets, joined rooms and the distribution
+of room sizes (this worker's sockets; see app/presence.py), cache sizes
+and hit counts, typing and broadcast-batching counters.
+
+Recording a sample is a bisect and three additions under the metric's
+lock. Every worker process keeps its own numbers, so scrape each worker
+or add them up in the dashboard. Recording and the endpoint are off
+unless METRICS_ENABLED=1. The endpoint has no user auth, so either keep it
+off the public listener or set METRICS_TOKEN and have the scraper send
+`Authorization: Bearer <token>`.
+"""
+from flask import current_app, g, request
+from . import querylog
+from bisect import bisect_left
+from functools import wraps
+import hmac
+import threading
+import time
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000, 5000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in sorted(self._series.items())]
+        for key, counts, total, count in series:
+            running = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                running += n
+                le = 'le="%s"' % (bound if bound == '+Inf' else _number(bound))
+                lines.append(f'{self.name}_bucket{_labels(self.labels, key, le)} {running}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f'{self.name}{_labels(self.labels, k)} {v}' for k, v in values)
+        return lines
+
+
+http_latency = Histogram('http_request_duration_seconds', 'HTTP request latency.',
+                         ('endpoint', 'method', 'status'))
+http_queries = Histogram('http_request_queries', 'SQL statements executed per HTTP request.',
+                         ('endpoint',), COUNT_BUCKETS)
+event_latency = Histogram('socketio_event_duration_seconds', 'Socket.IO event handler latency.',
+                          ('event',))
+event_queries = Histogram('socketio_event_queries', 'SQL statements executed per Socket.IO event.',
+                          ('event',), COUNT_BUCKETS)
+event_errors = Counter('socketio_event_errors_total', 'Socket.IO event handlers that raised.',
+                       ('event',))
+pool_checkout = Histogram('db_pool_checkout_seconds',
+                          'Time to check a connection out of the SQLAlchemy pool.')
+_recorded = (http_latency, http_queries, event_latency, event_queries, event_errors, pool_checkout)
+
+_enabled = False
+
+
+def _single(name, help, value, kind='gauge'):
+    return [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {_number(value)}']
+
+
+def _labelled_gauge(name, help, label, values):
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+    lines.extend(f'{name}{_labels((label,), (k,))} {_number(v)}' for k, v in sorted(values.items()))
+    return lines
+
+
+def _room_sizes():
+    from .presence import presence
+    sizes = Histogram('socketio_room_size', 'Sockets joined per room on this worker.',
+                      buckets=SIZE_BUCKETS)
+    for size in presence.room_sizes():
+        sizes.observe(size)
+    return sizes.render()
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    from .presence import presence
+    from .cache import cache_stats
+    from .typing_indicators import typing_state
+    from .broadcast import room_batcher
+
+    lines = []
+    for metric in _recorded:
+        lines.extend(metric.render())
+    lines.extend(_single('socketio_connected_sockets', 'Sockets connected to this worker.',
+                         presence.socket_count()))
+    lines.extend(_single('socketio_rooms', 'Channel rooms with a socket on this worker.',
+                         presence.channel_count()))
+    lines.extend(_room_sizes())
+    caches = cache_stats()
+    lines.extend(_labelled_gauge('cache_entries', 'Entries held per in-process cache.', 'cache',
+                                 {n: s['size'] for n, s in caches.items()}))
+    for field, outcome in (('hits', 'found'), ('misses', 'missed')):
+        name = f'cache_{field}_total'
+        lines.extend([f'# HELP {name} Lookups per in-process cache that {outcome} an entry.',
+                      f'# TYPE {name} counter'])
+        lines.extend(f'{name}{_labels(("cache",), (n,))} {s[field]}' for n, s in sorted(caches.items()))
+    typing = typing_state.stats()
+    lines.extend(_single('typing_updates_received_total', 'Typing events received.',
+                         typing['inbound'], 'counter'))
+    lines.extend(_single('typing_frames_sent_total', 'Coalesced typing frames sent.',
+                         typing['outbound'], 'counter'))
+    batches = room_batcher.stats()
+    lines.extend(_single('broadcast_batch_frames_total', 'Batched message frames sent.',
+                         batches['frames'], 'counter'))
+    lines.extend(_single('broadcast_batch_messages_total', 'Messages sent in batched frames.',
+                         batches['messages'], 'counter'))
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    for metric in _recorded:
+        metric.clear()
+
+
+def _start_request():
+    g._metrics_start = time.perf_counter()
+
+
+def _finish_request(response):
+    started = g.pop('_metrics_start', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        http_latency.observe(time.perf_counter() - started, endpoint, request.method, str(response.status_code))
+        log = g.get('querylog')
+        http_queries.observe(len(log) if log is not None else 0, endpoint)
+    return response
+
+
+def timed_event(name):
+    """Record latency, queries and errors of a Socket.IO handler as event `name`.
+
+    The handler also runs in its own querylog scope, so N+1 patterns in
+    socket events are reported like those in HTTP requests.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            log = querylog.begin(f'event {name}')
+            started = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                if _enabled:
+                    event_errors.inc(name)
+                raise
+            finally:
+                querylog.end(log)
+                if _enabled:
+                    event_latency.observe(time.perf_counter() - started, name)
+                    event_queries.observe(len(log), name)
+        return wrapper
+    return decorator
+
+
+def _time_checkouts(engine):
+    raw_connection = engine.raw_connection
+
+    @wraps(raw_connection)
+    def timed_raw_connection(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            pool_checkout.observe(time.perf_counter() - started)
+
+    engine.raw_connection = timed_raw_connection
+    engine._metrics_timed = True
+
+
+def init_metrics(app, db):
+    """Install the request hooks and pool instrumentation for `app`.
+
+    Query counts come from the request's querylog scope, so init_querylog
+    must have run first.
+    """
+    global _enabled
+    if not app.config.get('METRICS_ENABLED', False):
+        return
+    _enabled = True
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            if not getattr(engine, '_metrics_timed', False):
+                _time_checkouts(engine)
+
+
+def metrics_enabled():
+    return current_app.config.get('METRICS_ENABLED', False)
+
+
+def scrape_allowed(authorization):
+    """True if `authorization` carries METRICS_TOKEN, or no token is configured."""
+    token = current_app.config.get('METRICS_TOKEN')
+    return not token or hmac.compare_digest(authorization or '', f'Bearer {token}')
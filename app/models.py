@@ -1,5 +1,10 @@
 from . import db
 from datetime import datetime
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql, sqlite
+import os
+import threading
+import time
 import uuid
 
 
@@ -7,6 +12,38 @@ def gen_uuid():
     return str(uuid.uuid4())
 
 
+_uuid7_lock = threading.Lock()
+_uuid7_last = [0, 0]  # [unix_ms, counter] of the last id handed out
+
+
+def gen_uuid7():
+    """Time-ordered UUIDv7 string (RFC 9562).
+
+    The 48-bit millisecond timestamp leads, and the 12-bit rand_a field is
+    used as a counter so ids generated in the same millisecond by this
+    process still sort in creation order. The canonical string form sorts
+    the same way as the underlying bytes.
+    """
+    with _uuid7_lock:
+        now_ms = time.time_ns() // 1_000_000
+        last_ms, counter = _uuid7_last
+        if now_ms <= last_ms:
+            now_ms, counter = last_ms, counter + 1
+            if counter > 0xFFF:
+                now_ms, counter = last_ms + 1, 0
+        else:
+            counter = int.from_bytes(os.urandom(2), 'big') & 0x3FF
+        _uuid7_last[:] = [now_ms, counter]
+    rand_b = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    value = (now_ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | rand_b
+    return str(uuid.UUID(int=value))
+
+
+# Primary keys of the high-insert tables. Nothing references them by
+# foreign key, so on Postgres they are stored as native 16-byte uuids.
+OrderedId = db.String(36).with_variant(postgresql.UUID(as_uuid=False), 'postgresql')
+
+
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
@@ -26,24 +63,86 @@ class Channel(db.Model):
     is_private = db.Column(db.Boolean, default=False)
     owner_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Maintained alongside channel_memberships writes; see reconcile-member-counts.
+    # Private channels count their members. Every user belongs to a public
+    # channel unless they left it, so public channels count departures in
+    # left_count and take the user total from the 'users' counter.
+    member_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    left_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Set by delete_channel; the row lingers until app/purge.py removes it
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    # Moves with message edits/deletes and author renames (app/etags.py)
+    history_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Archive segments whose rows have left the messages table (app/archive.py)
+    archived_segments = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
-    def to_dict(self):
-        member_count = ChannelMembership.query.filter_by(channel_id=self.id).count()
-        return {"id": self.id, "name": self.name, "is_private": self.is_private, "owner_id": self.owner_id, "member_count": member_count}
+    @classmethod
+    def get_live(cls, channel_id):
+        """Return the channel unless it does not exist or is being deleted."""
+        return cls.query.filter_by(id=channel_id, deleted_at=None).first()
+
+    @classmethod
+    def adjust_member_count(cls, delta, *criteria, **filters):
+        """Atomically add `delta` members to the matching channels.
+
+        Runs in the caller's transaction so the counter commits together
+        with the membership rows it describes.
+        """
+        VersionCounter.bump(VersionCounter.CATALOG)
+        private = cls.is_private.is_(True)
+        return cls.query.filter(*criteria).filter_by(**filters).update({
+            cls.member_count: case((private, cls.member_count + delta), else_=cls.member_count),
+            cls.left_count: case((private, cls.left_count), else_=cls.left_count - delta),
+        }, synchronize_session=False)
+
+    def members(self, users_total=None):
+        """Member count; public channels need the 'users' counter value."""
+        if self.is_private:
+            return self.member_count
+        if users_total is None:
+            users_total = VersionCounter.value_of(VersionCounter.USERS)
+        return users_total - self.left_count
+
+    def to_dict(self, users_total=None):
+        return {"id": self.id, "name": self.name, "is_private": self.is_private, "owner_id": self.owner_id, "member_count": self.members(users_total)}
 
 
 class ChannelMembership(db.Model):
+    """Explicit membership state.
+
+    Every user is implicitly a member of every public channel, so rows only
+    exist for private channels, non-default roles (e.g. 'owner'), and users
+    who left a public channel (role ROLE_LEFT). A user has at most one row
+    per channel.
+    """
     __tablename__ = 'channel_memberships'
-    id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
+    __table_args__ = (
+        db.Index('ix_channel_memberships_user_channel', 'user_id', 'channel_id', unique=True),
+    )
+    ROLE_LEFT = 'left'
+
+    id = db.Column(OrderedId, primary_key=True, default=gen_uuid7)
     channel_id = db.Column(db.String(36), db.ForeignKey('channels.id', ondelete='CASCADE'), nullable=False)
     user_id = db.Column(db.String(36), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     role = db.Column(db.String(50), default='member')
     joined_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    @classmethod
+    def insert_if_absent(cls, **values):
+        """INSERT a row unless the user already has one for the channel; returns rows written."""
+        dialect = postgresql if db.session.connection().dialect.name == 'postgresql' else sqlite
+        stmt = dialect.insert(cls).values(**values).on_conflict_do_nothing(
+            index_elements=['channel_id', 'user_id'])
+        return db.session.execute(stmt).rowcount
+
 
 class Message(db.Model):
     __tablename__ = 'messages'
-    id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
+    __table_args__ = (
+        # Serves the keyset-paginated history query in routes/messages.py
+        db.Index('ix_messages_channel_history', 'channel_id', 'is_deleted', 'created_at', 'id'),
+    )
+    id = db.Column(OrderedId, primary_key=True, default=gen_uuid7)
     channel_id = db.Column(db.String(36), db.ForeignKey('channels.id', ondelete='CASCADE'), nullable=False)
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=True)
     content = db.Column(db.Text, nullable=False)
@@ -52,16 +151,17 @@ class Message(db.Model):
     is_deleted = db.Column(db.Boolean, default=False)
 
     def to_dict(self, user=None):
+        """Serialize the message; `user` may be a User or a cached profile dict."""
         user_obj = None
-        if user:
+        if isinstance(user, dict):
+            user_obj = user
+        elif user:
             user_obj = {'id': user.id, 'display_name': user.display_name}
         elif self.user_id:
-            # Lazy load user if not provided
-            from . import db as database
-            user = database.session.query(User).get(self.user_id)
-            if user:
-                user_obj = {'id': user.id, 'display_name': user.display_name}
-        
+            # Fall back to the shared profile cache if no author was provided
+            from .profiles import get_profile
+            user_obj = get_profile(self.user_id)
+
         return {
             'id': self.id,
             'channel_id': self.channel_id,
@@ -74,10 +174,73 @@ class Message(db.Model):
         }
 
 
+class ChannelPurge(db.Model):
+    """Progress of the background purge of a deleted channel."""
+    __tablename__ = 'channel_purges'
+    channel_id = db.Column(db.String(36), primary_key=True)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    messages_purged = db.Column(db.Integer, nullable=False, default=0)
+    memberships_purged = db.Column(db.Integer, nullable=False, default=0)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+
 class RefreshToken(db.Model):
     __tablename__ = 'refresh_tokens'
-    id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
-    token_hash = db.Column(db.String(255), nullable=False)
-    expires_at = db.Column(db.DateTime, nullable=True)
+    id = db.Column(OrderedId, primary_key=True, default=gen_uuid7)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    token_hash = db.Column(db.String(255), nullable=False, unique=True, index=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Tokens rotated from the same login share a family (see app/tokens.py)
+    family_id = db.Column(db.String(36), nullable=True, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+
+
+class VersionCounter(db.Model):
+    """Named counters changed in the same transaction as the data they describe.
+
+    'catalog' covers channels, memberships and member counts; 'channels'
+    only the set of live public channels and their names (app/catalog.py).
+    Message history is versioned per channel by Channel.history_version.
+    See app/etags.py. 'users' is the number of users, which every public
+    channel's member count starts from.
+    """
+    __tablename__ = 'version_counters'
+    CATALOG = 'catalog'
+    CHANNELS = 'channels'
+    USERS = 'users'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, name, session=None):
+        """Increment counter `name` once, as the current transaction of `session` commits.
+
+        The UPDATE is issued by app/etags.py right before COMMIT, so the
+        counter row stays locked only while the transaction finishes.
+        """
+        cls._pending(session).setdefault(name, 1)
+
+    @classmethod
+    def add(cls, name, delta, session=None):
+        """Add `delta` to counter `name` as the transaction commits; unlike bump, adds accumulate."""
+        pending = cls._pending(session)
+        pending[name] = pending.get(name, 0) + delta
+
+    @classmethod
+    def _pending(cls, session):
+        session = session or db.session()
+        return session.info.setdefault('version_bumps', {})
+
+    @classmethod
+    def apply_bumps(cls, session):
+        table = cls.__table__
+        for name, delta in sorted(session.info.pop('version_bumps', {}).items()):
+            result = session.execute(table.update().where(table.c.name == name).values(value=table.c.value + delta))
+            if result.rowcount == 0:
+                session.execute(table.insert().values(name=name, value=delta))
+
+    @classmethod
+    def value_of(cls, name):
+        return db.session.query(cls.value).filter_by(name=name).scalar() or 0
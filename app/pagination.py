@@ -0,0 +1,80 @@
+"""Opaque keyset cursors shared by the paginated endpoints.
+
+Decoded ids are validated as UUIDs here, because a malformed id bound
+into a native uuid column makes Postgres reject the whole query.
+"""
+from datetime import datetime
+import base64
+import uuid
+
+# Sorts before every real id, so (ts, NIL_ID) positions at the start of ts
+NIL_ID = str(uuid.UUID(int=0))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _row_id(value):
+    return str(uuid.UUID(value))
+
+
+def encode_cursor(created_at, row_id):
+    """Encode a (created_at, id) position as an opaque URL-safe token."""
+    raw = f'{created_at.isoformat()}|{row_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token produced by encode_cursor into (created_at, id).
+
+    Bare ISO timestamps (the format `before` used to take) are still
+    accepted; they position the cursor before every message sharing that
+    timestamp (the id is NIL_ID).
+    """
+    if not token:
+        raise InvalidCursor('empty cursor')
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        ts, row_id = raw.split('|', 1)
+        return datetime.fromisoformat(ts), _row_id(row_id)
+    except Exception:
+        pass
+    try:
+        return datetime.fromisoformat(token), NIL_ID
+    except Exception:
+        raise InvalidCursor(f'malformed cursor: {token!r}')
+
+
+def encode_rank_cursor(rank, row_id):
+    """Encode a (rank, id) search position as an opaque token."""
+    raw = f'{rank!r}|{row_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_rank_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        rank, row_id = raw.split('|', 1)
+        return float(rank), _row_id(row_id)
+    except Exception:
+        raise InvalidCursor(f'malformed cursor: {token!r}')
+
+
+def encode_name_cursor(name, row_id):
+    """Encode a (name, id) listing position as an opaque token."""
+    raw = f'{name}|{row_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_name_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        # Names may contain '|'; ids never do
+        name, row_id = raw.rsplit('|', 1)
+        return name, row_id
+    except Exception:
+        raise InvalidCursor(f'malformed cursor: {token!r}')
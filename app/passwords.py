@@ -0,0 +1,136 @@
+"""Password hashing on a bounded process pool.
+
+bcrypt is deliberately slow, and running it inline pins the request
+worker (and, under eventlet, the whole hub) for the duration of every
+signup and login. Hashes are computed on a dedicated pool of
+PASSWORD_HASH_WORKERS processes instead. At most PASSWORD_HASH_QUEUE_LIMIT
+requests may be queued or running on it; beyond that HashingBusy is raised
+straight away so the route can answer 503 rather than queue indefinitely.
+A request that waits longer than PASSWORD_HASH_TIMEOUT also gets
+HashingBusy, but its job keeps its slot until the pool has run it, so
+abandoned jobs still count against the limit.
+PASSWORD_HASH_WORKERS = 0 hashes inline. Under the eventlet/gevent
+async modes the hashing runs on the hub's OS thread pool instead of
+processes, with the same admission limit.
+
+BCRYPT_ROUNDS sets the cost for new hashes; verify_password's callers use
+needs_rehash to upgrade stored hashes on the next successful login.
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+import multiprocessing
+import threading
+import bcrypt as _bcrypt_lib
+
+
+class HashingBusy(Exception):
+    """The hashing pool and its queue are full."""
+
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+def _truncate(password):
+    # bcrypt only looks at the first 72 bytes; never hand it more
+    return password.encode('utf-8')[:72]
+
+
+def _hashpw(password_bytes, rounds):
+    return _bcrypt_lib.hashpw(password_bytes, _bcrypt_lib.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password_bytes, stored):
+    return _bcrypt_lib.checkpw(password_bytes, stored)
+
+
+def _get_pool(config):
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            workers = config.get('PASSWORD_HASH_WORKERS', 2)
+            # spawn, not fork: the parent runs threads (socket.io, workers)
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            _slots = threading.BoundedSemaphore(workers + config.get('PASSWORD_HASH_QUEUE_LIMIT', 32))
+        return _pool, _slots
+
+
+def _run(fn, *args):
+    config = current_app.config
+    if not config.get('PASSWORD_HASH_WORKERS', 2):
+        return fn(*args)
+    pool, slots = _get_pool(config)
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    mode = config.get('SOCKETIO_ASYNC_MODE', 'threading')
+    if mode != 'threading':
+        # Executor futures do not cooperate with a monkey-patched hub;
+        # bcrypt releases the GIL, so the hub's OS threads run in parallel
+        try:
+            return _call_in_os_thread(mode, fn, *args)
+        finally:
+            slots.release()
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        slots.release()
+        _discard_pool(pool)
+        raise HashingBusy()
+    # The slot is freed when the job finishes (or is cancelled), not when
+    # this caller stops waiting for it
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=config.get('PASSWORD_HASH_TIMEOUT', 10))
+    except FutureTimeout:
+        raise HashingBusy()
+    except BrokenProcessPool:
+        # A dead worker breaks the executor for good; start a fresh one
+        # for the next caller and report this one as busy
+        _discard_pool(pool)
+        raise HashingBusy()
+
+
+def _call_in_os_thread(mode, fn, *args):
+    if mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    import gevent
+    return gevent.get_hub().threadpool.apply(fn, args)
+
+
+def hash_password(password):
+    return _run(_hashpw, _truncate(password), current_app.config.get('BCRYPT_ROUNDS', 12))
+
+
+def verify_password(password, stored):
+    if isinstance(stored, str):
+        stored = stored.encode('utf-8')
+    return _run(_checkpw, _truncate(password), stored)
+
+
+def needs_rehash(stored):
+    """True if `stored` was hashed with a different cost than BCRYPT_ROUNDS."""
+    try:
+        rounds = int(stored.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != current_app.config.get('BCRYPT_ROUNDS', 12)
+
+
+def _discard_pool(pool):
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is pool:
+            _pool = _slots = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = _slots = None
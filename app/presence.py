@@ -0,0 +1,281 @@
+"""Presence: which sockets are connected and who is online in each channel.
+
+PresenceRegistry indexes this worker's own sockets. Three indexes are
+kept in step under one lock: sid -> (user, channels), user -> sids and
+channel -> {user: refcount}. A user is present in a channel while at
+least one of their sockets has joined it, so a second tab or device
+neither overwrites nor ends the first one's presence. join, leave and
+disconnect touch only the channels of the socket involved.
+
+Channel online lists come from a presence store shared by all workers,
+picked by PRESENCE_STORE_URL:
+
+    memory://          this process only (the default)
+    redis://...        a Redis server; needs the `redis` package
+    local://host:port  the LocalBroker from app/socket_queue.py
+
+Each socket's entry in a channel lives for PRESENCE_TTL seconds. The
+worker holding the socket renews the entries of all its connected
+sockets every PRESENCE_HEARTBEAT_INTERVAL seconds, and a client's
+'heartbeat' event renews its own entries early. Clients need not send
+heartbeats; only the sockets of a crashed worker drop out by themselves.
+"""
+from flask import current_app
+from .background import BackgroundWorker
+from urllib.parse import urlparse
+import json
+import socket
+import threading
+import time
+
+
+class PresenceRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sid_user = {}
+        self._sid_channels = {}
+        self._user_sids = {}
+        self._channel_users = {}
+
+    def connect(self, sid, user_id):
+        with self._lock:
+            self._sid_user[sid] = user_id
+            self._sid_channels.setdefault(sid, set())
+            self._user_sids.setdefault(user_id, set()).add(sid)
+
+    def user_for(self, sid):
+        return self._sid_user.get(sid)
+
+    def join(self, sid, channel_id):
+        """Record `sid` joining `channel_id`; True if its user just came online there."""
+        with self._lock:
+            user_id = self._sid_user.get(sid)
+            channels = self._sid_channels.get(sid)
+            if user_id is None or channel_id in channels:
+                return False
+            channels.add(channel_id)
+            users = self._channel_users.setdefault(channel_id, {})
+            users[user_id] = users.get(user_id, 0) + 1
+            return users[user_id] == 1
+
+    def leave(self, sid, channel_id):
+        """Record `sid` leaving `channel_id`; True if its user is now gone from it."""
+        with self._lock:
+            return self._leave(sid, channel_id)
+
+    def disconnect(self, sid):
+        """Forget `sid`; returns (user_id, channels its user is now gone from)."""
+        with self._lock:
+            user_id = self._sid_user.pop(sid, None)
+            if user_id is None:
+                return None, []
+            gone = [c for c in list(self._sid_channels.get(sid, ())) if self._leave(sid, c, user_id)]
+            del self._sid_channels[sid]
+            sids = self._user_sids[user_id]
+            sids.discard(sid)
+            if not sids:
+                del self._user_sids[user_id]
+            return user_id, gone
+
+    def _leave(self, sid, channel_id, user_id=None):
+        user_id = user_id or self._sid_user.get(sid)
+        channels = self._sid_channels.get(sid)
+        if user_id is None or not channels or channel_id not in channels:
+            return False
+        channels.discard(channel_id)
+        users = self._channel_users[channel_id]
+        users[user_id] -= 1
+        if users[user_id]:
+            return False
+        del users[user_id]
+        if not users:
+            del self._channel_users[channel_id]
+        return True
+
+    def online_users(self, channel_id):
+        with self._lock:
+            return list(self._channel_users.get(channel_id, ()))
+
+    def channels_for(self, sid):
+        with self._lock:
+            return set(self._sid_channels.get(sid, ()))
+
+    def sids_for(self, user_id):
+        with self._lock:
+            return set(self._user_sids.get(user_id, ()))
+
+    def is_online(self, user_id):
+        return user_id in self._user_sids
+
+    def socket_count(self):
+        return len(self._sid_user)
+
+    def channel_count(self):
+        return len(self._channel_users)
+
+    def joined(self):
+        """[(sid, user_id, channels)] for every socket that has joined a channel."""
+        with self._lock:
+            return [(sid, self._sid_user[sid], set(channels))
+                    for sid, channels in self._sid_channels.items() if channels]
+
+    def room_sizes(self):
+        """Sockets joined to each channel, counting every tab of a user."""
+        with self._lock:
+            return [sum(users.values()) for users in self._channel_users.values()]
+
+    def clear(self):
+        with self._lock:
+            self._sid_user.clear()
+            self._sid_channels.clear()
+            self._user_sids.clear()
+            self._channel_users.clear()
+
+
+class MemoryPresenceStore:
+    """Presence entries held in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def touch(self, channel_id, sid, user_id, ttl):
+        with self._lock:
+            self._channels.setdefault(channel_id, {})[sid] = (user_id, time.monotonic() + ttl)
+
+    def remove(self, channel_id, sid, user_id):
+        with self._lock:
+            entries = self._channels.get(channel_id)
+            if entries:
+                entries.pop(sid, None)
+
+    def online_users(self, channel_id):
+        now = time.monotonic()
+        with self._lock:
+            entries = self._channels.get(channel_id, {})
+            for sid in [sid for sid, (_, expires_at) in entries.items() if expires_at <= now]:
+                del entries[sid]
+            if not entries:
+                self._channels.pop(channel_id, None)
+            return sorted({user_id for user_id, _ in entries.values()})
+
+    def clear(self):
+        with self._lock:
+            self._channels.clear()
+
+
+class RedisPresenceStore:
+    """Presence entries in Redis: one sorted set per channel scored by expiry."""
+
+    def __init__(self, url, prefix='presence:'):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def touch(self, channel_id, sid, user_id, ttl):
+        key = self._prefix + channel_id
+        pipe = self._redis.pipeline()
+        pipe.zadd(key, {f'{sid}|{user_id}': time.time() + ttl})
+        pipe.expire(key, int(ttl) + 1)
+        pipe.execute()
+
+    def remove(self, channel_id, sid, user_id):
+        self._redis.zrem(self._prefix + channel_id, f'{sid}|{user_id}')
+
+    def online_users(self, channel_id):
+        key = self._prefix + channel_id
+        pipe = self._redis.pipeline()
+        pipe.zremrangebyscore(key, '-inf', time.time())
+        pipe.zrange(key, 0, -1)
+        members = pipe.execute()[1]
+        return sorted({m.decode().split('|', 1)[1] for m in members})
+
+    def clear(self):
+        pass
+
+
+class LocalPresenceStore:
+    """Presence entries in a LocalBroker, shared by every worker using it.
+
+    Writes wait for the broker's "OK", so once touch() or remove() returns
+    every worker's next read sees the change.
+    """
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or '127.0.0.1', parsed.port or 6380)
+        self._conn = None
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def _send(self, line):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = socket.create_connection(self.address, timeout=5)
+                        self._lines = self._conn.makefile('r', encoding='utf-8')
+                    self._conn.sendall(line.encode())
+                    return self._lines.readline()
+                except OSError:
+                    self._conn = None
+                    if attempt:
+                        raise
+
+    def touch(self, channel_id, sid, user_id, ttl):
+        self._send(f'PSET {channel_id} {sid} {user_id} {ttl}\n')
+
+    def remove(self, channel_id, sid, user_id):
+        self._send(f'PDEL {channel_id} {sid}\n')
+
+    def online_users(self, channel_id):
+        return json.loads(self._send(f'PGET {channel_id}\n'))
+
+    def clear(self):
+        pass
+
+
+def presence_store_for(url):
+    if not url or url.startswith('memory://'):
+        return MemoryPresenceStore()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisPresenceStore(url)
+    if url.startswith('local://'):
+        return LocalPresenceStore(url)
+    raise ValueError(f'Unsupported PRESENCE_STORE_URL: {url}')
+
+
+class _StoreProxy:
+    """Module-level handle whose backend is chosen by configure_presence."""
+
+    def __init__(self):
+        self.backend = MemoryPresenceStore()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+presence = PresenceRegistry()
+presence_store = _StoreProxy()
+
+
+def configure_presence(config):
+    presence_store.backend = presence_store_for(config.get('PRESENCE_STORE_URL'))
+
+
+def renew_presence():
+    """Renew the store entries of every socket connected to this worker."""
+    ttl = current_app.config.get('PRESENCE_TTL', 90)
+    for sid, user_id, channels in presence.joined():
+        for channel_id in channels:
+            presence_store.touch(channel_id, sid, user_id, ttl)
+    # Never "busy": the worker ticks once per interval
+
+
+presence_renewer = BackgroundWorker('presence-renewer', renew_presence)
+
+
+def start_presence_renewer(app):
+    """Start this worker's renewal loop; a no-op once it is running."""
+    presence_renewer.start(app, interval=app.config.get('PRESENCE_HEARTBEAT_INTERVAL', 30))
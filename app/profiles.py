@@ -0,0 +1,50 @@
+"""Cached author profiles for message serialization and presence events."""
+from sqlalchemy import event, inspect
+from . import db
+from .cache import TTLCache
+from .models import User
+
+profile_cache = TTLCache('profile', maxsize=10000, ttl=300)
+
+
+def _profile(user_id, display_name):
+    return {'id': user_id, 'display_name': display_name}
+
+
+def get_profiles(user_ids):
+    """Return {user_id: profile} for the given ids, loading misses in one query."""
+    wanted = {uid for uid in user_ids if uid}
+    profiles = profile_cache.get_many(wanted)
+    missing = wanted - profiles.keys()
+    if missing:
+        rows = db.session.query(User.id, User.display_name).filter(User.id.in_(missing)).all()
+        for user_id, display_name in rows:
+            profiles[user_id] = _profile(user_id, display_name)
+            profile_cache.set(user_id, profiles[user_id])
+    return profiles
+
+
+def get_profile(user_id):
+    if not user_id:
+        return None
+    return get_profiles([user_id]).get(user_id)
+
+
+def display_name_for(user_id):
+    profile = get_profile(user_id)
+    return profile['display_name'] if profile else 'Unknown'
+
+
+def invalidate_profile(user_id):
+    profile_cache.pop(user_id)
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    if inspect(target).attrs.display_name.history.has_changes():
+        invalidate_profile(target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    invalidate_profile(target.id)
@@ -0,0 +1,83 @@
+"""Background purge of deleted channels.
+
+delete_channel only marks the channel deleted (hiding it from every read)
+and records a ChannelPurge job. `purge_step` then removes the channel's
+messages and memberships in batches of CHANNEL_PURGE_BATCH_SIZE rows, one
+short transaction per batch, recording progress on the job. The channel
+row itself is deleted last. Unfinished jobs are picked up again whenever
+a worker starts, so a restart resumes the purge where it stopped.
+
+Every server process runs the worker. On Postgres a batch claims its job
+with FOR UPDATE SKIP LOCKED, so concurrent workers take different jobs or
+wait for the next round. SQLite serializes writers anyway. In both cases
+progress counts the rows a batch actually deleted and is added in SQL,
+so overlapping batches never count a row twice.
+"""
+from datetime import datetime
+from flask import current_app
+from . import db, archive, search
+from .background import BackgroundWorker
+from .models import Channel, ChannelMembership, ChannelPurge, Message
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _delete_batch(model, channel_id, batch_size):
+    """Delete up to `batch_size` rows; returns (selected ids, rows deleted)."""
+    ids = [row_id for (row_id,) in db.session.query(model.id).filter(
+        model.channel_id == channel_id).limit(batch_size)]
+    if not ids:
+        return ids, 0
+    return ids, model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+
+
+def purge_step(batch_size=None):
+    """Purge one batch from the oldest unfinished job; returns False when idle."""
+    batch_size = batch_size or current_app.config.get('CHANNEL_PURGE_BATCH_SIZE', 1000)
+    job = ChannelPurge.query.filter(ChannelPurge.completed_at.is_(None)) \
+        .order_by(ChannelPurge.requested_at).with_for_update(skip_locked=True).first()
+    if not job:
+        db.session.rollback()
+        return False
+
+    ids, deleted = _delete_batch(Message, job.channel_id, batch_size)
+    if ids:
+        search.remove_messages(db.session.connection(), ids)
+        job.messages_purged = ChannelPurge.messages_purged + deleted
+        db.session.commit()
+        return True
+
+    ids, deleted = _delete_batch(ChannelMembership, job.channel_id, batch_size)
+    if ids:
+        job.memberships_purged = ChannelPurge.memberships_purged + deleted
+        db.session.commit()
+        return True
+
+    channel_id = job.channel_id
+    Channel.query.filter_by(id=channel_id).delete(synchronize_session=False)
+    job.completed_at = datetime.utcnow()
+    db.session.commit()
+    # Only once the row is gone: a failed commit must leave the archive readable
+    try:
+        archive.remove_channel(channel_id)
+    except OSError as e:
+        logger.error(f'Could not remove the archive of purged channel {channel_id}: {str(e)}')
+    logger.info(f'Purged channel {channel_id}: {job.messages_purged} messages, '
+                f'{job.memberships_purged} memberships')
+    return True
+
+
+def purge_all(batch_size=None):
+    """Run every pending purge to completion in the calling thread."""
+    while purge_step(batch_size):
+        pass
+
+
+purge_worker = BackgroundWorker('channel-purge', purge_step)
+
+
+def start_purge_worker(app):
+    if app.config.get('CHANNEL_PURGE_WORKER', True):
+        purge_worker.start(app, interval=app.config.get('CHANNEL_PURGE_INTERVAL', 30))
+        purge_worker.kick()
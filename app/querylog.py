@@ -0,0 +1,151 @@
+"""Per-request SQL accounting: query counts, N+1 detection and slow queries.
+
+Every statement run through SQLAlchemy is added to the QueryLog of each
+open scope in the current thread (or green thread). create_app opens a
+scope per HTTP request and @timed_event one per Socket.IO event, and
+`capture()` opens one anywhere else, e.g. in tests.
+
+When a request or event scope closes, any statement shape run
+N_PLUS_ONE_THRESHOLD times or more is logged as a suspected N+1. The
+shape is the SQL text with IN lists collapsed, so `get(1)`, `get(2)`, ...
+count as the same statement. Statements slower than SLOW_QUERY_MS are
+logged as they finish. Setting either option to 0 turns that check off.
+"""
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from collections import Counter
+from contextlib import contextmanager
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,?)+\)')
+_WHITESPACE = re.compile(r'\s+')
+
+_local = threading.local()
+_settings = {'slow_seconds': 0.2, 'n_plus_one': 5}
+
+
+def statement_shape(statement):
+    """Normalize `statement` so repeats of one query compare equal."""
+    return _IN_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class QueryLog:
+    """Statements and their durations recorded inside one scope."""
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = []
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def statements(self):
+        return [statement for statement, _ in self.queries]
+
+    @property
+    def duration(self):
+        return sum(seconds for _, seconds in self.queries)
+
+    def repeated(self, threshold):
+        """[(shape, count)] of statement shapes run at least `threshold` times."""
+        shapes = Counter(statement_shape(s) for s, _ in self.queries)
+        return [(shape, n) for shape, n in shapes.most_common() if n >= threshold]
+
+    def format(self):
+        return '\n'.join(f'{seconds * 1000:8.2f}ms  {_WHITESPACE.sub(" ", s).strip()}'
+                         for s, seconds in self.queries)
+
+
+def _scopes():
+    scopes = getattr(_local, 'scopes', None)
+    if scopes is None:
+        scopes = _local.scopes = []
+    return scopes
+
+
+def current():
+    """The innermost open QueryLog of this thread, or None."""
+    scopes = getattr(_local, 'scopes', None)
+    return scopes[-1] if scopes else None
+
+
+def begin(name):
+    log = QueryLog(name)
+    _scopes().append(log)
+    return log
+
+
+def end(log, check=True):
+    """Close `log`'s scope, warning about repeated statement shapes."""
+    scopes = _scopes()
+    if log in scopes:
+        scopes.remove(log)
+    threshold = _settings['n_plus_one']
+    if check and threshold:
+        for shape, n in log.repeated(threshold):
+            logger.warning(f'Possible N+1 in {log.name}: {n} x {shape}')
+    return log
+
+
+@contextmanager
+def capture(name='capture', check=False):
+    """Record the statements run inside the block; yields the QueryLog."""
+    log = begin(name)
+    try:
+        yield log
+    finally:
+        end(log, check=check)
+
+
+def configure_querylog(config):
+    slow_ms = config.get('SLOW_QUERY_MS')
+    if slow_ms is not None:
+        _settings['slow_seconds'] = slow_ms / 1000.0
+    threshold = config.get('N_PLUS_ONE_THRESHOLD')
+    if threshold is not None:
+        _settings['n_plus_one'] = threshold
+
+
+def init_querylog(app):
+    """Apply `app`'s settings and open a scope around each of its requests."""
+    configure_querylog(app.config)
+    app.before_request(_begin_request)
+    app.teardown_request(_end_request)
+
+
+def _begin_request():
+    g.querylog = begin(request.endpoint or request.path)
+
+
+def _end_request(exc):
+    log = g.pop('querylog', None)
+    if log is not None:
+        end(log)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._querylog_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_querylog_started', None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    for log in getattr(_local, 'scopes', ()):
+        log.queries.append((statement, seconds))
+    slow = _settings['slow_seconds']
+    if slow and seconds >= slow:
+        scope = current()
+        logger.warning(f'Slow query ({seconds * 1000:.0f}ms) in {scope.name if scope else "background"}: '
+                       f'{_WHITESPACE.sub(" ", statement).strip()}')
@@ -1,11 +1,14 @@
 from flask import Blueprint, request, current_app, jsonify, make_response
 from .. import db
-from ..models import User, RefreshToken
-import bcrypt as _bcrypt_lib
+from ..models import User, VersionCounter
+from ..tokens import (
+    issue_refresh_token, rotate_refresh_token, revoke_refresh_token, InvalidRefreshToken
+)
+from ..access_tokens import revoke_token
+from ..passwords import hash_password, verify_password, needs_rehash, HashingBusy
 import jwt
+import time
 from datetime import datetime, timedelta
-import uuid
-import hashlib
 import traceback
 import logging
 
@@ -19,12 +22,26 @@ def create_access_token(user_id):
     exp = datetime.utcnow() + timedelta(
         minutes=current_app.config.get('ACCESS_TOKEN_EXPIRE_MINUTES', 15)
     )
-    payload = {'sub': user_id, 'exp': exp}
+    # Sub-second iat so revoke_user() cut-offs are exact
+    payload = {'sub': user_id, 'exp': exp, 'iat': time.time()}
     return jwt.encode(payload, secret, algorithm=alg)
 
 
-def create_refresh_token():
-    return str(uuid.uuid4())
+def hashing_busy_response():
+    resp = jsonify({'error': 'server busy, try again shortly'})
+    resp.headers['Retry-After'] = '1'
+    return resp, 503
+
+
+def set_refresh_cookie(resp, refresh):
+    resp.set_cookie(
+        'refresh_token', 
+        refresh, 
+        httponly=True, 
+        samesite='Lax', 
+        secure=False, 
+        path='/'
+    )
 
 
 @auth_bp.route('/signup', methods=['POST'])
@@ -41,13 +58,8 @@ def signup():
         if User.query.filter_by(email=email).first():
             return jsonify({'error': 'email already exists'}), 409
 
-        # Truncate password to 72 bytes (bcrypt limit). Work with bytes
-        # to ensure we never hand >72 bytes to the backend.
-        password_bytes = password.encode('utf-8')
-        password_truncated_bytes = password_bytes[:72]
-        # Use bcrypt.hashpw directly to avoid passlib backend detection issues
-        salt = _bcrypt_lib.gensalt()
-        pw_hash = _bcrypt_lib.hashpw(password_truncated_bytes, salt).decode('utf-8')
+        # Hashed on the password pool (see app/passwords.py)
+        pw_hash = hash_password(password)
 
         user = User(
             email=email,
@@ -57,41 +69,24 @@ def signup():
         db.session.add(user)
         db.session.flush()
         
-        # Auto-join public channels
-        from ..models import Channel, ChannelMembership
-        public_channels = Channel.query.filter_by(is_private=False).all()
-        for channel in public_channels:
-            membership = ChannelMembership(channel_id=channel.id, user_id=user.id, role='member')
-            db.session.add(membership)
+        # Membership of public channels is implicit, so joining them all
+        # is one add to the user total their member counts start from
+        VersionCounter.add(VersionCounter.USERS, 1)
         
         db.session.commit()
 
         access = create_access_token(user.id)
-        refresh = create_refresh_token()
-        refresh_hash = hashlib.sha256(refresh.encode()).hexdigest()
-
-        rt = RefreshToken(
-            user_id=user.id,
-            token_hash=refresh_hash,
-            expires_at=datetime.utcnow() + timedelta(
-                days=current_app.config.get('REFRESH_TOKEN_EXPIRE_DAYS', 30)
-            )
-        )
-        db.session.add(rt)
+        refresh = issue_refresh_token(user.id)
         db.session.commit()
 
         resp = jsonify({'user': user.to_dict(), 'access_token': access})
-        resp.set_cookie(
-            'refresh_token', 
-            refresh, 
-            httponly=True, 
-            samesite='Lax', 
-            secure=False, 
-            path='/'
-        )
+        set_refresh_cookie(resp, refresh)
 
         return resp, 201
 
+    except HashingBusy:
+        db.session.rollback()
+        return hashing_busy_response()
     except Exception as e:
         logger.error(f'Signup error: {str(e)}\n{traceback.format_exc()}')
         db.session.rollback()
@@ -112,43 +107,29 @@ def login():
         if not user:
             return jsonify({'error': 'invalid credentials'}), 401
 
-        # Truncate password to 72 bytes (bcrypt limit). Work with bytes
-        # to ensure we never hand >72 bytes to the backend.
-        password_bytes = password.encode('utf-8')
-        password_truncated_bytes = password_bytes[:72]
-        try:
-            stored = user.password_hash.encode('utf-8')
-        except Exception:
-            stored = user.password_hash
-        if not _bcrypt_lib.checkpw(password_truncated_bytes, stored):
+        if not verify_password(password, user.password_hash):
             return jsonify({'error': 'invalid credentials'}), 401
 
+        # Upgrade hashes made with a different BCRYPT_ROUNDS; best effort,
+        # a busy pool just leaves the old hash in place until next time
+        if needs_rehash(user.password_hash):
+            try:
+                user.password_hash = hash_password(password)
+            except HashingBusy:
+                pass
+
         access = create_access_token(user.id)
-        refresh = create_refresh_token()
-        refresh_hash = hashlib.sha256(refresh.encode()).hexdigest()
-
-        rt = RefreshToken(
-            user_id=user.id,
-            token_hash=refresh_hash,
-            expires_at=datetime.utcnow() + timedelta(
-                days=current_app.config.get('REFRESH_TOKEN_EXPIRE_DAYS', 30)
-            )
-        )
-        db.session.add(rt)
+        refresh = issue_refresh_token(user.id)
         db.session.commit()
 
         resp = jsonify({'user': user.to_dict(), 'access_token': access})
-        resp.set_cookie(
-            'refresh_token', 
-            refresh, 
-            httponly=True, 
-            samesite='Lax', 
-            secure=False, 
-            path='/'
-        )
+        set_refresh_cookie(resp, refresh)
 
         return resp, 200
 
+    except HashingBusy:
+        db.session.rollback()
+        return hashing_busy_response()
     except Exception as e:
         logger.error(f'Login error: {str(e)}\n{traceback.format_exc()}')
         db.session.rollback()
@@ -161,18 +142,27 @@ def refresh():
     if not refresh_token:
         return jsonify({'error': 'no refresh token'}), 401
 
-    refresh_hash = hashlib.sha256(refresh_token.encode()).hexdigest()
-    rt = RefreshToken.query.filter_by(token_hash=refresh_hash).first()
-
-    if not rt or (rt.expires_at and rt.expires_at < datetime.utcnow()):
-        return jsonify({'error': 'invalid or expired refresh token'}), 401
+    try:
+        user_id, new_refresh = rotate_refresh_token(refresh_token)
+    except InvalidRefreshToken:
+        resp = jsonify({'error': 'invalid or expired refresh token'})
+        resp.set_cookie('refresh_token', '', expires=0)
+        return resp, 401
 
-    access = create_access_token(rt.user_id)
-    return jsonify({'access_token': access}), 200
+    access = create_access_token(user_id)
+    resp = jsonify({'access_token': access})
+    set_refresh_cookie(resp, new_refresh)
+    return resp, 200
 
 
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
+    refresh_token = request.cookies.get('refresh_token')
+    if refresh_token:
+        revoke_refresh_token(refresh_token)
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.lower().startswith('bearer '):
+        revoke_token(auth_header[7:])
     resp = make_response('', 204)
     resp.set_cookie('refresh_token', '', expires=0)
     return resp
@@ -1,7 +1,14 @@
 from flask import Blueprint, request, jsonify, current_app
-from .. import db
-from ..models import Channel, ChannelMembership, User
+from sqlalchemy import and_, or_
+from .. import db, socketio
+from ..models import Channel, ChannelMembership, ChannelPurge, User
 from ..auth_decorator import require_auth
+from ..memberships import is_member, invalidate_user
+from ..purge import start_purge_worker
+from ..etags import catalog_etag, catalog_versions, not_modified, tag_response
+from ..catalog import channel_page
+from ..pagination import encode_name_cursor, decode_name_cursor, InvalidCursor
+from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,17 +18,40 @@ channels_bp = Blueprint('channels', __name__)
 @channels_bp.route('/', methods=['GET'], strict_slashes=False)
 @require_auth
 def list_channels():
-    """List all channels the user is a member of, or public channels."""
+    """List public channels and the user's private channels, ordered by (name, id).
+
+    Pages hold `limit` channels (100 by default, at most 500); pass each
+    `next_cursor` back to get the next one. Clients that still need the
+    whole list in one response must ask for it with `limit=all`.
+    """
     try:
         user_id = request.user_id
-        # Get channels user is a member of
-        memberships = ChannelMembership.query.filter_by(user_id=user_id).all()
-        channel_ids = [m.channel_id for m in memberships]
-        channels = Channel.query.filter(Channel.id.in_(channel_ids)).all() if channel_ids else []
-        # Also get public channels
-        public_channels = Channel.query.filter_by(is_private=False).all()
-        all_channels = list({c.id: c for c in channels + public_channels}.values())
-        return jsonify({'channels': [c.to_dict() for c in all_channels]}), 200
+        catalog_version, channels_version, users_total = catalog_versions()
+        etag = catalog_etag(user_id, catalog_version, users_total)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        q = request.args.get('q', '').strip() or None
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', '100')
+        if limit == 'all':
+            limit = None
+        else:
+            try:
+                limit = max(1, min(int(limit), 500))
+            except ValueError:
+                return jsonify({'error': 'invalid limit'}), 400
+        try:
+            after = decode_name_cursor(cursor) if cursor else None
+        except InvalidCursor:
+            return jsonify({'error': 'invalid cursor'}), 400
+
+        channels = channel_page(user_id, channels_version, users_total, limit, after=after, q=q)
+        has_more = limit is not None and len(channels) > limit
+        channels = channels[:limit]
+        next_cursor = encode_name_cursor(channels[-1]['name'], channels[-1]['id']) if has_more else None
+        body = jsonify({'channels': channels, 'next_cursor': next_cursor, 'has_more': has_more})
+        return tag_response(body, etag), 200
     except Exception as e:
         logger.error(f'List channels error: {str(e)}')
         return jsonify({'error': 'server error'}), 500
@@ -40,14 +70,17 @@ def create_channel():
         if not name or not name.strip():
             return jsonify({'error': 'name required'}), 400
         
-        channel = Channel(name=name.strip(), is_private=bool(is_private), owner_id=user_id)
+        # Every user is implicitly a member of a public channel (see Channel.members)
+        channel = Channel(name=name.strip(), is_private=bool(is_private), owner_id=user_id,
+                          member_count=1 if is_private else 0)
         db.session.add(channel)
         db.session.flush()
         
-        # Add creator as member
+        # Record the creator's role (and, for private channels, membership)
         membership = ChannelMembership(channel_id=channel.id, user_id=user_id, role='owner')
         db.session.add(membership)
         db.session.commit()
+        invalidate_user(user_id)
         
         return jsonify({'channel': channel.to_dict()}), 201
     except Exception as e:
@@ -62,7 +95,7 @@ def join_channel(channel_id):
     """Join a channel."""
     try:
         user_id = request.user_id
-        channel = Channel.query.get(channel_id)
+        channel = Channel.get_live(channel_id)
         
         if not channel:
             return jsonify({'error': 'channel not found'}), 404
@@ -71,13 +104,23 @@ def join_channel(channel_id):
             return jsonify({'error': 'cannot join private channel'}), 403
         
         # Check if already a member
-        existing = ChannelMembership.query.filter_by(channel_id=channel_id, user_id=user_id).first()
-        if existing:
+        if is_member(user_id, channel_id):
             return jsonify({'ok': True}), 200
         
-        membership = ChannelMembership(channel_id=channel_id, user_id=user_id, role='member')
-        db.session.add(membership)
+        # Public membership is implicit; rejoining just clears the leave
+        # marker, except that the owner's row goes back to 'owner'
+        left = ChannelMembership.query.filter_by(
+            channel_id=channel_id, user_id=user_id, role=ChannelMembership.ROLE_LEFT
+        )
+        if channel.owner_id == user_id:
+            rejoined = left.update({ChannelMembership.role: 'owner'}, synchronize_session=False)
+        else:
+            rejoined = left.delete(synchronize_session=False)
+        # is_member may be stale; only the request that cleared the marker counts
+        if rejoined:
+            Channel.adjust_member_count(1, id=channel_id)
         db.session.commit()
+        invalidate_user(user_id)
         
         return jsonify({'ok': True}), 200
     except Exception as e:
@@ -94,13 +137,25 @@ def get_channel_members(channel_id):
         user_id = request.user_id
         
         # Verify user is a member
-        membership = ChannelMembership.query.filter_by(channel_id=channel_id, user_id=user_id).first()
-        if not membership:
+        if not is_member(user_id, channel_id):
             return jsonify({'error': 'not a member'}), 403
         
-        members = db.session.query(User, ChannelMembership).join(
-            ChannelMembership, User.id == ChannelMembership.user_id
-        ).filter(ChannelMembership.channel_id == channel_id).all()
+        channel = Channel.get_live(channel_id)
+        if channel.is_private:
+            members = db.session.query(User, ChannelMembership.role).join(
+                ChannelMembership, User.id == ChannelMembership.user_id
+            ).filter(ChannelMembership.channel_id == channel_id)
+        else:
+            # Everyone is a member of a public channel unless they left it
+            members = db.session.query(User, ChannelMembership.role).outerjoin(
+                ChannelMembership, and_(
+                    User.id == ChannelMembership.user_id,
+                    ChannelMembership.channel_id == channel_id
+                )
+            )
+        members = members.filter(or_(
+            ChannelMembership.role.is_(None), ChannelMembership.role != ChannelMembership.ROLE_LEFT
+        )).all()
         
         return jsonify({
             'members': [
@@ -108,9 +163,9 @@ def get_channel_members(channel_id):
                     'id': u.id,
                     'email': u.email,
                     'display_name': u.display_name,
-                    'role': m.role
+                    'role': role or 'member'
                 }
-                for u, m in members
+                for u, role in members
             ]
         }), 200
     except Exception as e:
@@ -124,21 +179,20 @@ def get_channel(channel_id):
     """Get channel details."""
     try:
         user_id = request.user_id
-        channel = Channel.query.get(channel_id)
+        channel = Channel.get_live(channel_id)
         
         if not channel:
             return jsonify({'error': 'not found'}), 404
         
         # Verify user is a member (unless public)
         if channel.is_private:
-            membership = ChannelMembership.query.filter_by(channel_id=channel_id, user_id=user_id).first()
-            if not membership:
+            if not is_member(user_id, channel_id):
                 return jsonify({'error': 'not a member'}), 403
         
-        member_count = ChannelMembership.query.filter_by(channel_id=channel_id).count()
+        data = channel.to_dict()
         return jsonify({
-            'channel': channel.to_dict(),
-            'member_count': member_count
+            'channel': data,
+            'member_count': data['member_count']
         }), 200
     except Exception as e:
         logger.error(f'Get channel error: {str(e)}')
@@ -151,12 +205,25 @@ def leave_channel(channel_id):
     """Leave a channel."""
     try:
         user_id = request.user_id
-        membership = ChannelMembership.query.filter_by(channel_id=channel_id, user_id=user_id).first()
-        
+        channel = Channel.get_live(channel_id)
         
-        if membership:
-            db.session.delete(membership)
+        if channel and is_member(user_id, channel_id):
+            # Conditional writes: a concurrent leave that got here first
+            # changes no rows, so the count moves once
+            membership = ChannelMembership.query.filter_by(channel_id=channel_id, user_id=user_id)
+            if channel.is_private:
+                left = membership.delete(synchronize_session=False)
+            else:
+                # Keep the row as a marker that overrides implicit membership
+                left = membership.filter(ChannelMembership.role != ChannelMembership.ROLE_LEFT).update(
+                    {ChannelMembership.role: ChannelMembership.ROLE_LEFT}, synchronize_session=False
+                ) or ChannelMembership.insert_if_absent(
+                    channel_id=channel_id, user_id=user_id, role=ChannelMembership.ROLE_LEFT
+                )
+            if left:
+                Channel.adjust_member_count(-1, id=channel_id)
             db.session.commit()
+            invalidate_user(user_id)
         
         return '', 204
     except Exception as e:
@@ -171,7 +238,7 @@ def delete_channel(channel_id):
     """Delete a channel (owner only)."""
     try:
         user_id = request.user_id
-        channel = Channel.query.get(channel_id)
+        channel = Channel.get_live(channel_id)
         
         if not channel:
             return jsonify({'error': 'channel not found'}), 404
@@ -179,14 +246,13 @@ def delete_channel(channel_id):
         if channel.owner_id != user_id:
             return jsonify({'error': 'only owner can delete'}), 403
         
-        # Delete all memberships
-        ChannelMembership.query.filter_by(channel_id=channel_id).delete()
-        # Delete all messages
-        from ..models import Message
-        Message.query.filter_by(channel_id=channel_id).delete()
-        # Delete channel
-        db.session.delete(channel)
+        # Hide the channel now; messages and memberships are purged in
+        # bounded batches by the background worker (app/purge.py)
+        channel.deleted_at = datetime.utcnow()
+        db.session.add(ChannelPurge(channel_id=channel_id))
         db.session.commit()
+        socketio.close_room(f'channel:{channel_id}')
+        start_purge_worker(current_app._get_current_object())
         
         return '', 204
     except Exception as e:
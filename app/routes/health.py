@@ -1,4 +1,5 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, abort, jsonify, request
+from ..metrics import metrics_enabled, render, scrape_allowed
 
 health_bp = Blueprint('health', __name__)
 
@@ -6,3 +7,12 @@ health_bp = Blueprint('health', __name__)
 @health_bp.route('/healthz', methods=['GET'])
 def health():
     return jsonify({'status': 'ok'}), 200
+
+
+@health_bp.route('/metrics', methods=['GET'])
+def metrics():
+    if not metrics_enabled():
+        abort(404)
+    if not scrape_allowed(request.headers.get('Authorization')):
+        abort(401)
+    return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -1,8 +1,17 @@
 from flask import Blueprint, request, jsonify
-from ..models import Message, Channel, ChannelMembership
+from ..models import Message, Channel
 from .. import db
 from ..auth_decorator import require_auth
-from datetime import datetime
+from .. import archive
+from ..memberships import is_member
+from ..search import search_messages
+from ..profiles import get_profiles
+from ..serialization import RawJSON, extend_json, message_json
+from ..etags import history_etag, not_modified, tag_response
+from ..pagination import (
+    encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor, InvalidCursor
+)
+from sqlalchemy import tuple_
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,53 +26,145 @@ def get_messages(channel_id):
         user_id = request.user_id
         
         # Verify user is a member of the channel
-        membership = ChannelMembership.query.filter_by(channel_id=channel_id, user_id=user_id).first()
-        if not membership:
+        if not is_member(user_id, channel_id):
             return jsonify({'error': 'not a member of this channel'}), 403
         
-        # Cursor-based pagination: before=ISO timestamp or message_id
+        # Keyset pagination on (created_at, id): `before` pages towards older
+        # messages, `after` towards newer ones. Both take the opaque cursors
+        # returned below, so every page is a single index range scan.
         before = request.args.get('before')
+        after = request.args.get('after')
         limit = int(request.args.get('limit', 50))
-        limit = min(limit, 100)  # Cap at 100 to prevent abuse
-        
-        query = Message.query.filter_by(channel_id=channel_id, is_deleted=False).order_by(Message.created_at.desc())
-        
-        if before:
-            try:
-                before_dt = datetime.fromisoformat(before)
-                query = query.filter(Message.created_at < before_dt)
-            except Exception:
-                pass
-        
-        messages = query.limit(limit + 1).all()
-        has_more = len(messages) > limit
-        messages = messages[:limit]
-        
-        # Reverse to show chronological order
-        messages = list(reversed(messages))
-        
-        # Calculate next cursor
+        limit = max(1, min(limit, 100))  # Cap at 100 to prevent abuse
+
+        try:
+            before_key = decode_cursor(before) if before else None
+            after_key = decode_cursor(after) if after else None
+        except InvalidCursor:
+            return jsonify({'error': 'invalid cursor'}), 400
+
+        # The newest page is polled constantly; answer 304 while it is unchanged
+        etag = archived_segments = None
+        if not before and not after:
+            etag, archived_segments = history_etag(channel_id, limit)
+            unchanged = not_modified(etag)
+            if unchanged:
+                return unchanged
+
+        position = tuple_(Message.created_at, Message.id)
+        query = Message.query.filter_by(channel_id=channel_id, is_deleted=False)
+        if before_key:
+            query = query.filter(position < tuple_(*before_key))
+
+        if after_key and not before_key:
+            # Walk forwards from the cursor, draining archived history first
+            archived = archive.read_after(channel_id, after_key, limit + 1)
+            if archived:
+                last = archived[-1]
+                after_key = (last.created_at, last.id)
+            query = query.filter(position > tuple_(*after_key))
+            query = query.order_by(Message.created_at.asc(), Message.id.asc())
+            messages = archived + query.limit(limit + 1 - len(archived)).all()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+        else:
+            if after_key:
+                query = query.filter(position > tuple_(*after_key))
+            query = query.order_by(Message.created_at.desc(), Message.id.desc())
+            messages = query.limit(limit + 1).all()
+            if len(messages) <= limit:
+                # Hot table exhausted; continue into archived segments
+                oldest = messages[-1] if messages else None
+                start = (oldest.created_at, oldest.id) if oldest else before_key
+                archived = archive.read_before(channel_id, start, limit + 1 - len(messages),
+                                               archived_segments)
+                if after_key:
+                    archived = [m for m in archived if (m.created_at, m.id) > after_key]
+                messages += archived
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            # Reverse to show chronological order
+            messages = list(reversed(messages))
+
+        # next_cursor continues towards older messages, prev_cursor towards newer
         next_cursor = None
-        if has_more and messages:
-            next_cursor = messages[0].created_at.isoformat()
-        
-        # Import User model for eager loading
-        from ..models import User
-        messages_data = []
-        for m in messages:
-            user = User.query.get(m.user_id) if m.user_id else None
-            messages_data.append(m.to_dict(user=user))
+        prev_cursor = None
+        if messages:
+            if has_more or after_key:
+                next_cursor = encode_cursor(messages[0].created_at, messages[0].id)
+            prev_cursor = encode_cursor(messages[-1].created_at, messages[-1].id)
+
+        # Hydrate all authors of the page with a single IN (...) query;
+        # each message is encoded once and its bytes reused from then on
+        profiles = get_profiles(m.user_id for m in messages)
+        messages_data = [RawJSON(message_json(m, profiles.get(m.user_id))) for m in messages]
         
-        return jsonify({
+        response = jsonify({
             'messages': messages_data,
             'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
             'has_more': has_more
-        }), 200
+        })
+        if etag:
+            tag_response(response, etag)
+        return response, 200
     except Exception as e:
         logger.error(f'Get messages error: {str(e)}')
         return jsonify({'error': 'server error'}), 500
 
 
+def _search_response(**scope):
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'error': 'q required'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except ValueError:
+        return jsonify({'error': 'invalid limit'}), 400
+    cursor = request.args.get('cursor')
+    try:
+        after = decode_rank_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        return jsonify({'error': 'invalid cursor'}), 400
+
+    hits = search_messages(q, limit, after=after, **scope)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    profiles = get_profiles(m.user_id for m, _ in hits)
+    # Same cached encoding as history and broadcasts, with the rank spliced in
+    results = [RawJSON(extend_json(message_json(m, profiles.get(m.user_id)), rank=rank))
+               for m, rank in hits]
+    next_cursor = None
+    if has_more:
+        last, rank = hits[-1]
+        next_cursor = encode_rank_cursor(rank, last.id)
+    return jsonify({'results': results, 'next_cursor': next_cursor, 'has_more': has_more}), 200
+
+
+@messages_bp.route('/<channel_id>/messages/search', methods=['GET'], strict_slashes=False)
+@require_auth
+def search_channel_messages(channel_id):
+    """Full-text search within one channel, best match first."""
+    try:
+        if not is_member(request.user_id, channel_id):
+            return jsonify({'error': 'not a member of this channel'}), 403
+        return _search_response(channel_id=channel_id)
+    except Exception as e:
+        logger.error(f'Search messages error: {str(e)}')
+        return jsonify({'error': 'server error'}), 500
+
+
+@messages_bp.route('/messages/search', methods=['GET'], strict_slashes=False)
+@require_auth
+def search_all_messages():
+    """Full-text search across every channel the caller belongs to."""
+    try:
+        return _search_response(user_id=request.user_id)
+    except Exception as e:
+        logger.error(f'Search messages error: {str(e)}')
+        return jsonify({'error': 'server error'}), 500
+
+
 @messages_bp.route('/<channel_id>/messages', methods=['POST'], strict_slashes=False)
 @require_auth
 def create_message(channel_id):
@@ -72,8 +173,7 @@ def create_message(channel_id):
         user_id = request.user_id
         
         # Verify user is a member
-        membership = ChannelMembership.query.filter_by(channel_id=channel_id, user_id=user_id).first()
-        if not membership:
+        if not is_member(user_id, channel_id):
             return jsonify({'error': 'not a member of this channel'}), 403
         
         data = request.get_json() or {}
@@ -0,0 +1,140 @@
+"""Full-text message search.
+
+SQLite keeps an FTS5 table, `messages_fts`, next to `messages`. It is
+created by db.create_all(), and the mapper hooks below update it on every
+insert, edit and soft delete. Bulk writers that bypass the ORM (the
+group-commit writer, archiving) call index_rows / remove_messages
+themselves.
+
+Postgres needs no side table: migration 0004 adds a GIN index on
+to_tsvector('simple', content), and the query below uses that
+expression, so the index is maintained by the database itself.
+
+Results are ranked (bm25 on SQLite, ts_rank on Postgres) and paginated
+with a (rank, id) keyset cursor.
+"""
+from sqlalchemy import (
+    DDL, and_, event, func, inspect, literal_column, or_, select, table, text,
+)
+from . import db
+from .memberships import member_clause
+from .models import Channel, ChannelMembership, Message
+import re
+
+FTS_TABLE = 'messages_fts'
+
+# Hooked on the metadata rather than the table so that db.create_all() also
+# adds the index to databases whose messages table predates it
+event.listen(
+    db.metadata, 'after_create',
+    DDL(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"content, message_id UNINDEXED, channel_id UNINDEXED)").execute_if(dialect='sqlite'),
+)
+event.listen(
+    db.metadata, 'before_drop',
+    DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite'),
+)
+
+
+def _uses_fts(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def index_rows(connection, rows):
+    """Add message rows (dicts with id, channel_id, content) to the index."""
+    if not _uses_fts(connection):
+        return
+    rows = [r for r in rows if not r.get('is_deleted')]
+    if rows:
+        connection.execute(
+            text(f'INSERT INTO {FTS_TABLE} (content, message_id, channel_id) VALUES (:content, :id, :channel_id)'),
+            [{'content': r['content'], 'id': r['id'], 'channel_id': r['channel_id']} for r in rows],
+        )
+
+
+def remove_messages(connection, message_ids):
+    if not _uses_fts(connection) or not message_ids:
+        return
+    connection.execute(
+        text(f'DELETE FROM {FTS_TABLE} WHERE message_id = :id'),
+        [{'id': message_id} for message_id in message_ids],
+    )
+
+
+def remove_channel(connection, channel_id):
+    if _uses_fts(connection):
+        connection.execute(text(f'DELETE FROM {FTS_TABLE} WHERE channel_id = :channel_id'),
+                           {'channel_id': channel_id})
+
+
+@event.listens_for(Message, 'after_insert')
+def _message_inserted(mapper, connection, target):
+    index_rows(connection, [{'id': target.id, 'channel_id': target.channel_id,
+                             'content': target.content, 'is_deleted': target.is_deleted}])
+
+
+@event.listens_for(Message, 'after_update')
+def _message_updated(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.content.history.has_changes() or state.attrs.is_deleted.history.has_changes():
+        remove_messages(connection, [target.id])
+        index_rows(connection, [{'id': target.id, 'channel_id': target.channel_id,
+                                 'content': target.content, 'is_deleted': target.is_deleted}])
+
+
+@event.listens_for(Message, 'after_delete')
+def _message_deleted(mapper, connection, target):
+    remove_messages(connection, [target.id])
+
+
+def _fts_query(q):
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    terms = re.findall(r'\w+', q, flags=re.UNICODE)
+    return ' '.join(f'"{t}"' for t in terms)
+
+
+def search_messages(q, limit, user_id=None, channel_id=None, after=None):
+    """Return up to `limit` + 1 (Message, rank) pairs, best match first.
+
+    Searches `channel_id` when given, otherwise every channel `user_id`
+    belongs to. Membership and the soft-delete filter are part of the
+    query, so a full page is always `limit` live hits.
+    `after` is the (rank, id) of the last result of the previous page.
+    Lower rank is better on both backends.
+    """
+    if not q.strip():
+        return []
+    if _uses_fts(db.session.connection()):
+        terms = _fts_query(q)
+        if not terms:
+            return []
+        fts = literal_column(FTS_TABLE)
+        hits = select(
+            literal_column('message_id').label('id'), func.bm25(fts).label('rank'),
+        ).select_from(table(FTS_TABLE)).where(fts.op('MATCH')(terms))
+    else:
+        # Spelled out so the expression matches the GIN index from migration 0004
+        document = literal_column("to_tsvector('simple', messages.content)")
+        query = func.plainto_tsquery(literal_column("'simple'"), q)
+        hits = select(
+            Message.id.label('id'), (-func.ts_rank(document, query)).label('rank'),
+        ).where(document.op('@@')(query))
+    hits = hits.subquery('hits')
+
+    if channel_id is not None:
+        scope = Message.channel_id == channel_id
+    else:
+        scope = Message.channel_id.in_(
+            select(Channel.id).outerjoin(
+                ChannelMembership,
+                and_(ChannelMembership.channel_id == Channel.id, ChannelMembership.user_id == user_id),
+            ).where(Channel.deleted_at.is_(None), member_clause())
+        )
+    stmt = select(Message, hits.c.rank).join(hits, hits.c.id == Message.id).where(
+        Message.is_deleted.is_(False), scope)
+    if after:
+        after_rank, after_id = after
+        stmt = stmt.where(or_(hits.c.rank > after_rank,
+                              and_(hits.c.rank == after_rank, Message.id > after_id)))
+    stmt = stmt.order_by(hits.c.rank, Message.id).limit(limit + 1)
+    return [(message, rank) for message, rank in db.session.execute(stmt).all()]
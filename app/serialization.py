@@ -0,0 +1,141 @@
+"""JSON encoding for HTTP responses and Socket.IO packets, and cached message bytes.
+
+orjson is used when it is installed, and the standard library json
+module otherwise. Both produce the same documents. Flask's jsonify
+(through JSONProvider) and Socket.IO packets (through `socket_json`) both
+use this module.
+
+A RawJSON value is already-encoded JSON that is copied into the output
+as is. `message_json` encodes a message once into bytes and caches the
+result by message id and version. The socket broadcast of a new message
+and every later history page that includes it reuse those bytes instead
+of calling Message.to_dict and encoding again.
+"""
+from flask.json.provider import DefaultJSONProvider
+from .cache import TTLCache
+import json
+import secrets
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised by the stdlib fallback
+    orjson = None
+
+# Encoded JSON per (message id, edited_at, is_deleted, author display name)
+message_cache = TTLCache('message_json', maxsize=20000, ttl=300)
+
+_MARK = secrets.token_hex(8)
+_SPLIT = ('"\\u0000' + _MARK).encode()
+_END = '\\u0000"'.encode()
+
+
+class RawJSON:
+    """A value that is already encoded JSON (bytes)."""
+    __slots__ = ('encoded',)
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+    def __reduce__(self):
+        return (RawJSON, (self.encoded,))
+
+
+def dumps(obj, default=None, sort_keys=False, indent=None):
+    """Encode `obj` to compact UTF-8 JSON bytes, splicing in RawJSON values."""
+    raw = []
+
+    def fallback(value):
+        if isinstance(value, RawJSON):
+            raw.append(value.encoded)
+            return f'\x00{_MARK}{len(raw) - 1}\x00'
+        if default is not None:
+            return default(value)
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+    if orjson is not None and indent is None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        encoded = orjson.dumps(obj, default=fallback, option=option)
+    else:
+        separators = None if indent is not None else (',', ':')
+        encoded = json.dumps(obj, default=fallback, sort_keys=sort_keys, indent=indent,
+                             separators=separators, ensure_ascii=False).encode()
+    if not raw:
+        return encoded
+    # Each placeholder is "\u0000<mark><index>\u0000" in the output
+    parts = encoded.split(_SPLIT)
+    out = [parts[0]]
+    for part in parts[1:]:
+        end = part.index(_END)
+        out.append(raw[int(part[:end])])
+        out.append(part[end + len(_END):])
+    return b''.join(out)
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def extend_json(encoded, **fields):
+    """Add `fields` to the encoded JSON object `encoded` without decoding it."""
+    if not fields:
+        return encoded
+    extra = b','.join(dumps(k) + b':' + dumps(v) for k, v in fields.items())
+    return encoded[:-1] + (b',' if encoded != b'{}' else b'') + extra + b'}'
+
+
+def message_json(msg, user=None):
+    """Message.to_dict(user) as JSON bytes, encoded once per message version.
+
+    `user` is the author profile dict from app/profiles.py, as for to_dict.
+    """
+    if user is None and msg.user_id:
+        from .profiles import get_profile
+        user = get_profile(msg.user_id)
+    key = (msg.id, msg.edited_at, msg.is_deleted, user['display_name'] if user else None)
+    encoded = message_cache.get(key)
+    if encoded is None:
+        encoded = dumps(msg.to_dict(user=user))
+        message_cache.set(key, encoded)
+    return encoded
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's default provider on the faster encoder; understands RawJSON."""
+
+    def dumps(self, obj, **kwargs):
+        kwargs.pop('separators', None)
+        if set(kwargs) - {'default', 'sort_keys', 'indent'}:
+            return super().dumps(obj, **kwargs)
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return dumps(obj, **kwargs).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = 2 if self.compact is False or (self.compact is None and self._app.debug) else None
+        body = dumps(obj, default=self.default, sort_keys=self.sort_keys, indent=indent)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+class socket_json:
+    """json-module stand-in for python-socketio/engineio packets."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return dumps(obj).decode()
+
+    @staticmethod
+    def loads(data, **kwargs):
+        if orjson is not None:
+            return orjson.loads(data)
+        from engineio import json as engineio_json
+        return engineio_json.loads(data, **kwargs)
@@ -0,0 +1,231 @@
+"""Message-queue backends for cross-worker Socket.IO fan-out.
+
+With SOCKETIO_MESSAGE_QUEUE_URL set, every emit is published on a shared
+channel and replayed by the other workers, so `emit(..., room=...)` from
+any process reaches sockets held by all of them. redis://, kafka://,
+zmq+tcp:// and kombu URLs use the python-socketio managers. local://host:port
+uses the small TCP broker in this module, which needs no external service:
+
+    python -m app.socket_queue --port 6380
+    SOCKETIO_MESSAGE_QUEUE_URL=local://127.0.0.1:6380 gunicorn ...
+
+The broker relays lines of the form "PUB <channel> <json>" to every
+connection that sent "SUB <channel>". It also serves as the shared store
+behind local:// presence URLs (see app/presence.py): "PSET <channel>
+<sid> <user> <ttl>" and "PDEL <channel> <sid>", each answered with "OK"
+once applied, and "PGET <channel>", which answers with a JSON list of
+the users whose entries have not expired.
+Nothing is persisted, so a broker restart drops in-flight broadcasts and
+presence is rebuilt from the next round of renewals.
+"""
+from urllib.parse import urlparse
+import argparse
+import json
+import socket
+import socketserver
+import threading
+import time
+import logging
+import socketio as socketio_lib
+from .serialization import socket_json
+
+logger = logging.getLogger(__name__)
+
+
+def client_manager_for(url, channel='flask-socketio'):
+    """Build the Socket.IO client manager for a message-queue URL (or None).
+
+    Queue managers publish with app/serialization.py's encoder, which
+    understands the RawJSON payloads that send_message broadcasts.
+    """
+    if not url:
+        return socketio_lib.Manager()
+    if url.startswith('local://'):
+        return LocalManager(url, channel=channel, json=socket_json)
+    if url.startswith(('redis://', 'rediss://')):
+        return socketio_lib.RedisManager(url, channel=channel, json=socket_json)
+    if url.startswith('kafka://'):
+        return socketio_lib.KafkaManager(url, channel=channel, json=socket_json)
+    if url.startswith('zmq'):
+        return socketio_lib.ZmqManager(url, channel=channel, json=socket_json)
+    return socketio_lib.KombuManager(url, channel=channel, json=socket_json)
+
+
+class LocalManager(socketio_lib.PubSubManager):
+    """Socket.IO client manager backed by a LocalBroker."""
+    name = 'local'
+
+    def __init__(self, url='local://127.0.0.1:6380', channel='socketio', write_only=False,
+                 logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or '127.0.0.1', parsed.port or 6380)
+        self._pub = None
+        self._pub_lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        return socket.create_connection(self.address, timeout=5)
+
+    def _publish(self, data):
+        line = f'PUB {self.channel} {self.json.dumps(data)}\n'.encode()
+        with self._pub_lock:
+            for attempt in range(2):
+                try:
+                    if self._pub is None:
+                        self._pub = self._connect()
+                    self._pub.sendall(line)
+                    return
+                except OSError as e:
+                    self._pub = None
+                    if attempt:
+                        self._get_logger().error(f'Cannot publish to local broker: {e}')
+
+    def _listen(self):
+        retry_sleep = 1
+        while not self._closed:
+            try:
+                conn = self._connect()
+                conn.settimeout(None)
+                conn.sendall(f'SUB {self.channel}\n'.encode())
+                retry_sleep = 1
+                with conn, conn.makefile('r', encoding='utf-8') as lines:
+                    for line in lines:
+                        if self._closed:
+                            return
+                        yield line.split(' ', 2)[2]
+            except OSError as e:
+                if self._closed:
+                    return
+                self._get_logger().error(f'Cannot receive from local broker, retrying in {retry_sleep}s: {e}')
+                time.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+
+    def close(self):
+        self._closed = True
+        with self._pub_lock:
+            if self._pub is not None:
+                self._pub.close()
+                self._pub = None
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self._send_lock = threading.Lock()
+
+    def handle(self):
+        broker = self.server.broker
+        subscribed = []
+        try:
+            for raw in self.rfile:
+                parts = raw.decode('utf-8').rstrip('\n').split(' ', 2)
+                if parts[0] == 'SUB' and len(parts) == 2:
+                    broker._subscribe(parts[1], self)
+                    subscribed.append(parts[1])
+                elif parts[0] == 'PUB' and len(parts) == 3:
+                    broker._publish(parts[1], raw)
+                elif parts[0] in ('PSET', 'PDEL', 'PGET'):
+                    reply = broker._presence_command(parts)
+                    if reply is not None:
+                        self.send(reply)
+        except OSError:
+            pass
+        finally:
+            for channel in subscribed:
+                broker._unsubscribe(channel, self)
+
+    def send(self, raw):
+        with self._send_lock:
+            self.wfile.write(raw)
+
+
+class _BrokerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalBroker:
+    """In-process TCP pub/sub broker for local:// message-queue URLs."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = _BrokerServer((host, port), _BrokerHandler)
+        self._server.broker = self
+        self._subscribers = {}
+        self._presence = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'local://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='local-broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            handlers = [h for subs in self._subscribers.values() for h in subs]
+            self._subscribers.clear()
+        for handler in handlers:
+            try:
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _subscribe(self, channel, handler):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(handler)
+
+    def _unsubscribe(self, channel, handler):
+        with self._lock:
+            self._subscribers.get(channel, set()).discard(handler)
+
+    def _publish(self, channel, raw):
+        with self._lock:
+            handlers = list(self._subscribers.get(channel, ()))
+        for handler in handlers:
+            try:
+                handler.send(raw)
+            except OSError:
+                self._unsubscribe(channel, handler)
+
+    def _presence_command(self, parts):
+        now = time.monotonic()
+        with self._lock:
+            if parts[0] == 'PSET':
+                sid, user_id, ttl = parts[2].split(' ')
+                self._presence.setdefault(parts[1], {})[sid] = (user_id, now + float(ttl))
+                return b'OK\n'
+            elif parts[0] == 'PDEL':
+                self._presence.get(parts[1], {}).pop(parts[2], None)
+                return b'OK\n'
+            else:
+                entries = self._presence.get(parts[1], {})
+                for sid in [sid for sid, (_, expires_at) in entries.items() if expires_at <= now]:
+                    del entries[sid]
+                if not entries:
+                    self._presence.pop(parts[1], None)
+                users = sorted({user_id for user_id, _ in entries.values()})
+                return (json.dumps(users) + '\n').encode()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the local Socket.IO message-queue broker.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6380)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    broker = LocalBroker(args.host, args.port).start()
+    logger.info(f'Local broker listening on {broker.url}')
+    try:
+        broker._thread.join()
+    except KeyboardInterrupt:
+        broker.stop()
@@ -1,19 +1,25 @@
 from flask import current_app, request
 from flask_socketio import join_room, leave_room, emit, disconnect
 from . import socketio, db
-from .models import Message, Channel, ChannelMembership, User
+from .models import Message, Channel, gen_uuid7
+from .message_writer import message_writer
+from .broadcast import room_batcher
+from .memberships import is_member
+from .presence import presence, presence_store, start_presence_renewer
+from .profiles import display_name_for, get_profile, get_profiles
+from .access_tokens import verify_access_token
+from .metrics import timed_event
+from .serialization import RawJSON, extend_json, message_json
+from .typing_indicators import record_typing, start_typing_worker
+from datetime import datetime
 import jwt
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Store connected user IDs per socket
-socket_users = {}
-# Track online users per channel: {channel_id: {user_id: {display_name, sid}}}
-channel_users = {}
-
 
 @socketio.on('connect')
+@timed_event('connect')
 def handle_connect(auth):
     """Authenticate socket connection via JWT token."""
     token = None
@@ -25,19 +31,14 @@ def handle_connect(auth):
         return False
     
     try:
-        payload = jwt.decode(token, current_app.config['JWT_SECRET'], 
-                           algorithms=[current_app.config.get('JWT_ALGORITHM', 'HS256')])
-        user_id = payload.get('sub')
-        if not user_id:
-            logger.warning('Invalid token: no sub')
-            return False
-        
-        # Store user_id for this socket
-        socket_users[request.sid] = user_id
-        user = User.query.get(user_id)
+        user_id = verify_access_token(token)
+
+        presence.connect(request.sid, user_id)
+        start_presence_renewer(current_app._get_current_object())
         emit('connected', {
             'user_id': user_id,
-            'display_name': user.display_name if user else 'Unknown'
+            'display_name': display_name_for(user_id),
+            'heartbeat_interval': current_app.config.get('PRESENCE_HEARTBEAT_INTERVAL', 30)
         })
         logger.info(f'Socket connected: {request.sid} -> user {user_id}')
         return True
@@ -53,81 +54,79 @@ def handle_connect(auth):
 
 
 @socketio.on('disconnect')
+@timed_event('disconnect')
 def handle_disconnect():
     """Clean up on disconnect."""
-    if request.sid in socket_users:
-        user_id = socket_users[request.sid]
-        # Remove user from all channel tracking
-        for channel_id in list(channel_users.keys()):
-            if user_id in channel_users[channel_id]:
-                del channel_users[channel_id][user_id]
-                # Notify others in the channel
-                room = f'channel:{channel_id}'
-                user = User.query.get(user_id)
-                emit('presence_update', {
-                    'user_id': user_id,
-                    'display_name': user.display_name if user else 'Unknown',
-                    'action': 'left'
-                }, room=room)
-        logger.info(f'Socket disconnected: {request.sid} -> user {user_id}')
-        del socket_users[request.sid]
+    channel_ids = presence.channels_for(request.sid)
+    user_id, _ = presence.disconnect(request.sid)
+    if user_id is None:
+        return
+    for channel_id in channel_ids:
+        _drop_presence(channel_id, user_id)
+    logger.info(f'Socket disconnected: {request.sid} -> user {user_id}')
+
+
+def _drop_presence(channel_id, user_id):
+    """Remove this socket from the shared store; announce if the user is gone."""
+    presence_store.remove(channel_id, request.sid, user_id)
+    # Another tab, possibly on another worker, keeps the user present
+    if user_id not in presence_store.online_users(channel_id):
+        record_typing(channel_id, user_id, False)
+        emit('presence_update', {
+            'user_id': user_id,
+            'display_name': display_name_for(user_id),
+            'action': 'left'
+        }, room=f'channel:{channel_id}')
 
 
 @socketio.on('join_channel')
+@timed_event('join_channel')
 def handle_join_channel(data):
     """Join a channel room and broadcast presence."""
     try:
-        if request.sid not in socket_users:
+        user_id = presence.user_for(request.sid)
+        if not user_id:
             return {'error': 'not authenticated'}
         
-        user_id = socket_users[request.sid]
         channel_id = data.get('channel_id')
         
         if not channel_id:
             return {'error': 'channel_id required'}
         
         # Verify membership
-        membership = ChannelMembership.query.filter_by(
-            channel_id=channel_id, user_id=user_id
-        ).first()
-        if not membership:
+        if not is_member(user_id, channel_id):
             return {'error': 'not a member'}
         
         # Join room
         room = f'channel:{channel_id}'
         join_room(room)
         
-        # Get current user info
-        user = User.query.get(user_id)
-        user_display_name = user.display_name if user else 'Unknown'
+        presence.join(request.sid, channel_id)
         
-        # Initialize channel tracking if needed
-        if channel_id not in channel_users:
-            channel_users[channel_id] = {}
-        
-        # Add this user to the channel's online users
-        channel_users[channel_id][user_id] = {
-            'display_name': user_display_name,
-            'sid': request.sid
-        }
+        # Online lists come from the store shared by all workers
+        online = presence_store.online_users(channel_id)
+        came_online = user_id not in online
+        presence_store.touch(channel_id, request.sid, user_id, current_app.config.get('PRESENCE_TTL', 90))
+        if came_online:
+            online.append(user_id)
         
         # Send current online users list to joining client
-        online_users_dict = {}
-        for uid, user_info in channel_users[channel_id].items():
-            online_users_dict[uid] = {
-                'id': uid,
-                'display_name': user_info['display_name']
-            }
+        profiles = get_profiles(online)
+        online_users_dict = {
+            uid: {'id': uid, 'display_name': profiles[uid]['display_name'] if uid in profiles else 'Unknown'}
+            for uid in online
+        }
         emit('online_users_list', {'users': online_users_dict})
         
-        # Broadcast presence update to room
-        emit('presence_update', {
-            'user_id': user_id,
-            'display_name': user_display_name,
-            'action': 'joined'
-        }, room=room)
+        # Other tabs of an already-present user do not re-announce them
+        if came_online:
+            emit('presence_update', {
+                'user_id': user_id,
+                'display_name': display_name_for(user_id),
+                'action': 'joined'
+            }, room=room)
         
-        logger.info(f'User {user_id} joined channel {channel_id}, online: {list(channel_users[channel_id].keys())}')
+        logger.info(f'User {user_id} joined channel {channel_id}, online: {len(online)}')
         return {'ok': True}
     except Exception as e:
         logger.error(f'Join channel error: {str(e)}')
@@ -135,13 +134,14 @@ def handle_join_channel(data):
 
 
 @socketio.on('leave_channel')
+@timed_event('leave_channel')
 def handle_leave_channel(data):
     """Leave a channel room."""
     try:
-        if request.sid not in socket_users:
+        user_id = presence.user_for(request.sid)
+        if not user_id:
             return {'error': 'not authenticated'}
         
-        user_id = socket_users[request.sid]
         channel_id = data.get('channel_id')
         
         if not channel_id:
@@ -150,16 +150,8 @@ def handle_leave_channel(data):
         room = f'channel:{channel_id}'
         leave_room(room)
         
-        # Remove user from channel tracking
-        if channel_id in channel_users and user_id in channel_users[channel_id]:
-            del channel_users[channel_id][user_id]
-        
-        user = User.query.get(user_id)
-        emit('presence_update', {
-            'user_id': user_id,
-            'display_name': user.display_name if user else 'Unknown',
-            'action': 'left'
-        }, room=room)
+        presence.leave(request.sid, channel_id)
+        _drop_presence(channel_id, user_id)
         
         logger.info(f'User {user_id} left channel {channel_id}')
         return {'ok': True}
@@ -168,14 +160,28 @@ def handle_leave_channel(data):
         return {'error': 'server error'}
 
 
+@socketio.on('heartbeat')
+@timed_event('heartbeat')
+def handle_heartbeat(data=None):
+    """Renew this socket's presence in every channel it has joined."""
+    user_id = presence.user_for(request.sid)
+    if not user_id:
+        return {'error': 'not authenticated'}
+    ttl = current_app.config.get('PRESENCE_TTL', 90)
+    for channel_id in presence.channels_for(request.sid):
+        presence_store.touch(channel_id, request.sid, user_id, ttl)
+    return {'ok': True}
+
+
 @socketio.on('send_message')
+@timed_event('send_message')
 def handle_send_message(data):
     """Send a message to a channel."""
     try:
-        if request.sid not in socket_users:
+        user_id = presence.user_for(request.sid)
+        if not user_id:
             return {'error': 'not authenticated'}
         
-        user_id = socket_users[request.sid]
         channel_id = data.get('channel_id')
         content = data.get('content', '').strip()
         temp_id = data.get('temp_id')
@@ -187,24 +193,32 @@ def handle_send_message(data):
             return {'error': 'message too long'}
         
         # Verify membership
-        membership = ChannelMembership.query.filter_by(
-            channel_id=channel_id, user_id=user_id
-        ).first()
-        if not membership:
+        if not is_member(user_id, channel_id):
             return {'error': 'not a member'}
         
-        # Create and persist message
-        msg = Message(channel_id=channel_id, user_id=user_id, content=content)
-        db.session.add(msg)
-        db.session.commit()
+        if current_app.config.get('GROUP_COMMIT_ENABLED'):
+            msg, queued = _submit_grouped(channel_id, user_id, content, temp_id)
+            if msg is None:
+                return {'error': 'server error'}
+            if queued:
+                # Saved with its batch and broadcast then; the client must not retry
+                return {'ok': True, 'id': msg.id, 'pending': True}
+        else:
+            # Create and persist message
+            msg = Message(channel_id=channel_id, user_id=user_id, content=content)
+            db.session.add(msg)
+            db.session.commit()
         
-        # Broadcast to room
-        user = User.query.get(user_id)
-        message_data = msg.to_dict(user=user)
-        message_data['temp_id'] = temp_id
+        # Broadcast to room; the encoded message is cached for history reads
+        message_data = RawJSON(extend_json(message_json(msg, get_profile(user_id)), temp_id=temp_id))
         
         room = f'channel:{channel_id}'
-        emit('message', message_data, room=room)
+        if current_app.config.get('BROADCAST_BATCH_ENABLED'):
+            room_batcher.start(current_app._get_current_object())
+            if not room_batcher.submit(room, message_data):
+                emit('message', message_data, room=room)
+        else:
+            emit('message', message_data, room=room)
         
         logger.info(f'User {user_id} sent message to channel {channel_id}')
         return {'ok': True, 'id': msg.id}
@@ -214,20 +228,70 @@ def handle_send_message(data):
         return {'error': 'server error'}
 
 
+def _submit_grouped(channel_id, user_id, content, temp_id):
+    """Queue a message on the group-commit writer; returns (transient Message, queued).
+
+    In the default 'flush' ack mode this blocks until the batch holding the
+    message has committed, and returns (None, False) if that commit failed.
+    If the wait times out the row stays queued: `queued` is True and the
+    message is broadcast when its batch commits.
+    """
+    row = {
+        'id': gen_uuid7(),
+        'channel_id': channel_id,
+        'user_id': user_id,
+        'content': content,
+        'created_at': datetime.utcnow(),
+        'edited_at': None,
+        'is_deleted': False,
+    }
+    message_writer.start(current_app._get_current_object())
+    pending = message_writer.submit(row)
+    if current_app.config.get('GROUP_COMMIT_ACK', 'flush') == 'flush':
+        try:
+            pending.wait(timeout=current_app.config.get('GROUP_COMMIT_ACK_TIMEOUT', 5))
+        except TimeoutError:
+            app = current_app._get_current_object()
+            pending.on_done(lambda error: _broadcast_queued(app, row, temp_id, error))
+            return Message(**row), True
+        except Exception as e:
+            logger.error(f'Group commit ack failed: {str(e)}')
+            return None, False
+    return Message(**row), False
+
+
+def _broadcast_queued(app, row, temp_id, error):
+    # Runs on the writer thread once a message acked as pending has resolved
+    if error is not None:
+        logger.error(f'Pending message {row["id"]} was not saved: {str(error)}')
+        return
+    with app.app_context():
+        msg = Message(**row)
+        message_data = RawJSON(extend_json(message_json(msg, get_profile(row['user_id'])), temp_id=temp_id))
+        socketio.emit('message', message_data, to=f'channel:{row["channel_id"]}')
+
+
 @socketio.on('typing')
+@timed_event('typing')
 def handle_typing(data):
     """Broadcast typing indicator."""
     try:
-        if request.sid not in socket_users:
+        user_id = presence.user_for(request.sid)
+        if not user_id:
             return
         
-        user_id = socket_users[request.sid]
         channel_id = data.get('channel_id')
         is_typing = data.get('is_typing', False)
         
         if not channel_id:
             return
         
+        if current_app.config.get('TYPING_COALESCE_INTERVAL_MS', 0):
+            # Coalesced into one 'typing_users' frame per room and interval
+            start_typing_worker(current_app._get_current_object())
+            record_typing(channel_id, user_id, bool(is_typing))
+            return
+        
         room = f'channel:{channel_id}'
         emit('typing', {
             'user_id': user_id,
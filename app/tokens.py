@@ -0,0 +1,122 @@
+"""Refresh-token store: issue, rotate, revoke and sweep.
+
+Only SHA-256 digests of refresh tokens are stored, looked up through the
+unique token_hash index. Every refresh rotates the token: the presented
+row is revoked and a new one is issued in the same family. Presenting an
+already-revoked token means it leaked, so the whole family is revoked.
+Revoked rows are kept until they expire so reuse can still be detected;
+`sweep_step` then deletes expired rows in batches.
+"""
+from datetime import datetime, timedelta
+from flask import current_app
+from . import db
+from .background import BackgroundWorker
+from .models import RefreshToken, gen_uuid7
+import hashlib
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidRefreshToken(Exception):
+    pass
+
+
+class RefreshTokenReused(InvalidRefreshToken):
+    pass
+
+
+def hash_token(raw):
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def issue_refresh_token(user_id, family_id=None):
+    """Create a refresh token for `user_id` and return the raw value.
+
+    The caller commits. Beyond REFRESH_TOKENS_PER_USER live tokens, the
+    user's oldest ones are deleted.
+    """
+    raw = str(uuid.uuid4())
+    now = datetime.utcnow()
+    token_id = gen_uuid7()
+    db.session.add(RefreshToken(
+        id=token_id,
+        user_id=user_id,
+        family_id=family_id or token_id,
+        token_hash=hash_token(raw),
+        created_at=now,
+        expires_at=now + timedelta(days=current_app.config.get('REFRESH_TOKEN_EXPIRE_DAYS', 30)),
+    ))
+    if family_id is None:
+        _enforce_cap(user_id)
+    return raw
+
+
+def _enforce_cap(user_id):
+    cap = current_app.config.get('REFRESH_TOKENS_PER_USER', 10)
+    db.session.flush()
+    stale = [row_id for (row_id,) in db.session.query(RefreshToken.id).filter(
+        RefreshToken.user_id == user_id,
+        RefreshToken.revoked_at.is_(None),
+    ).order_by(RefreshToken.created_at.desc(), RefreshToken.id.desc()).offset(cap)]
+    if stale:
+        RefreshToken.query.filter(RefreshToken.id.in_(stale)).delete(synchronize_session=False)
+
+
+def rotate_refresh_token(raw):
+    """Swap a valid refresh token for a new one; returns (user_id, new_raw)."""
+    rt = RefreshToken.query.filter_by(token_hash=hash_token(raw)).first()
+    now = datetime.utcnow()
+    if not rt or (rt.expires_at and rt.expires_at < now):
+        raise InvalidRefreshToken()
+    # Tokens issued before families existed form a family of their own
+    family_id = rt.family_id or rt.id
+    if rt.revoked_at is not None:
+        revoke_family(family_id)
+        db.session.commit()
+        logger.warning(f'Refresh token reuse detected for user {rt.user_id}; family revoked')
+        raise RefreshTokenReused()
+    # Conditional update so two concurrent refreshes cannot both succeed
+    claimed = RefreshToken.query.filter_by(id=rt.id, revoked_at=None).update(
+        {RefreshToken.revoked_at: now}, synchronize_session=False
+    )
+    if not claimed:
+        db.session.rollback()
+        raise RefreshTokenReused()
+    new_raw = issue_refresh_token(rt.user_id, family_id=family_id)
+    db.session.commit()
+    return rt.user_id, new_raw
+
+
+def revoke_refresh_token(raw):
+    RefreshToken.query.filter_by(token_hash=hash_token(raw), revoked_at=None).update(
+        {RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def revoke_family(family_id):
+    RefreshToken.query.filter_by(family_id=family_id, revoked_at=None).update(
+        {RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False
+    )
+
+
+def sweep_step(batch_size=None):
+    """Delete one batch of expired tokens; returns the number deleted."""
+    batch_size = batch_size or current_app.config.get('REFRESH_TOKEN_SWEEP_BATCH_SIZE', 1000)
+    expired = [row_id for (row_id,) in db.session.query(RefreshToken.id).filter(
+        RefreshToken.expires_at < datetime.utcnow()
+    ).limit(batch_size)]
+    if expired:
+        RefreshToken.query.filter(RefreshToken.id.in_(expired)).delete(synchronize_session=False)
+        db.session.commit()
+    return len(expired)
+
+
+token_sweeper = BackgroundWorker('refresh-token-sweep', sweep_step, interval=3600)
+
+
+def start_token_sweeper(app):
+    if app.config.get('REFRESH_TOKEN_SWEEPER', True):
+        token_sweeper.start(app, interval=app.config.get('REFRESH_TOKEN_SWEEP_INTERVAL', 3600))
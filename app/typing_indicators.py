@@ -0,0 +1,134 @@
+"""Server-side coalescing of typing indicators.
+
+Clients send a 'typing' event per keystroke burst. Instead of relaying
+each one to the whole room, handle_typing records it here: repeated
+"still typing" events from the same (user, channel) only push back that
+user's expiry, and an entry lapses after TYPING_EXPIRY_SECONDS without a
+refresh. Every TYPING_COALESCE_INTERVAL_MS the flusher emits a single
+'typing_users' frame to each room whose set of typers changed since its
+last frame, so a room sees at most one typing frame per interval however
+many people type in it. The frame goes to the whole room; clients drop
+their own id.
+
+Coalescing is opt-in (TYPING_COALESCE_INTERVAL_MS > 0) because clients
+must understand 'typing_users'; with 0, handle_typing relays each event
+as 'typing' as before.
+
+Each worker only sees the typing events of its own sockets, so typers
+are also written to the shared presence store (app/presence.py) under
+'typing:<channel id>'. A frame carries the typers read back from the
+store, merged across workers. The store entry is written when a user
+starts typing and rewritten once it is half an expiry old, not on every
+event.
+"""
+from . import socketio
+from .background import BackgroundWorker
+from .presence import presence_store
+import threading
+import time
+
+TOUCH = 'touch'
+REMOVE = 'remove'
+
+
+class TypingCoalescer:
+
+    def __init__(self, expiry=5.0):
+        self.expiry = expiry
+        self.inbound = 0
+        self.outbound = 0
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._dirty = set()
+        self._stored = {}
+
+    def update(self, channel_id, user_id, is_typing):
+        """Record one inbound typing event.
+
+        Returns TOUCH or REMOVE when the shared store entry needs writing,
+        else None.
+        """
+        now = time.monotonic()
+        write = None
+        with self._lock:
+            self.inbound += 1
+            typers = self._rooms.setdefault(channel_id, {})
+            if is_typing:
+                if user_id not in typers:
+                    self._dirty.add(channel_id)
+                typers[user_id] = now + self.expiry
+                if now - self._stored.get((channel_id, user_id), -self.expiry) >= self.expiry / 2:
+                    self._stored[(channel_id, user_id)] = now
+                    write = TOUCH
+            elif typers.pop(user_id, None) is not None:
+                self._dirty.add(channel_id)
+                self._stored.pop((channel_id, user_id), None)
+                write = REMOVE
+            if not typers:
+                del self._rooms[channel_id]
+        return write
+
+    def collect(self):
+        """Expire stale typers; return [(channel_id, expired user_ids)] for changed rooms."""
+        now = time.monotonic()
+        expired_by_room = {}
+        with self._lock:
+            for channel_id, typers in list(self._rooms.items()):
+                expired = [uid for uid, expires_at in typers.items() if expires_at <= now]
+                for uid in expired:
+                    del typers[uid]
+                    self._stored.pop((channel_id, uid), None)
+                if expired:
+                    self._dirty.add(channel_id)
+                    expired_by_room[channel_id] = expired
+                if not typers:
+                    del self._rooms[channel_id]
+            frames = [(channel_id, expired_by_room.get(channel_id, [])) for channel_id in self._dirty]
+            self._dirty.clear()
+            self.outbound += len(frames)
+            return frames
+
+    def stats(self):
+        return {'inbound': self.inbound, 'outbound': self.outbound, 'rooms': len(self._rooms)}
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self._dirty.clear()
+            self._stored.clear()
+
+
+typing_state = TypingCoalescer()
+
+
+def _store_key(channel_id):
+    return f'typing:{channel_id}'
+
+
+def record_typing(channel_id, user_id, is_typing):
+    """Record a typing event here and, when due, in the shared store."""
+    write = typing_state.update(channel_id, user_id, is_typing)
+    if write == TOUCH:
+        # Outlives the local entry, which lapses `expiry` after the last event
+        presence_store.touch(_store_key(channel_id), user_id, user_id, typing_state.expiry * 1.5)
+    elif write == REMOVE:
+        presence_store.remove(_store_key(channel_id), user_id, user_id)
+
+
+def flush_typing():
+    for channel_id, expired in typing_state.collect():
+        key = _store_key(channel_id)
+        for user_id in expired:
+            presence_store.remove(key, user_id, user_id)
+        socketio.emit('typing_users', {'channel_id': channel_id, 'user_ids': presence_store.online_users(key)},
+                      room=f'channel:{channel_id}')
+    # Never "busy": the worker ticks once per interval
+    return False
+
+
+typing_worker = BackgroundWorker('typing-coalescer', flush_typing)
+
+
+def start_typing_worker(app):
+    typing_state.expiry = app.config.get('TYPING_EXPIRY_SECONDS', 5)
+    typing_worker.start(app, interval=app.config.get('TYPING_COALESCE_INTERVAL_MS', 0) / 1000.0)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Frames/sec and CPU for per-message vs batched room broadcasts.
+
+    python benchmarks/bench_broadcast.py --receivers 500 --messages 500
+    python benchmarks/bench_broadcast.py --interval-ms 50 --max-batch 100
+
+One sender and --receivers listeners join the same channel through the
+in-process Socket.IO test client, and the sender sends --messages
+messages as fast as it can. Per mode, reports the frames delivered
+across all clients, frames/sec, and process CPU time per message.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db, socketio  # noqa: E402
+from app.broadcast import room_batcher  # noqa: E402
+from app.config import Config  # noqa: E402
+
+
+def make_app():
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+            'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+        BCRYPT_ROUNDS = 4
+        PASSWORD_HASH_WORKERS = 0
+        TYPING_COALESCE_INTERVAL_MS = 0
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def connect(app, http, name):
+    data = http.post('/api/auth/signup', json={'email': f'{name}@bench', 'password': 'x'}).get_json()
+    return socketio.test_client(app, flask_test_client=http, auth={'token': data['access_token']})
+
+
+def run(app, sender, receivers, channel_id, total):
+    for sio in [sender] + receivers:
+        sio.get_received()
+    cpu, wall = time.process_time(), time.perf_counter()
+    for i in range(total):
+        sender.emit('send_message', {'channel_id': channel_id, 'content': f'm{i}'}, callback=True)
+    room_batcher.stop()
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    frames = delivered = 0
+    for sio in receivers:
+        for packet in sio.get_received():
+            if packet['name'] == 'message':
+                frames += 1
+                delivered += 1
+            elif packet['name'] == 'messages':
+                frames += 1
+                delivered += len(packet['args'][0]['messages'])
+    return frames, delivered, wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--receivers', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--interval-ms', type=int, default=20)
+    parser.add_argument('--max-batch', type=int, default=50)
+    args = parser.parse_args()
+
+    app = make_app()
+    app.config['BROADCAST_BATCH_INTERVAL_MS'] = args.interval_ms
+    app.config['BROADCAST_BATCH_MAX'] = args.max_batch
+    with app.app_context():
+        http = app.test_client()
+        sender = connect(app, http, 'sender')
+        token = http.post('/api/auth/login', json={'email': 'sender@bench', 'password': 'x'}).get_json()
+        channel_id = http.post('/api/channels', json={'name': 'bench'}, headers={
+            'Authorization': f'Bearer {token["access_token"]}'}).get_json()['channel']['id']
+        receivers = [connect(app, http, f'r{i}') for i in range(args.receivers)]
+        for sio in [sender] + receivers:
+            sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+
+        print(f'{args.receivers} receivers, {args.messages} messages')
+        for mode, enabled in (('per-message', False), ('batched', True)):
+            app.config['BROADCAST_BATCH_ENABLED'] = enabled
+            frames, delivered, wall, cpu = run(app, sender, receivers, channel_id, args.messages)
+            print(f'{mode:>12}: {frames:8d} frames  {frames / wall:10.0f} frames/s  '
+                  f'{cpu / args.messages * 1000:6.2f}ms CPU/msg  ({delivered} messages delivered)')
+
+
+if __name__ == '__main__':
+    main()
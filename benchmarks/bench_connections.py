@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""Concurrent Socket.IO connections one worker holds in each async mode.
+
+    python benchmarks/bench_connections.py --connections 2000
+    python benchmarks/bench_connections.py --modes eventlet gevent --hold 20
+
+For each mode, starts run.py's app in a subprocess with
+SOCKETIO_ASYNC_MODE set and opens --connections authenticated websocket
+connections to it, --concurrency at a time, from a single asyncio
+client. The connections are then held open for --hold seconds. Reported
+per mode: connections established and still open after the hold,
+connect latency p50/p99, and the server's OS threads and RSS while
+holding. Raise `ulimit -n` first for large counts.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER = ("import run; run.socketio.run(run.app, host='127.0.0.1', port={port}, "
+          "allow_unsafe_werkzeug=True, log_output=False)")
+
+
+def start_server(mode, port):
+    env = dict(os.environ, SOCKETIO_ASYNC_MODE=mode, PORT=str(port), BCRYPT_ROUNDS='4',
+               PASSWORD_HASH_WORKERS='0', CHANNEL_PURGE_WORKER='0', REFRESH_TOKEN_SWEEPER='0',
+               DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    proc = subprocess.Popen([sys.executable, '-c', SERVER.format(port=port)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/healthz', timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def signup(port):
+    body = json.dumps({'email': f'bench{time.time_ns()}@bench', 'password': 'x'}).encode()
+    req = urllib.request.Request(f'http://127.0.0.1:{port}/api/auth/signup', data=body,
+                                 headers={'Content-Type': 'application/json'})
+    return json.load(urllib.request.urlopen(req))['access_token']
+
+
+def server_stats(pid):
+    stats = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Threads', 'VmRSS'):
+                stats[key] = value.strip()
+    return stats
+
+
+def ws_frame(text):
+    data = text.encode()
+    mask = os.urandom(4)
+    if len(data) < 126:
+        header = bytes([0x81, 0x80 | len(data)])
+    else:
+        header = bytes([0x81, 0x80 | 126]) + len(data).to_bytes(2, 'big')
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+async def ws_read(reader):
+    head = await reader.readexactly(2)
+    length = head[1] & 0x7f
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), 'big')
+    return head[0] & 0x0f, (await reader.readexactly(length)).decode(errors='replace')
+
+
+async def open_socket(port, token):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f'GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\n'
+                  f'Host: 127.0.0.1:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                  f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+    status = await reader.readuntil(b'\r\n\r\n')
+    if b' 101 ' not in status.split(b'\r\n', 1)[0]:
+        raise ConnectionError(status.split(b'\r\n', 1)[0].decode())
+    await ws_read(reader)  # engine.io open packet
+    writer.write(ws_frame('40' + json.dumps({'token': token})))
+    while True:
+        _, packet = await ws_read(reader)
+        if packet.startswith('40'):
+            return reader, writer
+        if packet.startswith('44'):
+            raise ConnectionError(packet)
+
+
+async def keep_alive(reader, writer):
+    # Answer engine.io pings until the server closes the socket
+    try:
+        while True:
+            opcode, packet = await ws_read(reader)
+            if opcode == 0x8:
+                return False
+            if packet == '2':
+                writer.write(ws_frame('3'))
+    except (OSError, asyncio.IncompleteReadError):
+        return False
+
+
+async def hold_connections(port, token, total, concurrency, hold, pid):
+    limit = asyncio.Semaphore(concurrency)
+    latencies, sockets, errors = [], [], []
+
+    async def one():
+        async with limit:
+            started = time.perf_counter()
+            try:
+                sockets.append(await asyncio.wait_for(open_socket(port, token), 30))
+                latencies.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                errors.append(e)
+
+    await asyncio.gather(*(one() for _ in range(total)))
+    watchers = [asyncio.ensure_future(keep_alive(r, w)) for r, w in sockets]
+    await asyncio.sleep(hold)
+    stats = server_stats(pid)
+    still_open = sum(1 for w in watchers if not w.done())
+    for watcher in watchers:
+        watcher.cancel()
+    for _, writer in sockets:
+        writer.close()
+    latencies.sort()
+    pick = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] if latencies else 0
+    return len(sockets), still_open, pick(50), pick(99), stats, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['threading', 'eventlet'])
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--hold', type=float, default=5)
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    print(f'{args.connections} connections, {args.concurrency} at a time, held {args.hold:.0f}s')
+    for mode in args.modes:
+        proc = start_server(mode, args.port)
+        try:
+            token = signup(args.port)
+            opened, still_open, p50, p99, stats, errors = asyncio.run(hold_connections(
+                args.port, token, args.connections, args.concurrency, args.hold, proc.pid))
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f'{mode:>10}: {opened:6d} opened  {still_open:6d} held  connect p50 {p50:7.1f}ms '
+              f'p99 {p99:7.1f}ms  server threads {stats.get("Threads")}  RSS {stats.get("VmRSS")}'
+              + (f'  ({len(errors)} failed: {errors[0]!r})' if errors else ''))
+
+
+if __name__ == '__main__':
+    main()
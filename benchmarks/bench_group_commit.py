@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Compare messages/sec for per-message commits vs the group-commit writer.
+
+    python benchmarks/bench_group_commit.py --messages 2000 --threads 16
+    DATABASE_URL=postgresql://... python benchmarks/bench_group_commit.py
+
+Each sender thread mimics handle_send_message's write: per-message mode
+adds and commits one Message; group mode submits the row to the writer
+and waits for the flush ack (GROUP_COMMIT_ACK='flush').
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.config import Config  # noqa: E402
+from app.message_writer import message_writer  # noqa: E402
+from app.models import Channel, Message, User, gen_uuid, gen_uuid7  # noqa: E402
+
+
+def make_app():
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+            'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def run(app, mode, total, threads):
+    with app.app_context():
+        user = User(email=f'{gen_uuid()}@bench', password_hash='x', display_name='bench')
+        channel = Channel(name='bench')
+        db.session.add_all([user, channel])
+        db.session.commit()
+        user_id, channel_id = user.id, channel.id
+
+    per_thread = total // threads
+    errors = []
+
+    def sender():
+        with app.app_context():
+            for i in range(per_thread):
+                try:
+                    if mode == 'per-message':
+                        db.session.add(Message(channel_id=channel_id, user_id=user_id, content=f'm{i}'))
+                        db.session.commit()
+                    else:
+                        message_writer.submit({
+                            'id': gen_uuid7(), 'channel_id': channel_id, 'user_id': user_id,
+                            'content': f'm{i}', 'created_at': datetime.utcnow(),
+                            'edited_at': None, 'is_deleted': False,
+                        }).wait(timeout=30)
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(e)
+
+    if mode == 'group':
+        message_writer.start(app)
+    workers = [threading.Thread(target=sender) for _ in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    if mode == 'group':
+        message_writer.stop()
+    sent = per_thread * threads - len(errors)
+    return sent / elapsed, elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--interval-ms', type=int, default=5)
+    parser.add_argument('--max-batch', type=int, default=100)
+    args = parser.parse_args()
+
+    app = make_app()
+    app.config['GROUP_COMMIT_INTERVAL_MS'] = args.interval_ms
+    app.config['GROUP_COMMIT_MAX_BATCH'] = args.max_batch
+    print(f'{args.messages} messages, {args.threads} sender threads, {app.config["SQLALCHEMY_DATABASE_URI"]}')
+    for mode in ('per-message', 'group'):
+        rate, elapsed, errors = run(app, mode, args.messages, args.threads)
+        print(f'{mode:>12}: {rate:9.0f} msg/s  ({elapsed:.2f}s, {errors} errors)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Insert and range-scan cost of random uuid4 vs time-ordered UUIDv7 keys.
+
+    python benchmarks/bench_ids.py --rows 200000
+    DATABASE_URL=postgresql://... python benchmarks/bench_ids.py
+
+Creates a scratch table shaped like `messages` (string primary key plus the
+history index), inserts the same number of rows with each id generator and
+then times ordered range scans over the primary key.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy as sa  # noqa: E402
+from app.models import gen_uuid, gen_uuid7  # noqa: E402
+
+
+def make_table(metadata, name):
+    return sa.Table(
+        name, metadata,
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('channel_id', sa.String(36), nullable=False),
+        sa.Column('content', sa.Text, nullable=False),
+        sa.Column('created_at', sa.DateTime, nullable=False),
+        sa.Index(f'ix_{name}_history', 'channel_id', 'created_at', 'id'),
+    )
+
+
+def bench(engine, table, gen, rows, batch):
+    base = datetime(2024, 1, 1)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for offset in range(0, rows, batch):
+            conn.execute(table.insert(), [
+                {'id': gen(), 'channel_id': 'c', 'content': 'x' * 64,
+                 'created_at': base + timedelta(milliseconds=offset + i)}
+                for i in range(min(batch, rows - offset))
+            ])
+    insert_s = time.perf_counter() - started
+
+    with engine.connect() as conn:
+        ids = [r[0] for r in conn.execute(sa.select(table.c.id).order_by(table.c.id).limit(200))]
+        started = time.perf_counter()
+        for start in ids:
+            conn.execute(
+                sa.select(table).where(table.c.id > start).order_by(table.c.id).limit(100)
+            ).fetchall()
+        scan_s = time.perf_counter() - started
+    return insert_s, scan_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+
+    url = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'ids.db')
+    engine = sa.create_engine(url)
+    metadata = sa.MetaData()
+    tables = {'uuid4': make_table(metadata, 'bench_ids_v4'), 'uuid7': make_table(metadata, 'bench_ids_v7')}
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    print(f'{args.rows} rows, {url}')
+    try:
+        for name, gen in (('uuid4', gen_uuid), ('uuid7', gen_uuid7)):
+            insert_s, scan_s = bench(engine, tables[name], gen, args.rows, args.batch)
+            print(f'{name}: insert {args.rows / insert_s:9.0f} rows/s   200 range scans {scan_s * 1000:7.1f} ms')
+    finally:
+        metadata.drop_all(engine)
+
+
+if __name__ == '__main__':
+    main()
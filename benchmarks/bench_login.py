@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Measure login throughput with inline bcrypt vs the hashing process pool.
+
+    python benchmarks/bench_login.py --threads 32 --seconds 10 --rounds 12
+    python benchmarks/bench_login.py --workers 4 --queue-limit 8
+
+Login threads hammer /api/auth/login for a fixed time while a probe
+thread polls /healthz, standing in for message traffic on the same
+process. Reported per mode: successful logins/sec, 503 rejections, and
+probe latency p50/p99.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db, passwords  # noqa: E402
+from app.config import Config  # noqa: E402
+
+
+def make_app(rounds):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+            'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+        BCRYPT_ROUNDS = rounds
+        CHANNEL_PURGE_WORKER = False
+        REFRESH_TOKEN_SWEEPER = False
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def run(app, threads, seconds):
+    stop = threading.Event()
+    counts = {'ok': 0, 'busy': 0, 'other': 0}
+    lock = threading.Lock()
+    probe_ms = []
+    creds = {'email': 'bench@example.com', 'password': 'BenchPassword123'}
+
+    def login():
+        client = app.test_client()
+        while not stop.is_set():
+            status = client.post('/api/auth/login', json=creds).status_code
+            key = 'ok' if status == 200 else 'busy' if status == 503 else 'other'
+            with lock:
+                counts[key] += 1
+
+    def probe():
+        client = app.test_client()
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get('/healthz')
+            probe_ms.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.01)
+
+    workers = [threading.Thread(target=login) for _ in range(threads)]
+    workers.append(threading.Thread(target=probe))
+    for w in workers:
+        w.start()
+    time.sleep(seconds)
+    stop.set()
+    for w in workers:
+        w.join()
+    return counts, probe_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--queue-limit', type=int, default=32)
+    args = parser.parse_args()
+
+    app = make_app(args.rounds)
+    app.config['PASSWORD_HASH_WORKERS'] = 0
+    app.test_client().post('/api/auth/signup', json={
+        'email': 'bench@example.com', 'password': 'BenchPassword123'})
+    print(f'{args.threads} login threads for {args.seconds:.0f}s, bcrypt cost {args.rounds}')
+
+    for mode, workers in (('inline', 0), (f'pool x{args.workers}', args.workers)):
+        app.config['PASSWORD_HASH_WORKERS'] = workers
+        app.config['PASSWORD_HASH_QUEUE_LIMIT'] = args.queue_limit
+        if workers:
+            # Warm the pool so process spawn is not counted
+            with app.app_context():
+                passwords.verify_password('x', passwords.hash_password('x'))
+        counts, probe_ms = run(app, args.threads, args.seconds)
+        print(f'{mode:>10}: {counts["ok"] / args.seconds:8.1f} logins/s  '
+              f'{counts["busy"]} rejected (503)  {counts["other"]} errors  '
+              f'probe p50 {percentile(probe_ms, 50):.1f}ms p99 {percentile(probe_ms, 99):.1f}ms')
+    passwords.shutdown_pool()
+
+
+if __name__ == '__main__':
+    main()
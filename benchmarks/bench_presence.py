@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Presence registry throughput at 50k sockets across 5k channels.
+
+    python benchmarks/bench_presence.py --sockets 50000 --channels 5000
+    python benchmarks/bench_presence.py --threads 8
+
+Each socket belongs to one of sockets/2 users (so most users have two
+tabs) and joins --per-socket random channels. Times connect+join,
+leave, and disconnect for every socket, spread across --threads threads.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.presence import PresenceRegistry  # noqa: E402
+
+
+def timed(label, fn, shards, ops):
+    threads = [threading.Thread(target=fn, args=(shard,)) for shard in shards]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    print(f'{label:>11}: {ops / elapsed:10.0f} ops/s  ({elapsed * 1000:.0f}ms for {ops} ops)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sockets', type=int, default=50000)
+    parser.add_argument('--channels', type=int, default=5000)
+    parser.add_argument('--per-socket', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    sockets = [(f'sid{i}', f'user{i // 2}', rng.sample(range(args.channels), args.per_socket))
+               for i in range(args.sockets)]
+    shards = [sockets[i::args.threads] for i in range(args.threads)]
+    registry = PresenceRegistry()
+    joins = args.sockets * args.per_socket
+
+    def connect_and_join(shard):
+        for sid, user_id, channels in shard:
+            registry.connect(sid, user_id)
+            for channel_id in channels:
+                registry.join(sid, channel_id)
+
+    def leave_first(shard):
+        for sid, _, channels in shard:
+            registry.leave(sid, channels[0])
+
+    def disconnect(shard):
+        for sid, _, _ in shard:
+            registry.disconnect(sid)
+
+    print(f'{args.sockets} sockets, {args.channels} channels, {args.per_socket} joins each, '
+          f'{args.threads} threads')
+    timed('join', connect_and_join, shards, args.sockets + joins)
+    print(f'{"":>11}  {registry.socket_count()} sockets, {registry.channel_count()} channels online')
+    timed('leave', leave_first, shards, args.sockets)
+    timed('disconnect', disconnect, shards, args.sockets)
+    assert registry.socket_count() == 0 and registry.channel_count() == 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Cost of serializing a history page of messages, per encoder and path.
+
+    python benchmarks/bench_serialization.py --page 100 --rounds 2000
+
+Builds --page messages from 10 authors and times encoding a full
+history page body ({'messages': [...], 'next_cursor': ..., ...}):
+
+    to_dict + flask json      what get_messages did before (stdlib, sorted keys)
+    to_dict + fast encoder    the same dicts through app/serialization.py
+    message_json, cold        encode-once bytes with an empty cache
+    message_json, cached      page assembled from cached bytes
+
+The fast-encoder rows are run with orjson and again with the stdlib
+fallback, which is what a deployment without orjson gets.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from app import serialization  # noqa: E402
+from app.models import Message  # noqa: E402
+from app.serialization import RawJSON, dumps, message_json, message_cache  # noqa: E402
+
+
+def make_page(size):
+    authors = [{'id': str(uuid.uuid4()), 'display_name': f'user {i}'} for i in range(10)]
+    start = datetime(2024, 1, 1)
+    messages = []
+    for i in range(size):
+        author = authors[i % len(authors)]
+        messages.append(Message(id=str(uuid.uuid4()), channel_id='c', user_id=author['id'],
+                                content=f'message number {i} with some ordinary chat text',
+                                created_at=start + timedelta(seconds=i, microseconds=i),
+                                edited_at=None, is_deleted=False))
+    return messages, {a['id']: a for a in authors}
+
+
+def envelope(items):
+    return {'messages': items, 'next_cursor': 'abc', 'prev_cursor': 'def', 'has_more': True}
+
+
+def timed(rounds, fn):
+    fn()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--page', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    messages, profiles = make_page(args.page)
+    flask_json = DefaultJSONProvider(Flask('bench'))
+
+    def flask_page():
+        return flask_json.dumps(envelope([m.to_dict(user=profiles[m.user_id]) for m in messages]))
+
+    def fast_page():
+        return dumps(envelope([m.to_dict(user=profiles[m.user_id]) for m in messages]))
+
+    def cold_page():
+        message_cache.clear()
+        return dumps(envelope([RawJSON(message_json(m, profiles[m.user_id])) for m in messages]))
+
+    def cached_page():
+        return dumps(envelope([RawJSON(message_json(m, profiles[m.user_id])) for m in messages]))
+
+    print(f'{args.page}-message page, {len(flask_page())} bytes, µs per page')
+    print(f'{"to_dict + flask json":>24}: {timed(args.rounds, flask_page):9.1f}')
+    backends = [('orjson', serialization.orjson), ('stdlib', None)] if serialization.orjson else \
+        [('stdlib', None)]
+    for name, module in backends:
+        serialization.orjson = module
+        print(f'[{name}]')
+        print(f'{"to_dict + fast encoder":>24}: {timed(args.rounds, fast_page):9.1f}')
+        print(f'{"message_json, cold":>24}: {timed(args.rounds, cold_page):9.1f}')
+        print(f'{"message_json, cached":>24}: {timed(args.rounds, cached_page):9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+"""Load test: a swarm of simulated users over REST and Socket.IO.
+
+    python benchmarks/loadtest.py --users 50 --duration 30
+    DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --users 200
+    python benchmarks/loadtest.py --save sqlite-threading
+    python benchmarks/loadtest.py --compare sqlite-threading
+
+Without --url the app is started from run.py in a subprocess on a free
+port, with a fresh SQLite database or DATABASE_URL, and with any
+--env KEY=VALUE settings (e.g. --env GROUP_COMMIT_ENABLED=1). Each
+simulated user signs up, lists channels and joins one of --channels
+rooms over a websocket. Then, until --duration runs out, it picks one
+action per --think-ms by weight: send a message, send typing events,
+page through history, or list channels.
+
+Reported per action: count, errors and p50/p95/p99 latency (message
+sends are timed to their ack). Packets the socket reader cannot handle
+are counted as errors of the 'socket_packet' action. Also reported: acked
+messages/sec, and fan-out delay from send to arrival at every other
+member of the room.
+--save writes the results to benchmarks/baselines/<name>.json, and
+--compare prints the change against such a file. Baselines are only
+comparable on the same machine and settings.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, 'benchmarks', 'baselines')
+SERVER = ("import run; run.socketio.run(run.app, host='127.0.0.1', port={port}, "
+          "allow_unsafe_werkzeug=True, log_output=False)")
+ACTIONS = {'send_message': 50, 'typing': 25, 'history': 15, 'list_channels': 10}
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+class Recorder:
+    """Latency samples and error counts per action, shared by all users."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.fanout = []
+        self._lock = threading.Lock()
+
+    def timed(self, action, fn, *args):
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            self.error(action)
+            return None
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.samples.setdefault(action, []).append(elapsed)
+        return result
+
+    def error(self, action):
+        with self._lock:
+            self.errors[action] = self.errors.get(action, 0) + 1
+
+    def delivered(self, delay_ms):
+        with self._lock:
+            self.fanout.append(delay_ms)
+
+    def summary(self, duration):
+        actions = {}
+        for action in sorted(set(self.samples) | set(self.errors)):
+            samples = sorted(self.samples.get(action, []))
+            actions[action] = {
+                'count': len(samples), 'errors': self.errors.get(action, 0),
+                'p50_ms': percentile(samples, 50), 'p95_ms': percentile(samples, 95),
+                'p99_ms': percentile(samples, 99),
+            }
+        fanout = sorted(self.fanout)
+        return {
+            'actions': actions,
+            'messages_per_sec': len(self.samples.get('send_message', [])) / duration,
+            'fanout': {'deliveries': len(fanout), 'p50_ms': percentile(fanout, 50),
+                       'p95_ms': percentile(fanout, 95), 'p99_ms': percentile(fanout, 99)},
+        }
+
+
+class SocketClient:
+    """Minimal Socket.IO-over-websocket client (EIO 4, text frames only)."""
+
+    def __init__(self, host, port, token, on_event, on_error=None):
+        self.on_event = on_event
+        self.on_error = on_error or (lambda: None)
+        self._sock = socket.create_connection((host, port), timeout=30)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self._sock.sendall((f'GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\n'
+                            f'Host: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                            f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+        self._buf = b''
+        while b'\r\n\r\n' not in self._buf:
+            self._buf += self._sock.recv(4096)
+        status, self._buf = self._buf.split(b'\r\n\r\n', 1)
+        if b' 101 ' not in status.split(b'\r\n', 1)[0]:
+            raise ConnectionError(status.split(b'\r\n', 1)[0].decode())
+        self._send_lock = threading.Lock()
+        self._acks = {}
+        self._ack_id = 0
+        self._cond = threading.Condition()
+        self._read()  # engine.io open packet
+        self._send('40' + json.dumps({'token': token}))
+        while True:
+            packet = self._read()
+            if packet.startswith('40'):
+                break
+            if packet.startswith('44'):
+                raise ConnectionError(packet)
+        self._sock.settimeout(None)
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def _recv_exact(self, n):
+        while len(self._buf) < n:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('socket closed')
+            self._buf += chunk
+        data, self._buf = self._buf[:n], self._buf[n:]
+        return data
+
+    def _read(self):
+        head = self._recv_exact(2)
+        length = head[1] & 0x7f
+        if length == 126:
+            length = int.from_bytes(self._recv_exact(2), 'big')
+        elif length == 127:
+            length = int.from_bytes(self._recv_exact(8), 'big')
+        if head[0] & 0x0f == 0x8:
+            raise ConnectionError('socket closed')
+        return self._recv_exact(length).decode()
+
+    def _send(self, text):
+        data = text.encode()
+        mask = os.urandom(4)
+        n = len(data)
+        if n < 126:
+            header = bytes([0x81, 0x80 | n])
+        elif n < 65536:
+            header = bytes([0x81, 0x80 | 126]) + n.to_bytes(2, 'big')
+        else:
+            header = bytes([0x81, 0x80 | 127]) + n.to_bytes(8, 'big')
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        with self._send_lock:
+            self._sock.sendall(header + mask + masked)
+
+    def _reader(self):
+        # Only a closed socket ends the thread; a bad packet (or a failing
+        # on_event) is reported through on_error and the next one is read
+        while True:
+            try:
+                packet = self._read()
+            except OSError:
+                return
+            except ValueError:
+                # Not UTF-8; the frame has been consumed, so carry on
+                self.on_error()
+                continue
+            try:
+                self._dispatch(packet)
+            except Exception:
+                self.on_error()
+
+    def _dispatch(self, packet):
+        if packet == '2':
+            self._send('3')
+        elif packet.startswith('42'):
+            event, *args = json.loads(packet[2:])
+            self.on_event(event, args[0] if args else None)
+        elif packet.startswith('43'):
+            split = packet.index('[')
+            with self._cond:
+                self._acks[int(packet[2:split])] = json.loads(packet[split:])
+                self._cond.notify_all()
+
+    def emit(self, event, data, ack=True, timeout=30):
+        if not ack:
+            self._send('42' + json.dumps([event, data]))
+            return None
+        with self._cond:
+            self._ack_id += 1
+            ack_id = self._ack_id
+        self._send(f'42{ack_id}' + json.dumps([event, data]))
+        with self._cond:
+            if not self._cond.wait_for(lambda: ack_id in self._acks, timeout):
+                raise TimeoutError(f'no ack for {event}')
+            args = self._acks.pop(ack_id)
+        return args[0] if args else None
+
+    def close(self):
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class SimulatedUser:
+
+    def __init__(self, n, base_url, recorder, args, channel_ids):
+        self.n = n
+        self.recorder = recorder
+        self.args = args
+        self.channel_ids = channel_ids
+        parsed = urllib.parse.urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.http = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        self.token = None
+        self.sock = None
+        self.rng = random.Random(n)
+        self.channel_id = None
+        self.cursor = None
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        self.http.request(method, path, body=json.dumps(body) if body is not None else None,
+                          headers=headers)
+        resp = self.http.getresponse()
+        data = resp.read()
+        if resp.status >= 400:
+            raise RuntimeError(f'{method} {path}: {resp.status}')
+        return json.loads(data) if data else None
+
+    def on_event(self, event, payload):
+        now = time.perf_counter()
+        if event == 'message':
+            messages = [payload]
+        elif event == 'messages':
+            messages = payload['messages']
+        else:
+            return
+        for m in messages:
+            content = m.get('content', '')
+            if content.startswith('lt ') and m.get('temp_id', '').split(':')[0] != str(self.n):
+                self.recorder.delivered((now - float(content.split(' ')[1])) * 1000)
+
+    def setup(self):
+        email = f'lt{self.n}-{os.getpid()}-{int(time.time())}@loadtest'
+        data = self.recorder.timed('signup', self.request, 'POST', '/api/auth/signup',
+                                   {'email': email, 'password': 'LoadTest123'})
+        if data is None:
+            return False
+        self.token = data['access_token']
+        self.recorder.timed('login', self.request, 'POST', '/api/auth/login',
+                            {'email': email, 'password': 'LoadTest123'})
+        self.recorder.timed('list_channels', self.request, 'GET', '/api/channels')
+        self.channel_id = self.channel_ids[self.n % len(self.channel_ids)]
+        self.sock = self.recorder.timed('connect', SocketClient, self.host, self.port,
+                                        self.token, self.on_event,
+                                        lambda: self.recorder.error('socket_packet'))
+        if self.sock is None:
+            return False
+        return self.recorder.timed('join_channel', self.sock.emit, 'join_channel',
+                                   {'channel_id': self.channel_id}) is not None
+
+    def send_message(self):
+        ack = self.sock.emit('send_message', {
+            'channel_id': self.channel_id, 'content': f'lt {time.perf_counter():.6f}',
+            'temp_id': f'{self.n}:{self.rng.random()}'})
+        if not ack or not ack.get('ok'):
+            raise RuntimeError(ack)
+
+    def typing(self):
+        for _ in range(3):
+            self.sock.emit('typing', {'channel_id': self.channel_id, 'is_typing': True}, ack=False)
+
+    def history(self):
+        path = f'/api/channels/{self.channel_id}/messages?limit=50'
+        if self.cursor:
+            path += '&before=' + urllib.parse.quote(self.cursor)
+        page = self.request('GET', path)
+        self.cursor = page.get('next_cursor') if page.get('has_more') else None
+
+    def list_channels(self):
+        self.request('GET', '/api/channels')
+
+    def run(self, deadline):
+        actions, weights = zip(*ACTIONS.items())
+        while time.perf_counter() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            self.recorder.timed(action, getattr(self, action))
+            time.sleep(self.args.think_ms / 1000.0 * self.rng.uniform(0.5, 1.5))
+        self.sock.close()
+
+
+def start_server(port, env_overrides):
+    env = dict(os.environ, PORT=str(port), CHANNEL_PURGE_WORKER='0', REFRESH_TOKEN_SWEEPER='0')
+    # Cheap hashing so signups measure the app, not bcrypt; override with --env
+    env.setdefault('BCRYPT_ROUNDS', '4')
+    env.setdefault('PASSWORD_HASH_WORKERS', '0')
+    env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loadtest.db'))
+    env.update(env_overrides)
+    proc = subprocess.Popen([sys.executable, '-c', SERVER.format(port=port)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(150):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/healthz')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('server did not start')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def create_channels(base_url, recorder, args):
+    owner = SimulatedUser(-1, base_url, recorder, args, [])
+    data = owner.request('POST', '/api/auth/signup', {
+        'email': f'owner-{os.getpid()}-{int(time.time())}@loadtest', 'password': 'LoadTest123'})
+    owner.token = data['access_token']
+    return [owner.request('POST', '/api/channels', {'name': f'loadtest-{time.time_ns()}-{i}'})['channel']['id']
+            for i in range(args.channels)]
+
+
+def run(base_url, args):
+    recorder = Recorder()
+    channel_ids = create_channels(base_url, recorder, args)
+    users = [SimulatedUser(i, base_url, recorder, args, channel_ids) for i in range(args.users)]
+    ready = []
+
+    def setup(user):
+        if user.setup():
+            ready.append(user)
+
+    threads = [threading.Thread(target=setup, args=(u,)) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=u.run, args=(deadline,)) for u in ready]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    time.sleep(0.5)  # let the last broadcasts arrive
+    result = recorder.summary(time.perf_counter() - started)
+    result['users_ready'] = len(ready)
+    return result
+
+
+def print_result(result, baseline=None):
+    print(f'{"action":>14} {"count":>7} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for action, row in result['actions'].items():
+        line = (f'{action:>14} {row["count"]:7d} {row["errors"]:6d} {row["p50_ms"]:8.1f} '
+                f'{row["p95_ms"]:8.1f} {row["p99_ms"]:8.1f}')
+        old = (baseline or {}).get('actions', {}).get(action)
+        if old and old['p95_ms']:
+            line += f'   p95 {(row["p95_ms"] / old["p95_ms"] - 1) * 100:+6.1f}%'
+        print(line)
+    fanout = result['fanout']
+    line = f'messages/sec {result["messages_per_sec"]:.1f}'
+    if baseline:
+        line += f' ({(result["messages_per_sec"] / (baseline["messages_per_sec"] or 1) - 1) * 100:+.1f}%)'
+    print(line)
+    print(f'fan-out: {fanout["deliveries"]} deliveries, p50 {fanout["p50_ms"]:.1f}ms '
+          f'p95 {fanout["p95_ms"]:.1f}ms p99 {fanout["p99_ms"]:.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='drive an already running server instead of starting one')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--think-ms', type=float, default=100)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra app settings for the local server')
+    parser.add_argument('--save', metavar='NAME', help='save results as a baseline')
+    parser.add_argument('--compare', metavar='NAME', help='compare against a saved baseline')
+    args = parser.parse_args()
+
+    proc = None
+    base_url = args.url
+    if not base_url:
+        port = free_port()
+        proc = start_server(port, dict(kv.split('=', 1) for kv in args.env))
+        base_url = f'http://127.0.0.1:{port}'
+    try:
+        print(f'{args.users} users, {args.channels} channels, {args.duration:.0f}s against {base_url}')
+        result = run(base_url, args)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+    result['settings'] = {'users': args.users, 'channels': args.channels, 'duration': args.duration,
+                          'think_ms': args.think_ms, 'env': args.env, 'url': args.url}
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINES, f'{args.compare}.json')) as f:
+            baseline = json.load(f)
+    print_result(result, baseline)
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        path = os.path.join(BASELINES, f'{args.save}.json')
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        print(f'saved {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 """Gunicorn configuration for production deployment."""
+import importlib.util
 import os
 import multiprocessing
 
@@ -6,10 +7,32 @@ import multiprocessing
 bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
 backlog = 2048
 
-# Worker processes (use 1 for WebSocket, or 2-4 with message queue)
+# Worker processes. Rooms live in each worker's memory, so more than one
+# worker needs SOCKETIO_MESSAGE_QUEUE_URL (redis://... or local://host:port,
+# see app/socket_queue.py) to fan emits out across them. Long-polling
+# clients also need sticky sessions, which gunicorn cannot provide: with
+# several workers either restrict clients to the websocket transport or run
+# one-worker instances behind a sticky load balancer.
+message_queue = os.getenv('SOCKETIO_MESSAGE_QUEUE_URL')
 workers = int(os.getenv('GUNICORN_WORKERS', '1'))
-worker_class = 'eventlet'
-worker_connections = 1000
+if workers > 1 and not message_queue:
+    raise RuntimeError('GUNICORN_WORKERS > 1 requires SOCKETIO_MESSAGE_QUEUE_URL')
+
+# The worker class follows the app's async mode (see app/async_mode.py).
+# Workers inherit this environment, so the default applies to the app too.
+async_mode = os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'eventlet')
+if async_mode == 'threading':
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', '100'))
+elif async_mode == 'gevent':
+    # Optional dependencies, not in requirements.txt by default
+    if any(importlib.util.find_spec(name) is None for name in ('gevent', 'geventwebsocket')):
+        raise RuntimeError('SOCKETIO_ASYNC_MODE=gevent needs gevent and gevent-websocket; '
+                           'pip install gevent gevent-websocket')
+    worker_class = 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+else:
+    worker_class = 'eventlet'
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
 timeout = 120
 keepalive = 5
 
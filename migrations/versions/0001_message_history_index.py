@@ -0,0 +1,31 @@
+"""Composite index for keyset-paginated message history
+
+Revision ID: 0001_message_history_index
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_message_history_index'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tables predate migrations (run.py creates them with db.create_all()),
+    # and new databases already get this index from the model definition.
+    op.create_index(
+        'ix_messages_channel_history',
+        'messages',
+        ['channel_id', 'is_deleted', 'created_at', 'id'],
+        if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.drop_index('ix_messages_channel_history', table_name='messages', if_exists=True)
@@ -0,0 +1,33 @@
+"""Denormalized channels.member_count
+
+Revision ID: 0002_channel_member_count
+Revises: 0001_message_history_index
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_channel_member_count'
+down_revision = '0001_message_history_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'channels',
+        sa.Column('member_count', sa.Integer(), nullable=False, server_default='0'),
+    )
+    op.execute(
+        'UPDATE channels SET member_count = ('
+        'SELECT COUNT(*) FROM channel_memberships '
+        'WHERE channel_memberships.channel_id = channels.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('channels') as batch_op:
+        batch_op.drop_column('member_count')
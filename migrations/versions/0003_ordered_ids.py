@@ -0,0 +1,36 @@
+"""Native uuid storage for time-ordered primary keys
+
+Revision ID: 0003_ordered_ids
+Revises: 0002_channel_member_count
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_ordered_ids'
+down_revision = '0002_channel_member_count'
+branch_labels = None
+depends_on = None
+
+TABLES = ('messages', 'channel_memberships', 'refresh_tokens')
+
+
+def upgrade():
+    # New rows get UUIDv7 ids from the application; existing uuid4 ids stay
+    # as they are (they are valid uuids, and history is ordered by the
+    # (created_at, id) cursor rather than by id alone). Only Postgres has a
+    # compact uuid type to convert to; elsewhere the columns stay VARCHAR(36).
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN id TYPE uuid USING id::uuid')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN id TYPE varchar(36) USING id::text')
@@ -0,0 +1,43 @@
+"""Full-text search index for messages
+
+Revision ID: 0004_message_search
+Revises: 0003_ordered_ids
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_message_search'
+down_revision = '0003_ordered_ids'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages "
+            "USING gin (to_tsvector('simple', content))"
+        )
+    elif dialect == 'sqlite':
+        op.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5('
+            'content, message_id UNINDEXED, channel_id UNINDEXED)'
+        )
+        op.execute('DELETE FROM messages_fts')
+        op.execute(
+            'INSERT INTO messages_fts (content, message_id, channel_id) '
+            'SELECT content, id, channel_id FROM messages WHERE NOT is_deleted'
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_messages_content_tsv')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS messages_fts')
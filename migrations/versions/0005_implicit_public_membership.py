@@ -0,0 +1,53 @@
+"""Implicit membership of public channels
+
+Revision ID: 0005_implicit_public_membership
+Revises: 0004_message_search
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_implicit_public_membership'
+down_revision = '0004_message_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_channel_memberships_user_channel',
+        'channel_memberships',
+        ['user_id', 'channel_id'],
+        if_not_exists=True,
+    )
+    # Plain 'member' rows in public channels are now implied; owner rows stay.
+    # Leaving used to delete the row, so there is no record of past leaves
+    # and every user becomes a member of every public channel.
+    op.execute(
+        "DELETE FROM channel_memberships WHERE role = 'member' AND channel_id IN "
+        "(SELECT id FROM channels WHERE is_private IS NOT true)"
+    )
+    op.execute(
+        "UPDATE channels SET member_count = (SELECT COUNT(*) FROM users) WHERE is_private IS NOT true"
+    )
+
+
+def downgrade():
+    # Materialize implicit memberships again, then drop the leave markers
+    if op.get_bind().dialect.name == 'postgresql':
+        new_id = 'gen_random_uuid()'
+    else:
+        new_id = 'lower(hex(randomblob(16)))'
+    op.execute(
+        "INSERT INTO channel_memberships (id, channel_id, user_id, role, joined_at) "
+        f"SELECT {new_id}, c.id, u.id, 'member', CURRENT_TIMESTAMP "
+        "FROM users u CROSS JOIN channels c "
+        "WHERE c.is_private IS NOT true AND NOT EXISTS ("
+        "SELECT 1 FROM channel_memberships m WHERE m.channel_id = c.id AND m.user_id = u.id)"
+    )
+    op.execute("DELETE FROM channel_memberships WHERE role = 'left'")
+    op.drop_index('ix_channel_memberships_user_channel', table_name='channel_memberships',
+                  if_exists=True)
@@ -0,0 +1,35 @@
+"""Soft-deleted channels and background purge jobs
+
+Revision ID: 0006_channel_purge
+Revises: 0005_implicit_public_membership
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_channel_purge'
+down_revision = '0005_implicit_public_membership'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('channels', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_table(
+        'channel_purges',
+        sa.Column('channel_id', sa.String(length=36), nullable=False),
+        sa.Column('requested_at', sa.DateTime(), nullable=False),
+        sa.Column('messages_purged', sa.Integer(), nullable=False),
+        sa.Column('memberships_purged', sa.Integer(), nullable=False),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('channel_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('channel_purges')
+    with op.batch_alter_table('channels') as batch_op:
+        batch_op.drop_column('deleted_at')
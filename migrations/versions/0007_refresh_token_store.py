@@ -0,0 +1,38 @@
+"""Indexed, rotating refresh-token store
+
+Revision ID: 0007_refresh_token_store
+Revises: 0006_channel_purge
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_refresh_token_store'
+down_revision = '0006_channel_purge'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Expired rows were never deleted before; drop them ahead of indexing
+    op.execute('DELETE FROM refresh_tokens WHERE expires_at < CURRENT_TIMESTAMP')
+    with op.batch_alter_table('refresh_tokens') as batch_op:
+        batch_op.add_column(sa.Column('family_id', sa.String(length=36), nullable=True))
+        batch_op.add_column(sa.Column('revoked_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_refresh_tokens_token_hash', 'refresh_tokens', ['token_hash'], unique=True)
+    op.create_index('ix_refresh_tokens_user_id', 'refresh_tokens', ['user_id'])
+    op.create_index('ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'])
+    op.create_index('ix_refresh_tokens_family_id', 'refresh_tokens', ['family_id'])
+
+
+def downgrade():
+    op.drop_index('ix_refresh_tokens_family_id', table_name='refresh_tokens')
+    op.drop_index('ix_refresh_tokens_expires_at', table_name='refresh_tokens')
+    op.drop_index('ix_refresh_tokens_user_id', table_name='refresh_tokens')
+    op.drop_index('ix_refresh_tokens_token_hash', table_name='refresh_tokens')
+    with op.batch_alter_table('refresh_tokens') as batch_op:
+        batch_op.drop_column('revoked_at')
+        batch_op.drop_column('family_id')
@@ -0,0 +1,30 @@
+"""Version counters for conditional GETs
+
+Revision ID: 0008_version_counters
+Revises: 0007_refresh_token_store
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_version_counters'
+down_revision = '0007_refresh_token_store'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    counters = op.create_table(
+        'version_counters',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+    op.bulk_insert(counters, [{'name': 'catalog', 'value': 0}, {'name': 'history', 'value': 0}])
+
+
+def downgrade():
+    op.drop_table('version_counters')
@@ -0,0 +1,26 @@
+"""Seed the 'channels' version counter for the public channel catalog
+
+Revision ID: 0009_channels_version
+Revises: 0008_version_counters
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_channels_version'
+down_revision = '0008_version_counters'
+branch_labels = None
+depends_on = None
+
+counters = sa.table('version_counters', sa.column('name', sa.String), sa.column('value', sa.BigInteger))
+
+
+def upgrade():
+    op.bulk_insert(counters, [{'name': 'channels', 'value': 0}])
+
+
+def downgrade():
+    op.execute(counters.delete().where(counters.c.name == 'channels'))
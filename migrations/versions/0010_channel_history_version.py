@@ -0,0 +1,29 @@
+"""Per-channel history versions replace the global 'history' counter
+
+Revision ID: 0010_channel_history_version
+Revises: 0009_channels_version
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_channel_history_version'
+down_revision = '0009_channels_version'
+branch_labels = None
+depends_on = None
+
+counters = sa.table('version_counters', sa.column('name', sa.String), sa.column('value', sa.BigInteger))
+
+
+def upgrade():
+    op.add_column('channels', sa.Column('history_version', sa.Integer(), nullable=False, server_default='0'))
+    op.execute(counters.delete().where(counters.c.name == 'history'))
+
+
+def downgrade():
+    op.bulk_insert(counters, [{'name': 'history', 'value': 0}])
+    with op.batch_alter_table('channels') as batch_op:
+        batch_op.drop_column('history_version')
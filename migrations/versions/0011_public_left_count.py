@@ -0,0 +1,37 @@
+"""Public member counts from a user total minus leaves
+
+Revision ID: 0011_public_left_count
+Revises: 0010_channel_history_version
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011_public_left_count'
+down_revision = '0010_channel_history_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('channels', sa.Column('left_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute(
+        "UPDATE channels SET left_count = (SELECT COUNT(*) FROM channel_memberships m "
+        "WHERE m.channel_id = channels.id AND m.role = 'left') WHERE is_private IS NOT true"
+    )
+    op.execute(
+        "INSERT INTO version_counters (name, value) SELECT 'users', COUNT(*) FROM users"
+    )
+
+
+def downgrade():
+    op.execute(
+        "UPDATE channels SET member_count = (SELECT COUNT(*) FROM users) - left_count "
+        "WHERE is_private IS NOT true"
+    )
+    op.execute("DELETE FROM version_counters WHERE name = 'users'")
+    with op.batch_alter_table('channels') as batch_op:
+        batch_op.drop_column('left_count')
@@ -0,0 +1,46 @@
+"""One membership row per user and channel
+
+Revision ID: 0012_unique_membership
+Revises: 0011_public_left_count
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0012_unique_membership'
+down_revision = '0011_public_left_count'
+branch_labels = None
+depends_on = None
+
+# Which duplicate survives: owner, then any other role, then a leave marker
+RANK = "CASE {0}.role WHEN 'owner' THEN 0 WHEN 'left' THEN 2 ELSE 1 END"
+
+
+def upgrade():
+    op.execute(
+        "DELETE FROM channel_memberships WHERE EXISTS ("
+        "SELECT 1 FROM channel_memberships k "
+        "WHERE k.channel_id = channel_memberships.channel_id AND k.user_id = channel_memberships.user_id "
+        f"AND ({RANK.format('k')} < {RANK.format('channel_memberships')} "
+        f"OR ({RANK.format('k')} = {RANK.format('channel_memberships')} AND k.id < channel_memberships.id)))"
+    )
+    # Duplicates were counted twice; recount what is left
+    op.execute(
+        "UPDATE channels SET left_count = (SELECT COUNT(*) FROM channel_memberships m "
+        "WHERE m.channel_id = channels.id AND m.role = 'left') WHERE is_private IS NOT true"
+    )
+    op.execute(
+        "UPDATE channels SET member_count = (SELECT COUNT(*) FROM channel_memberships m "
+        "WHERE m.channel_id = channels.id AND m.role != 'left') WHERE is_private = true"
+    )
+    op.drop_index('ix_channel_memberships_user_channel', table_name='channel_memberships')
+    op.create_index('ix_channel_memberships_user_channel', 'channel_memberships',
+                    ['user_id', 'channel_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_channel_memberships_user_channel', table_name='channel_memberships')
+    op.create_index('ix_channel_memberships_user_channel', 'channel_memberships',
+                    ['user_id', 'channel_id'])
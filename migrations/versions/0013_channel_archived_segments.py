@@ -0,0 +1,46 @@
+"""Record each channel's archived segment count on the channel row
+
+Revision ID: 0013_channel_archived_segments
+Revises: 0012_unique_membership
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import json
+import os
+
+
+# revision identifiers, used by Alembic.
+revision = '0013_channel_archived_segments'
+down_revision = '0012_unique_membership'
+branch_labels = None
+depends_on = None
+
+
+def _archive_dir():
+    # Same default as app.archive.archive_dir(): <instance path>/archive
+    return os.environ.get('ARCHIVE_DIR') or os.path.join(
+        os.path.dirname(__file__), os.pardir, os.pardir, 'instance', 'archive')
+
+
+def upgrade():
+    op.add_column('channels', sa.Column('archived_segments', sa.Integer(), nullable=False, server_default='0'))
+    # Readers now trust the column, so count the segments already on disk
+    root = _archive_dir()
+    if not os.path.isdir(root):
+        return
+    bind = op.get_bind()
+    for channel_id in os.listdir(root):
+        try:
+            with open(os.path.join(root, channel_id, 'index.json')) as f:
+                count = len(json.load(f)['segments'])
+        except FileNotFoundError:
+            continue
+        bind.execute(sa.text('UPDATE channels SET archived_segments = :count WHERE id = :id'),
+                     {'count': count, 'id': channel_id})
+
+
+def downgrade():
+    with op.batch_alter_table('channels') as batch_op:
+        batch_op.drop_column('archived_segments')
@@ -1,5 +1,18 @@
-from app import create_app, socketio, db
 import os
+
+# Green async modes must patch the standard library before anything else,
+# the app package included, is imported (gunicorn's eventlet/gevent
+# workers do this themselves)
+if os.environ.get('SOCKETIO_ASYNC_MODE') == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif os.environ.get('SOCKETIO_ASYNC_MODE') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from app import create_app, socketio, db
+from app.purge import start_purge_worker
+from app.tokens import start_token_sweeper
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -11,12 +24,18 @@ app = create_app()
 with app.app_context():
     db.create_all()
 
+# Resume purging channels deleted before the last restart, and keep
+# expired refresh tokens from piling up
+start_purge_worker(app)
+start_token_sweeper(app)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', '5000'))
     host = os.environ.get('HOST', '127.0.0.1')
     logger.info(f"Starting server on {host}:{port}")
     try:
-        # Use threading mode for better Windows compatibility
+        # SOCKETIO_ASYNC_MODE picks the server: werkzeug threads by default
+        # (Windows-friendly), or eventlet/gevent's own WSGI server
         socketio.run(
             app,
             host=host,
@@ -1,8 +1,18 @@
 ﻿import pytest
+from contextlib import contextmanager
 from app import create_app, db
+from app.cache import clear_caches
+from app.querylog import capture
 
 @pytest.fixture
-def app():
+def app_env():
+    """Environment for create_app; override with @pytest.mark.parametrize('app_env', [...])."""
+    return {}
+
+@pytest.fixture
+def app(app_env, monkeypatch):
+    for name, value in app_env.items():
+        monkeypatch.setenv(name, value)
     app = create_app()
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
@@ -19,3 +29,20 @@ def client(app):
 @pytest.fixture
 def runner(app):
     return app.test_cli_runner()
+
+@pytest.fixture(autouse=True)
+def _reset_caches():
+    # In-process caches outlive the per-test database
+    clear_caches()
+    yield
+    clear_caches()
+
+@pytest.fixture
+def query_budget():
+    """`with query_budget(n) as log:` fails if the block runs more than n SQL statements."""
+    @contextmanager
+    def budget(limit):
+        with capture('query_budget') as log:
+            yield log
+        assert len(log) <= limit, f'{len(log)} queries, budget {limit}:\n{log.format()}'
+    return budget
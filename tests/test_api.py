@@ -7,8 +7,10 @@ from datetime import datetime
 
 
 @pytest.fixture
-def app():
+def app(app_env, monkeypatch):
     """Create app with test database."""
+    for name, value in app_env.items():
+        monkeypatch.setenv(name, value)
     app = create_app()
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
@@ -32,6 +34,21 @@ def runner(app):
     return app.test_cli_runner()
 
 
+def signup_user(client, name, password='SecurePassword123'):
+    """Sign up a user and return (token, user_id)."""
+    response = client.post('/api/auth/signup', json={
+        'email': f'{name.lower()}@example.com',
+        'display_name': name,
+        'password': password
+    })
+    data = json.loads(response.data)
+    return data['access_token'], data['user']['id']
+
+
+def auth_headers(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
 class TestAuth:
     """Auth endpoint tests."""
     
@@ -96,6 +113,119 @@ class TestAuth:
         assert response.status_code == 401
 
 
+    def test_refresh_rotates_and_detects_reuse(self, client, app):
+        """Refresh issues a new token; replaying the old one revokes the family."""
+        signup_user(client, 'Alice')
+        original = client.get_cookie('refresh_token').value
+
+        response = client.post('/api/auth/refresh')
+        assert response.status_code == 200
+        rotated = client.get_cookie('refresh_token').value
+        assert rotated != original
+
+        # Replaying the rotated-out token is treated as theft
+        client.set_cookie('refresh_token', original)
+        assert client.post('/api/auth/refresh').status_code == 401
+        client.set_cookie('refresh_token', rotated)
+        assert client.post('/api/auth/refresh').status_code == 401
+
+    def test_refresh_tokens_capped_and_swept(self, client, app, runner):
+        """Live tokens per user are capped and expired rows are swept."""
+        app.config['REFRESH_TOKENS_PER_USER'] = 3
+        _, user_id = signup_user(client, 'Alice')
+        for _ in range(5):
+            client.post('/api/auth/login', json={'email': 'alice@example.com',
+                                                 'password': 'SecurePassword123'})
+        with app.app_context():
+            assert RefreshToken.query.filter_by(user_id=user_id).count() == 3
+            RefreshToken.query.update({RefreshToken.expires_at: datetime(2000, 1, 1)})
+            db.session.commit()
+        result = runner.invoke(args=['sweep-refresh-tokens'])
+        assert 'Deleted 3 expired refresh token(s)' in result.output
+        with app.app_context():
+            assert RefreshToken.query.count() == 0
+
+    def test_access_token_cached_and_revoked_on_logout(self, client, app):
+        """Verified tokens are served from the cache; logout revokes them."""
+        from app.access_tokens import token_cache
+        token, _ = signup_user(client, 'Alice')
+        for _ in range(3):
+            assert client.get('/api/channels', headers=auth_headers(token)).status_code == 200
+        assert token_cache.stats()['size'] == 1
+        assert token_cache.hits >= 2
+
+        client.post('/api/auth/logout', headers=auth_headers(token))
+        assert client.get('/api/channels', headers=auth_headers(token)).status_code == 401
+
+    def test_login_rehashes_when_cost_changes(self, client, app):
+        """A changed BCRYPT_ROUNDS upgrades the stored hash on login."""
+        app.config['BCRYPT_ROUNDS'] = 4
+        _, user_id = signup_user(client, 'Alice')
+        with app.app_context():
+            assert db.session.get(User, user_id).password_hash.startswith('$2b$04$')
+
+        app.config['BCRYPT_ROUNDS'] = 5
+        response = client.post('/api/auth/login', json={'email': 'alice@example.com',
+                                                         'password': 'SecurePassword123'})
+        assert response.status_code == 200
+        with app.app_context():
+            db.session.expire_all()
+            assert db.session.get(User, user_id).password_hash.startswith('$2b$05$')
+
+    def test_login_rejected_when_hash_pool_saturated(self, client, app):
+        """A login that finds every pool slot taken answers 503 at once."""
+        from app import passwords
+        app.config.update(BCRYPT_ROUNDS=4, PASSWORD_HASH_WORKERS=0)
+        signup_user(client, 'Alice')
+        passwords.shutdown_pool()
+        app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_LIMIT=0,
+                          PASSWORD_HASH_TIMEOUT=30)
+        login = {'email': 'alice@example.com', 'password': 'SecurePassword123'}
+        try:
+            # Hold the only slot, as a running hash would
+            _, slots = passwords._get_pool(app.config)
+            assert slots.acquire(blocking=False)
+            # Unknown users never reach the pool
+            response = client.post('/api/auth/login', json={**login, 'email': 'bob@example.com'})
+            assert response.status_code == 401
+            response = client.post('/api/auth/login', json=login)
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+
+            slots.release()
+            assert client.post('/api/auth/login', json=login).status_code == 200
+        finally:
+            passwords.shutdown_pool()
+
+    def test_abandoned_hash_holds_its_slot(self, client, app):
+        """A hash that times out answers 503, and its job keeps the slot until it ends."""
+        from concurrent.futures import Future
+        from app import passwords
+        app.config.update(BCRYPT_ROUNDS=4, PASSWORD_HASH_WORKERS=0)
+        signup_user(client, 'Alice')
+        passwords.shutdown_pool()
+        app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_LIMIT=0,
+                          PASSWORD_HASH_TIMEOUT=0.01)
+        login = {'email': 'alice@example.com', 'password': 'SecurePassword123'}
+        try:
+            pool, _ = passwords._get_pool(app.config)
+            job = Future()
+            pool.submit = lambda *args: job
+            # Gave up waiting: busy, not a server error
+            response = client.post('/api/auth/login', json=login)
+            assert response.status_code == 503
+            # The abandoned job still occupies the pool, so this one is
+            # turned away at once however long it would wait
+            app.config['PASSWORD_HASH_TIMEOUT'] = 30
+            assert client.post('/api/auth/login', json=login).status_code == 503
+
+            job.set_result(False)
+            del pool.submit
+            assert client.post('/api/auth/login', json=login).status_code == 200
+        finally:
+            passwords.shutdown_pool()
+
+
 class TestChannels:
     """Channel endpoint tests."""
     
@@ -121,6 +251,133 @@ class TestChannels:
         assert 'channels' in data
         assert isinstance(data['channels'], list)
     
+    def test_channel_endpoints_query_budget(self, client, query_budget):
+        token, _ = signup_user(client, 'Alice')
+        for i in range(5):
+            client.post('/api/channels', json={'name': f'c{i}'}, headers=auth_headers(token))
+        # Includes the catalog and channels version bumps (app/etags.py)
+        with query_budget(6):
+            client.post('/api/channels', json={'name': 'general'}, headers=auth_headers(token))
+        # Version read, public catalog load, page; then the catalog is cached
+        with query_budget(3):
+            response = client.get('/api/channels', headers=auth_headers(token))
+        names = {c['name'] for c in json.loads(response.data)['channels']}
+        assert {'general', 'c0', 'c1', 'c2', 'c3', 'c4'} <= names
+        with query_budget(2):
+            client.get('/api/channels?q=c', headers=auth_headers(token))
+        with query_budget(1):
+            client.get('/api/channels', headers={**auth_headers(token), 'If-None-Match': response.headers['ETag']})
+
+    def test_list_channels_conditional_get(self, client):
+        token, _ = signup_user(client, 'Alice')
+        other, _ = signup_user(client, 'Bob')
+        client.post('/api/channels', json={'name': 'general'}, headers=auth_headers(token))
+        first = client.get('/api/channels', headers=auth_headers(token))
+        etag = first.headers['ETag']
+        assert 'no-cache' in first.headers['Cache-Control']
+
+        again = client.get('/api/channels', headers={**auth_headers(token), 'If-None-Match': etag})
+        assert again.status_code == 304
+        assert again.data == b''
+        assert again.headers['ETag'] == etag
+        # The tag is per user
+        assert client.get('/api/channels', headers={
+            **auth_headers(other), 'If-None-Match': etag}).status_code == 200
+
+        # Catalog and member-count changes produce a new tag
+        for change in (
+            lambda: client.post('/api/channels', json={'name': 'random'}, headers=auth_headers(other)),
+            lambda: signup_user(client, 'Carol'),
+        ):
+            change()
+            response = client.get('/api/channels', headers={**auth_headers(token), 'If-None-Match': etag})
+            assert response.status_code == 200
+            assert response.headers['ETag'] != etag
+            etag = response.headers['ETag']
+
+    def test_list_channels_paginated_and_filtered(self, client):
+        token, _ = signup_user(client, 'Alice')
+        for name in ('delta', 'alpha', 'Charlie', 'bravo', 'echo'):
+            client.post('/api/channels', json={'name': name}, headers=auth_headers(token))
+        client.post('/api/channels', json={'name': 'bravo-private', 'is_private': True},
+                    headers=auth_headers(token))
+
+        names, cursor = [], None
+        while True:
+            query = '?limit=2' + (f'&cursor={cursor}' if cursor else '')
+            data = json.loads(client.get(f'/api/channels{query}', headers=auth_headers(token)).data)
+            assert len(data['channels']) <= 2
+            names += [c['name'] for c in data['channels']]
+            cursor = data['next_cursor']
+            assert data['has_more'] == (cursor is not None)
+            if not cursor:
+                break
+        mine = [n for n in names if n != 'test-channel']
+        assert mine == ['Charlie', 'alpha', 'bravo', 'bravo-private', 'delta', 'echo']
+        assert len(names) == len(set(names))
+
+        data = json.loads(client.get('/api/channels?q=BRAV', headers=auth_headers(token)).data)
+        assert [c['name'] for c in data['channels']] == ['bravo', 'bravo-private']
+        assert client.get('/api/channels?cursor=%%%', headers=auth_headers(token)).status_code == 400
+
+    def test_list_channels_whole_list_only_on_request(self, client, app):
+        """The default is one page; limit=all returns every channel."""
+        token, user_id = signup_user(client, 'Alice')
+        with app.app_context():
+            db.session.add_all(Channel(name=f'room-{i:03d}', owner_id=user_id) for i in range(120))
+            db.session.commit()
+        data = json.loads(client.get('/api/channels', headers=auth_headers(token)).data)
+        assert len(data['channels']) == 100 and data['has_more'] is True
+        data = json.loads(client.get('/api/channels?limit=all', headers=auth_headers(token)).data)
+        rooms = [c['name'] for c in data['channels'] if c['name'].startswith('room-')]
+        assert rooms == [f'room-{i:03d}' for i in range(120)]
+        assert data['has_more'] is False and data['next_cursor'] is None
+        for bad in ('abc', '1.5', ''):
+            response = client.get(f'/api/channels?limit={bad}', headers=auth_headers(token))
+            assert response.status_code == 400
+            assert json.loads(response.data)['error'] == 'invalid limit'
+
+    def test_list_channels_is_member(self, client):
+        token, _ = signup_user(client, 'Alice')
+        other, _ = signup_user(client, 'Bob')
+        public = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                        headers=auth_headers(token)).data)['channel']
+        client.post('/api/channels', json={'name': 'secret', 'is_private': True}, headers=auth_headers(token))
+        client.post(f'/api/channels/{public["id"]}/leave', headers=auth_headers(other))
+
+        mine = {c['name']: c for c in json.loads(
+            client.get('/api/channels', headers=auth_headers(token)).data)['channels']}
+        assert mine['general']['is_member'] and mine['secret']['is_member']
+        assert mine['general']['member_count'] == 1
+        theirs = {c['name']: c for c in json.loads(
+            client.get('/api/channels', headers=auth_headers(other)).data)['channels']}
+        assert 'secret' not in theirs
+        assert theirs['general']['is_member'] is False
+
+    def test_public_catalog_cached_until_channels_change(self, client):
+        from app.catalog import catalog_cache
+        token, _ = signup_user(client, 'Alice')
+        other, _ = signup_user(client, 'Bob')
+        general = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                         headers=auth_headers(token)).data)['channel']
+
+        def listed():
+            data = json.loads(client.get('/api/channels', headers=auth_headers(token)).data)
+            return {c['name'] for c in data['channels']}
+
+        assert 'general' in listed()
+        misses = catalog_cache.misses
+        # Joins and leaves move member counts, not the catalog
+        client.post(f'/api/channels/{general["id"]}/leave', headers=auth_headers(other))
+        assert 'general' in listed()
+        assert catalog_cache.misses == misses
+
+        client.post('/api/channels', json={'name': 'random'}, headers=auth_headers(other))
+        assert 'random' in listed()
+        client.delete(f'/api/channels/{general["id"]}', headers=auth_headers(token))
+        assert 'general' not in listed()
+        assert catalog_cache.misses == misses + 2
+
     def test_create_channel_success(self, client):
         """Test successful channel creation."""
         # Signup
@@ -170,6 +427,228 @@ class TestChannels:
         assert response.status_code == 200
 
 
+    def test_membership_changes_apply_immediately(self, client, app):
+        """Join/leave invalidate the cached membership index."""
+        token1, _ = signup_user(client, 'Alice')
+        token2, bob_id = signup_user(client, 'Bob')
+        create_resp = client.post('/api/channels', json={'name': 'general'},
+                                  headers=auth_headers(token1))
+        channel_id = json.loads(create_resp.data)['channel']['id']
+        url = f'/api/channels/{channel_id}/messages'
+
+        # Public channel membership is implicit
+        assert client.get(url, headers=auth_headers(token2)).status_code == 200
+        client.post(f'/api/channels/{channel_id}/leave', headers=auth_headers(token2))
+        assert client.get(url, headers=auth_headers(token2)).status_code == 403
+        client.post(f'/api/channels/{channel_id}/join', headers=auth_headers(token2))
+        assert client.get(url, headers=auth_headers(token2)).status_code == 200
+
+
+    def test_member_count_maintained(self, client, app, runner):
+        """member_count follows joins and leaves and can be reconciled."""
+        token1, _ = signup_user(client, 'Alice')
+        token2, _ = signup_user(client, 'Bob')
+        create_resp = client.post('/api/channels', json={'name': 'general'},
+                                  headers=auth_headers(token1))
+        channel = json.loads(create_resp.data)['channel']
+        assert channel['member_count'] == 2
+
+        client.post(f'/api/channels/{channel["id"]}/leave', headers=auth_headers(token2))
+        client.post(f'/api/channels/{channel["id"]}/join', headers=auth_headers(token2))
+        client.post(f'/api/channels/{channel["id"]}/join', headers=auth_headers(token2))
+        data = json.loads(client.get(f'/api/channels/{channel["id"]}',
+                                     headers=auth_headers(token1)).data)
+        assert data['member_count'] == 2
+
+        # New signups auto-join public channels
+        signup_user(client, 'Carol')
+        data = json.loads(client.get(f'/api/channels/{channel["id"]}',
+                                     headers=auth_headers(token1)).data)
+        assert data['channel']['member_count'] == 3
+
+        client.post(f'/api/channels/{channel["id"]}/leave', headers=auth_headers(token2))
+        with app.app_context():
+            ch = db.session.get(Channel, channel['id'])
+            assert ch.members() == 2
+            ch.left_count = 40
+            db.session.commit()
+
+        result = runner.invoke(args=['reconcile-member-counts'])
+        assert '1 channel(s) reconciled' in result.output
+        with app.app_context():
+            db.session.expire_all()
+            assert db.session.get(Channel, channel['id']).members() == 2
+
+    def test_signup_leaves_channel_rows_alone(self, client, app):
+        """Signup adds to the user total instead of updating every public channel."""
+        from app.models import VersionCounter
+        token, _ = signup_user(client, 'Alice')
+        channel = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                         headers=auth_headers(token)).data)['channel']
+        with app.app_context():
+            users = VersionCounter.value_of(VersionCounter.USERS)
+            catalog = VersionCounter.value_of(VersionCounter.CATALOG)
+        signup_user(client, 'Bob')
+        with app.app_context():
+            assert VersionCounter.value_of(VersionCounter.USERS) == users + 1
+            assert VersionCounter.value_of(VersionCounter.CATALOG) == catalog
+            assert db.session.get(Channel, channel['id']).left_count == 0
+        data = json.loads(client.get(f'/api/channels/{channel["id"]}', headers=auth_headers(token)).data)
+        assert data['member_count'] == channel['member_count'] + 1
+
+    def test_stale_membership_check_moves_count_once(self, client, app, monkeypatch):
+        """A repeated leave or join that another worker's cache let through writes nothing."""
+        from app.routes import channels as channel_routes
+        token1, _ = signup_user(client, 'Alice')
+        token2, bob_id = signup_user(client, 'Bob')
+        channel_id = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                            headers=auth_headers(token1)).data)['channel']['id']
+
+        def count():
+            data = json.loads(client.get(f'/api/channels/{channel_id}', headers=auth_headers(token1)).data)
+            return data['member_count']
+
+        monkeypatch.setattr(channel_routes, 'is_member', lambda user_id, channel_id: True)
+        for _ in range(2):
+            assert client.post(f'/api/channels/{channel_id}/leave', headers=auth_headers(token2)).status_code == 204
+        assert count() == 1
+        monkeypatch.setattr(channel_routes, 'is_member', lambda user_id, channel_id: False)
+        for _ in range(2):
+            assert client.post(f'/api/channels/{channel_id}/join', headers=auth_headers(token2)).status_code == 200
+        assert count() == 2
+        with app.app_context():
+            assert ChannelMembership.query.filter_by(channel_id=channel_id, user_id=bob_id).count() == 0
+
+    def test_owner_keeps_role_after_rejoining(self, client):
+        token, _ = signup_user(client, 'Alice')
+        channel_id = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                            headers=auth_headers(token)).data)['channel']['id']
+        client.post(f'/api/channels/{channel_id}/leave', headers=auth_headers(token))
+        client.post(f'/api/channels/{channel_id}/join', headers=auth_headers(token))
+        members = json.loads(client.get(f'/api/channels/{channel_id}/members',
+                                        headers=auth_headers(token)).data)['members']
+        assert [m['role'] for m in members if m['display_name'] == 'Alice'] == ['owner']
+
+    def test_reconcile_invalidates_channel_list_etag(self, client, app, runner):
+        token, _ = signup_user(client, 'Alice')
+        channel = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                         headers=auth_headers(token)).data)['channel']
+        # Drift written behind the ORM's back, as a crash between writes would leave it
+        db.session.execute(db.text('UPDATE channels SET left_count = 40 WHERE id = :id'),
+                           {'id': channel['id']})
+        db.session.commit()
+        etag = client.get('/api/channels', headers=auth_headers(token)).headers['ETag']
+
+        runner.invoke(args=['reconcile-member-counts'])
+        response = client.get('/api/channels', headers={**auth_headers(token), 'If-None-Match': etag})
+        assert response.status_code == 200
+        counts = {c['id']: c['member_count'] for c in json.loads(response.data)['channels']}
+        assert counts[channel['id']] == 1
+
+
+    def test_public_membership_is_implicit(self, client, app):
+        """Signup adds no membership rows; existing users see new public channels."""
+        token1, alice_id = signup_user(client, 'Alice')
+        token2, bob_id = signup_user(client, 'Bob')
+        public_id = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                           headers=auth_headers(token1)).data)['channel']['id']
+        private_id = json.loads(client.post('/api/channels', json={'name': 'ops', 'is_private': True},
+                                            headers=auth_headers(token1)).data)['channel']['id']
+        token3, _ = signup_user(client, 'Carol')
+        with app.app_context():
+            # Only the two owner rows exist
+            assert ChannelMembership.query.count() == 2
+
+        members = json.loads(client.get(f'/api/channels/{public_id}/members',
+                                        headers=auth_headers(token3)).data)['members']
+        assert {m['display_name'] for m in members} == {'Alice', 'Bob', 'Carol'}
+        assert {m['role'] for m in members if m['id'] == alice_id} == {'owner'}
+        assert client.get(f'/api/channels/{private_id}/members',
+                          headers=auth_headers(token2)).status_code == 403
+
+        client.post(f'/api/channels/{public_id}/leave', headers=auth_headers(token2))
+        members = json.loads(client.get(f'/api/channels/{public_id}/members',
+                                        headers=auth_headers(token3)).data)['members']
+        assert bob_id not in {m['id'] for m in members}
+
+
+    def test_delete_channel_hides_then_purges_in_batches(self, client, app):
+        """Deletion hides the channel at once; the purge runs in bounded batches."""
+        from app.models import ChannelPurge
+        from app.purge import purge_step, purge_all
+        app.config['CHANNEL_PURGE_WORKER'] = False
+        token, user_id = signup_user(client, 'Alice')
+        channel_id = json.loads(client.post('/api/channels', json={'name': 'doomed'},
+                                            headers=auth_headers(token)).data)['channel']['id']
+        for i in range(5):
+            client.post(f'/api/channels/{channel_id}/messages', json={'content': f'm{i}'},
+                        headers=auth_headers(token))
+
+        assert client.delete(f'/api/channels/{channel_id}', headers=auth_headers(token)).status_code == 204
+        assert client.get(f'/api/channels/{channel_id}', headers=auth_headers(token)).status_code == 404
+        assert client.get(f'/api/channels/{channel_id}/messages', headers=auth_headers(token)).status_code == 403
+        listed = json.loads(client.get('/api/channels', headers=auth_headers(token)).data)['channels']
+        assert channel_id not in [c['id'] for c in listed]
+        assert client.delete(f'/api/channels/{channel_id}', headers=auth_headers(token)).status_code == 404
+
+        with app.app_context():
+            assert purge_step(batch_size=2)
+            job = db.session.get(ChannelPurge, channel_id)
+            assert job.messages_purged == 2 and job.completed_at is None
+            purge_all(batch_size=2)
+            db.session.expire_all()
+            job = db.session.get(ChannelPurge, channel_id)
+            assert job.messages_purged == 5
+            assert job.memberships_purged == 1
+            assert job.completed_at is not None
+            assert db.session.get(Channel, channel_id) is None
+            assert Message.query.filter_by(channel_id=channel_id).count() == 0
+
+    def test_purge_keeps_archive_until_channel_row_commits(self, client, app, tmp_path, monkeypatch):
+        """Archived segments are removed only after the channel row's deletion commits."""
+        from app.purge import purge_all
+        app.config.update(CHANNEL_PURGE_WORKER=False, ARCHIVE_DIR=str(tmp_path))
+        token, _ = signup_user(client, 'Alice')
+        channel_id = json.loads(client.post('/api/channels', json={'name': 'doomed'},
+                                            headers=auth_headers(token)).data)['channel']['id']
+        segment = tmp_path / channel_id / 'segment'
+        segment.parent.mkdir()
+        segment.write_bytes(b'archived')
+        assert client.delete(f'/api/channels/{channel_id}', headers=auth_headers(token)).status_code == 204
+
+        with app.app_context():
+            commit = db.session.commit
+
+            def failing_commit():
+                if db.session.get(Channel, channel_id) is None:
+                    raise RuntimeError('commit failed')
+                commit()
+            monkeypatch.setattr(db.session, 'commit', failing_commit)
+            with pytest.raises(RuntimeError):
+                purge_all()
+            db.session.rollback()
+            assert segment.exists()
+
+            monkeypatch.setattr(db.session, 'commit', commit)
+            purge_all()
+            assert db.session.get(Channel, channel_id) is None
+            assert not segment.parent.exists()
+
+    def test_delete_by_another_worker_hides_channel_at_once(self, client, app):
+        """Membership checks read deleted_at, so no worker's cache outlives a delete."""
+        token, _ = signup_user(client, 'Alice')
+        channel_id = json.loads(client.post('/api/channels', json={'name': 'doomed'},
+                                            headers=auth_headers(token)).data)['channel']['id']
+        url = f'/api/channels/{channel_id}/messages'
+        assert client.get(url, headers=auth_headers(token)).status_code == 200
+        # Committed elsewhere: this process never sees delete_channel run
+        db.session.execute(db.text('UPDATE channels SET deleted_at = CURRENT_TIMESTAMP WHERE id = :id'),
+                           {'id': channel_id})
+        db.session.commit()
+        assert client.get(url, headers=auth_headers(token)).status_code == 403
+        assert client.post(url, json={'content': 'late'}, headers=auth_headers(token)).status_code == 403
+
+
 class TestMessages:
     """Message endpoint tests."""
     
@@ -210,6 +689,359 @@ class TestMessages:
         assert 'has_more' in data
 
 
+    def test_history_pages_do_not_skip_equal_timestamps(self, client, app):
+        """Keyset cursors page through messages sharing a created_at."""
+        token, user_id = signup_user(client, 'Alice')
+        create_resp = client.post('/api/channels', json={'name': 'general'},
+                                  headers=auth_headers(token))
+        channel_id = json.loads(create_resp.data)['channel']['id']
+
+        stamp = datetime(2024, 1, 1, 12, 0, 0)
+        with app.app_context():
+            for i in range(7):
+                db.session.add(Message(channel_id=channel_id, user_id=user_id,
+                                       content=f'm{i}', created_at=stamp))
+            db.session.commit()
+
+        seen = []
+        cursor = None
+        while True:
+            url = f'/api/channels/{channel_id}/messages?limit=3'
+            if cursor:
+                url += f'&before={cursor}'
+            data = json.loads(client.get(url, headers=auth_headers(token)).data)
+            seen = [m['id'] for m in data['messages']] + seen
+            cursor = data['next_cursor']
+            if not data['has_more']:
+                break
+        assert len(seen) == 7
+        assert len(set(seen)) == 7
+
+    def test_history_after_cursor(self, client, app):
+        """`after` returns newer messages in chronological order."""
+        token, user_id = signup_user(client, 'Alice')
+        create_resp = client.post('/api/channels', json={'name': 'general'},
+                                  headers=auth_headers(token))
+        channel_id = json.loads(create_resp.data)['channel']['id']
+        with app.app_context():
+            for i in range(5):
+                db.session.add(Message(channel_id=channel_id, user_id=user_id, content=f'm{i}',
+                                       created_at=datetime(2024, 1, 1, 12, 0, i)))
+            db.session.commit()
+
+        page = json.loads(client.get(f'/api/channels/{channel_id}/messages?limit=2',
+                                     headers=auth_headers(token)).data)
+        assert [m['content'] for m in page['messages']] == ['m3', 'm4']
+        older = json.loads(client.get(
+            f'/api/channels/{channel_id}/messages?limit=2&before={page["next_cursor"]}',
+            headers=auth_headers(token)).data)
+        assert [m['content'] for m in older['messages']] == ['m1', 'm2']
+        newer = json.loads(client.get(
+            f'/api/channels/{channel_id}/messages?limit=5&after={older["prev_cursor"]}',
+            headers=auth_headers(token)).data)
+        assert [m['content'] for m in newer['messages']] == ['m3', 'm4']
+        assert newer['has_more'] is False
+
+        bad = client.get(f'/api/channels/{channel_id}/messages?before=not-a-cursor',
+                         headers=auth_headers(token))
+        assert bad.status_code == 400
+
+    def test_history_cursor_ids_validated(self, client, app):
+        """Legacy timestamps still page; cursors with a non-UUID id are rejected."""
+        from app.pagination import encode_cursor, encode_rank_cursor
+        token, user_id = signup_user(client, 'Alice')
+        channel_id = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                            headers=auth_headers(token)).data)['channel']['id']
+        with app.app_context():
+            for i in range(3):
+                db.session.add(Message(channel_id=channel_id, user_id=user_id, content=f'm{i}',
+                                       created_at=datetime(2024, 1, 1, 12, 0, i)))
+            db.session.commit()
+        url = f'/api/channels/{channel_id}/messages'
+
+        legacy = json.loads(client.get(url + '?before=2024-01-01T12:00:02',
+                                       headers=auth_headers(token)).data)
+        assert [m['content'] for m in legacy['messages']] == ['m0', 'm1']
+        legacy = json.loads(client.get(url + '?after=2024-01-01T12:00:01',
+                                       headers=auth_headers(token)).data)
+        assert [m['content'] for m in legacy['messages']] == ['m1', 'm2']
+
+        crafted = encode_cursor(datetime(2024, 1, 1, 12, 0, 2), "x' OR 1=1")
+        assert client.get(f'{url}?before={crafted}', headers=auth_headers(token)).status_code == 400
+        crafted = encode_rank_cursor(-1.0, 'not-a-uuid')
+        assert client.get(f'{url}/search?q=m0&cursor={crafted}',
+                          headers=auth_headers(token)).status_code == 400
+
+
+    def test_history_hydrates_authors_in_one_query(self, client, app, query_budget):
+        """A history page loads all authors with a single users query."""
+        token, user_id = signup_user(client, 'Alice')
+        _, bob_id = signup_user(client, 'Bob')
+        create_resp = client.post('/api/channels', json={'name': 'general'},
+                                  headers=auth_headers(token))
+        channel_id = json.loads(create_resp.data)['channel']['id']
+        with app.app_context():
+            for i in range(10):
+                author = user_id if i % 2 else bob_id
+                db.session.add(Message(channel_id=channel_id, user_id=author, content=f'm{i}'))
+            db.session.commit()
+
+        # Every membership check also reads the channel's deleted_at
+        with query_budget(5) as log:
+            response = client.get(f'/api/channels/{channel_id}/messages',
+                                  headers=auth_headers(token))
+        data = json.loads(response.data)
+        assert {m['user']['display_name'] for m in data['messages']} == {'Alice', 'Bob'}
+        user_queries = [s for s in log.statements if 'FROM users' in s]
+        assert len(user_queries) <= 1
+
+        # Authors and membership roles are cached for the next poll
+        with query_budget(3):
+            client.get(f'/api/channels/{channel_id}/messages', headers=auth_headers(token))
+        # and an unchanged page costs only that check and the version read
+        with query_budget(2):
+            client.get(f'/api/channels/{channel_id}/messages',
+                       headers={**auth_headers(token), 'If-None-Match': response.headers['ETag']})
+
+    def test_history_conditional_get(self, client, app):
+        token, user_id = signup_user(client, 'Alice')
+        create_resp = client.post('/api/channels', json={'name': 'general'},
+                                  headers=auth_headers(token))
+        channel_id = json.loads(create_resp.data)['channel']['id']
+        url = f'/api/channels/{channel_id}/messages'
+        db.session.add(Message(channel_id=channel_id, user_id=user_id, content='hello'))
+        db.session.commit()
+
+        etag = client.get(url, headers=auth_headers(token)).headers['ETag']
+        conditional = {**auth_headers(token), 'If-None-Match': etag}
+        assert client.get(url, headers=conditional).status_code == 304
+        # Other page sizes and cursor pages are not tagged alike
+        assert client.get(url + '?limit=10', headers=conditional).status_code == 200
+        older = client.get(url + '?before=' + 'x', headers=conditional)
+        assert older.status_code == 400 and 'ETag' not in older.headers
+
+        def changed():
+            response = client.get(url, headers={**auth_headers(token), 'If-None-Match': etag})
+            assert response.status_code == 200
+            return response.headers['ETag']
+
+        db.session.add(Message(channel_id=channel_id, user_id=user_id, content='new'))
+        db.session.commit()
+        etag = changed()
+        db.session.get(User, user_id).display_name = 'Alicia'
+        db.session.commit()
+        etag = changed()
+        msg = Message.query.filter_by(content='new').one()
+        msg.is_deleted = True
+        db.session.commit()
+        changed()
+
+    def test_history_etag_versioned_per_channel(self, client, app):
+        token, user_id = signup_user(client, 'Alice')
+        channel_ids = [json.loads(client.post('/api/channels', json={'name': name},
+                                              headers=auth_headers(token)).data)['channel']['id']
+                       for name in ('one', 'two')]
+        for channel_id in channel_ids:
+            db.session.add(Message(channel_id=channel_id, user_id=user_id, content='hello'))
+        db.session.commit()
+        etags = [client.get(f'/api/channels/{c}/messages', headers=auth_headers(token)).headers['ETag']
+                 for c in channel_ids]
+
+        # An edit in one channel leaves the other channel's tag valid
+        Message.query.filter_by(channel_id=channel_ids[0]).one().content = 'edited'
+        db.session.commit()
+        statuses = [client.get(f'/api/channels/{c}/messages',
+                               headers={**auth_headers(token), 'If-None-Match': etag}).status_code
+                    for c, etag in zip(channel_ids, etags)]
+        assert statuses == [200, 304]
+
+    def test_history_reuses_encoded_messages(self, client, app):
+        """History pages are built from cached message bytes, same JSON as to_dict."""
+        from app.serialization import message_cache
+        token, user_id = signup_user(client, 'Alice')
+        create_resp = client.post('/api/channels', json={'name': 'general'},
+                                  headers=auth_headers(token))
+        channel_id = json.loads(create_resp.data)['channel']['id']
+        msg = Message(channel_id=channel_id, user_id=user_id, content='caf\u00e9 "quoted"')
+        db.session.add(msg)
+        db.session.commit()
+        expected = msg.to_dict()
+
+        first = client.get(f'/api/channels/{channel_id}/messages', headers=auth_headers(token))
+        hits = message_cache.hits
+        second = client.get(f'/api/channels/{channel_id}/messages', headers=auth_headers(token))
+        assert message_cache.hits == hits + 1
+        assert first.data == second.data
+        data = json.loads(second.data)
+        assert data['messages'] == [expected]
+        assert data['has_more'] is False
+
+    def test_json_backends_agree(self, monkeypatch):
+        from app import serialization
+        from app.serialization import RawJSON, dumps, extend_json
+        doc = {'b': [1, 2.5, None, True], 'a': 'caf\u00e9 \u0000 "x"',
+               'raw': [RawJSON(b'{"id":1}'), RawJSON(extend_json(b'{"id":2}', temp_id='t'))]}
+        fast = dumps(doc, sort_keys=True)
+        monkeypatch.setattr(serialization, 'orjson', None)
+        assert dumps(doc, sort_keys=True) == fast
+        assert json.loads(fast)['raw'] == [{'id': 1}, {'id': 2, 'temp_id': 't'}]
+
+    def test_profile_cache_invalidated_on_rename(self, client, app):
+        """Renaming a user is reflected in the next serialized message."""
+        from app.profiles import display_name_for
+        token, user_id = signup_user(client, 'Alice')
+        with app.app_context():
+            assert display_name_for(user_id) == 'Alice'
+            user = db.session.get(User, user_id)
+            user.display_name = 'Alicia'
+            db.session.commit()
+            assert display_name_for(user_id) == 'Alicia'
+
+
+    def test_history_continues_into_archive(self, client, app, runner, tmp_path):
+        """Paging past the hot table reads archived segments transparently."""
+        app.config['ARCHIVE_DIR'] = str(tmp_path)
+        app.config['ARCHIVE_SEGMENT_SIZE'] = 5
+        token, user_id = signup_user(client, 'Alice')
+        create_resp = client.post('/api/channels', json={'name': 'general'},
+                                  headers=auth_headers(token))
+        channel_id = json.loads(create_resp.data)['channel']['id']
+        with app.app_context():
+            for i in range(12):
+                db.session.add(Message(channel_id=channel_id, user_id=user_id, content=f'old{i}',
+                                       created_at=datetime(2020, 1, 1, 0, 0, i)))
+            for i in range(3):
+                db.session.add(Message(channel_id=channel_id, user_id=user_id, content=f'new{i}'))
+            db.session.commit()
+
+        result = runner.invoke(args=['archive-messages', '--older-than-days', '30'])
+        assert 'Archived 12 message(s)' in result.output
+        with app.app_context():
+            assert Message.query.filter_by(channel_id=channel_id).count() == 3
+
+        url = f'/api/channels/{channel_id}/messages?limit=4'
+        contents = []
+        cursor = None
+        while True:
+            data = json.loads(client.get(url + (f'&before={cursor}' if cursor else ''),
+                                         headers=auth_headers(token)).data)
+            contents = [m['content'] for m in data['messages']] + contents
+            cursor = data['next_cursor']
+            if not data['has_more']:
+                break
+        assert contents == [f'old{i}' for i in range(12)] + ['new0', 'new1', 'new2']
+        assert data['messages'][0]['user']['display_name'] == 'Alice'
+
+        # Walking forwards from the oldest page crosses back into the hot table
+        forward = []
+        cursor = data['prev_cursor']
+        while cursor:
+            page = json.loads(client.get(url + f'&after={cursor}', headers=auth_headers(token)).data)
+            forward += [m['content'] for m in page['messages']]
+            cursor = page['prev_cursor'] if page['has_more'] else None
+        assert forward == contents[len(data['messages']):]
+
+    def test_history_reads_archive_index_only_when_needed(self, client, app, runner, tmp_path, monkeypatch):
+        from app import archive
+        app.config['ARCHIVE_DIR'] = str(tmp_path)
+        loads = []
+        load_index = archive.load_index
+        monkeypatch.setattr(archive, 'load_index', lambda channel_id: loads.append(channel_id) or load_index(channel_id))
+        token, user_id = signup_user(client, 'Alice')
+        channel_id = json.loads(client.post('/api/channels', json={'name': 'general'},
+                                            headers=auth_headers(token)).data)['channel']['id']
+        client.post(f'/api/channels/{channel_id}/messages', json={'content': 'hot'}, headers=auth_headers(token))
+        url = f'/api/channels/{channel_id}/messages?limit=10'
+        for _ in range(3):
+            assert client.get(url, headers=auth_headers(token)).status_code == 200
+        assert loads == []
+
+        with app.app_context():
+            db.session.add(Message(channel_id=channel_id, user_id=user_id, content='old',
+                                   created_at=datetime(2020, 1, 1)))
+            db.session.commit()
+        runner.invoke(args=['archive-messages', '--older-than-days', '30'])
+        loads.clear()
+        for _ in range(3):
+            data = json.loads(client.get(url, headers=auth_headers(token)).data)
+            assert [m['content'] for m in data['messages']] == ['old', 'hot']
+        # The three pages share one read of the manifest
+        assert len(loads) == 1
+
+
+    def test_search_messages(self, client, app):
+        """Search is scoped to the channel or to the caller's memberships."""
+        token1, _ = signup_user(client, 'Alice')
+        token2, _ = signup_user(client, 'Bob')
+        ch1 = json.loads(client.post('/api/channels', json={'name': 'one'},
+                                     headers=auth_headers(token1)).data)['channel']['id']
+        ch2 = json.loads(client.post('/api/channels', json={'name': 'two', 'is_private': True},
+                                     headers=auth_headers(token2)).data)['channel']['id']
+        for i in range(5):
+            client.post(f'/api/channels/{ch1}/messages', json={'content': f'deploy window {i}'},
+                        headers=auth_headers(token1))
+        client.post(f'/api/channels/{ch1}/messages', json={'content': 'lunch?'},
+                    headers=auth_headers(token1))
+        client.post(f'/api/channels/{ch2}/messages', json={'content': 'secret deploy'},
+                    headers=auth_headers(token2))
+
+        url = f'/api/channels/{ch1}/messages/search?q=deploy&limit=2'
+        found, cursor = [], None
+        while True:
+            data = json.loads(client.get(url + (f'&cursor={cursor}' if cursor else ''),
+                                         headers=auth_headers(token1)).data)
+            found += [r['content'] for r in data['results']]
+            cursor = data['next_cursor']
+            if not data['has_more']:
+                break
+        assert sorted(found) == [f'deploy window {i}' for i in range(5)]
+
+        # Cross-channel search never reaches channels the caller is not in
+        data = json.loads(client.get('/api/channels/messages/search?q=deploy&limit=50',
+                                     headers=auth_headers(token1)).data)
+        assert 'secret deploy' not in [r['content'] for r in data['results']]
+        assert client.get(f'/api/channels/{ch2}/messages/search?q=deploy',
+                          headers=auth_headers(token1)).status_code == 403
+
+        # Soft-deleted messages drop out of the index
+        with app.app_context():
+            msg = Message.query.filter_by(content='deploy window 0').one()
+            msg.is_deleted = True
+            db.session.commit()
+        data = json.loads(client.get(f'/api/channels/{ch1}/messages/search?q=window&limit=50',
+                                     headers=auth_headers(token1)).data)
+        assert len(data['results']) == 4
+
+        # Rows a bulk write hides without touching the index still never
+        # shorten a page
+        with app.app_context():
+            Message.query.filter(Message.content.in_(['deploy window 1', 'deploy window 2'])).update(
+                {Message.is_deleted: True}, synchronize_session=False)
+            db.session.commit()
+        data = json.loads(client.get(f'/api/channels/{ch1}/messages/search?q=window&limit=2',
+                                     headers=auth_headers(token1)).data)
+        assert len(data['results']) == 2 and data['has_more'] is False
+        assert all(isinstance(r['rank'], float) for r in data['results'])
+        for url in (f'/api/channels/{ch1}/messages/search?q=window&limit=x',
+                    '/api/channels/messages/search?q=window&limit=x'):
+            response = client.get(url, headers=auth_headers(token1))
+            assert response.status_code == 400
+            assert json.loads(response.data)['error'] == 'invalid limit'
+
+
+class TestModels:
+    """Model helper tests."""
+
+    def test_uuid7_ids_are_time_ordered(self):
+        """gen_uuid7 yields valid v7 uuids that sort in creation order."""
+        import uuid
+        from app.models import gen_uuid7
+        ids = [gen_uuid7() for _ in range(5000)]
+        assert ids == sorted(ids)
+        assert len(set(ids)) == len(ids)
+        assert uuid.UUID(ids[0]).version == 7
+
+
 class TestHealth:
     """Health check tests."""
     
@@ -219,3 +1051,50 @@ class TestHealth:
         assert response.status_code == 200
         data = json.loads(response.data)
         assert data['status'] == 'ok'
+
+    def test_metrics_off_by_default(self, client):
+        assert client.get('/metrics').status_code == 404
+
+    @pytest.mark.parametrize('app_env', [{'METRICS_ENABLED': '1', 'METRICS_TOKEN': 's3cret'}])
+    def test_metrics_require_token(self, client):
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+    @pytest.mark.parametrize('app_env', [{'METRICS_ENABLED': '1'}])
+    def test_metrics_endpoint(self, client):
+        from app.metrics import http_latency
+        token, _ = signup_user(client, 'Alice')
+        before = http_latency.count('channels.list_channels', 'GET', '200')
+        client.get('/api/channels', headers=auth_headers(token))
+        assert http_latency.count('channels.list_channels', 'GET', '200') == before + 1
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        body = response.get_data(as_text=True)
+        assert ('http_request_duration_seconds_bucket{endpoint="channels.list_channels",'
+                'method="GET",status="200",le="+Inf"}') in body
+        assert 'http_request_queries_count{endpoint="channels.list_channels"}' in body
+        assert 'db_pool_checkout_seconds_count' in body
+        assert 'socketio_connected_sockets 0' in body
+        assert 'cache_hits_total{cache="token"}' in body
+
+
+class TestQueryLog:
+    """Query accounting tests."""
+
+    def test_repeated_queries_reported_as_n_plus_one(self, app, caplog):
+        from app.querylog import capture
+        users = [User(email=f'u{i}@example.com', password_hash='x') for i in range(6)]
+        db.session.add_all(users)
+        db.session.commit()
+        ids = [u.id for u in users]
+        db.session.expire_all()
+        with caplog.at_level('WARNING', logger='app.querylog'):
+            with capture('profiles', check=True) as log:
+                for user_id in ids:
+                    db.session.get(User, user_id)
+        assert len(log) == 6
+        assert log.repeated(5)[0][1] == 6
+        assert 'Possible N+1 in profiles: 6 x SELECT' in caplog.text
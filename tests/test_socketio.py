@@ -0,0 +1,397 @@
+"""Socket.IO event handler tests."""
+import pytest
+from app import create_app, db, socketio
+from app.models import Message
+from test_api import auth_headers, signup_user
+import json
+import time
+
+
+def create_channel(client, token, name='general', is_private=False):
+    response = client.post('/api/channels', json={'name': name, 'is_private': is_private},
+                           headers=auth_headers(token))
+    return json.loads(response.data)['channel']['id']
+
+
+def received(sio, name):
+    # The test client unwraps the payload of the reserved 'message' event
+    return [p['args'][0] if isinstance(p['args'], list) else p['args']
+            for p in sio.get_received() if p['name'] == name]
+
+
+class TestSendMessage:
+    """send_message event tests."""
+
+    def test_send_message_persists_and_broadcasts(self, app, client):
+        token, user_id = signup_user(client, 'Alice')
+        channel_id = create_channel(client, token)
+        sio = socketio.test_client(app, flask_test_client=client, auth={'token': token})
+        assert sio.is_connected()
+        sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        sio.get_received()
+
+        ack = sio.emit('send_message', {'channel_id': channel_id, 'content': 'hi', 'temp_id': 't1'},
+                       callback=True)
+        assert ack['ok'] is True
+        messages = received(sio, 'message')
+        assert messages[0]['id'] == ack['id']
+        assert messages[0]['temp_id'] == 't1'
+        assert db.session.get(Message, ack['id']).content == 'hi'
+        sio.disconnect()
+
+    @pytest.mark.parametrize('app_env', [{'METRICS_ENABLED': '1'}])
+    def test_event_latency_and_queries_recorded(self, app, client):
+        from app.metrics import event_latency, event_queries, render
+        token, _ = signup_user(client, 'Alice')
+        channel_id = create_channel(client, token)
+        sio = socketio.test_client(app, flask_test_client=client, auth={'token': token})
+        sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        sent = event_latency.count('send_message')
+        sio.emit('send_message', {'channel_id': channel_id, 'content': 'hi'}, callback=True)
+        assert event_latency.count('send_message') == sent + 1
+        assert event_queries.count('send_message') == sent + 1
+
+        body = render()
+        assert 'socketio_event_duration_seconds_count{event="join_channel"}' in body
+        assert 'socketio_connected_sockets 1' in body
+        assert 'socketio_rooms 1' in body
+        assert 'socketio_room_size_bucket{le="1"} 1' in body
+        sio.disconnect()
+
+    def test_busy_room_gets_batched_frames(self, app, client):
+        from app.broadcast import room_batcher
+        app.config.update(BROADCAST_BATCH_ENABLED=True, BROADCAST_BATCH_INTERVAL_MS=300)
+        token, user_id = signup_user(client, 'Alice')
+        channel_id = create_channel(client, token)
+        sio = socketio.test_client(app, flask_test_client=client, auth={'token': token})
+        sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        sio.get_received()
+        # Freeze the clock so every send falls in the same rate window; the
+        # batch then goes out when the batcher stops
+        room_batcher.clock = lambda: 1000.0
+        try:
+            acks = [sio.emit('send_message', {'channel_id': channel_id, 'content': f'm{i}'},
+                             callback=True) for i in range(8)]
+        finally:
+            room_batcher.stop()
+            room_batcher.clock = time.monotonic
+        # Up to BROADCAST_BATCH_MIN_RATE (5) messages a second go out one by one
+        packets = sio.get_received()
+        assert [p['name'] for p in packets] == ['message'] * 5 + ['messages']
+        assert [m['id'] for m in packets[-1]['args'][0]['messages']] == [a['id'] for a in acks[5:]]
+        sio.disconnect()
+
+    def test_group_commit_acks_after_flush(self, app, client):
+        from app.message_writer import message_writer
+        app.config['GROUP_COMMIT_ENABLED'] = True
+        app.config['GROUP_COMMIT_INTERVAL_MS'] = 2
+        token, user_id = signup_user(client, 'Alice')
+        channel_id = create_channel(client, token)
+        sio = socketio.test_client(app, flask_test_client=client, auth={'token': token})
+        sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        sio.get_received()
+
+        try:
+            acks = [sio.emit('send_message', {'channel_id': channel_id, 'content': f'm{i}'},
+                             callback=True) for i in range(5)]
+        finally:
+            message_writer.stop()
+        assert all(a['ok'] for a in acks)
+        assert [m['id'] for m in received(sio, 'message')] == [a['id'] for a in acks]
+        db.session.expire_all()
+        stored = Message.query.filter(Message.id.in_([a['id'] for a in acks])).count()
+        assert stored == 5
+        sio.disconnect()
+
+    def test_group_commit_ack_timeout_answers_pending(self, app, client, monkeypatch):
+        import threading
+        from app.message_writer import message_writer
+        app.config['GROUP_COMMIT_ENABLED'] = True
+        app.config['GROUP_COMMIT_INTERVAL_MS'] = 2
+        app.config['GROUP_COMMIT_ACK_TIMEOUT'] = 0.05
+        token, user_id = signup_user(client, 'Alice')
+        channel_id = create_channel(client, token)
+        sio = socketio.test_client(app, flask_test_client=client, auth={'token': token})
+        sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        sio.get_received()
+
+        # Hold the writer so the batch commits only after the ack has timed out
+        release = threading.Event()
+        flush = message_writer._flush
+        monkeypatch.setattr(message_writer, '_flush', lambda batch: (release.wait(5), flush(batch)))
+        try:
+            ack = sio.emit('send_message', {'channel_id': channel_id, 'content': 'slow', 'temp_id': 't1'},
+                           callback=True)
+            assert ack['ok'] is True and ack['pending'] is True
+            assert received(sio, 'message') == []
+            release.set()
+        finally:
+            release.set()
+            message_writer.stop()
+        messages = received(sio, 'message')
+        assert [(m['id'], m['temp_id']) for m in messages] == [(ack['id'], 't1')]
+        db.session.expire_all()
+        assert Message.query.filter_by(id=ack['id']).count() == 1
+        sio.disconnect()
+
+    def test_group_commit_rejects_only_the_bad_row(self, app, client):
+        from datetime import datetime
+        from app.message_writer import GroupCommitWriter
+        from app.models import gen_uuid7
+        token, user_id = signup_user(client, 'Alice')
+        channel_id = create_channel(client, token)
+        writer = GroupCommitWriter()
+        writer._app = app
+
+        def row(content, id=None):
+            return {'id': id or gen_uuid7(), 'channel_id': channel_id, 'user_id': user_id,
+                    'content': content, 'created_at': datetime.utcnow(), 'edited_at': None,
+                    'is_deleted': False}
+        first = writer.submit(row('first'))
+        writer._flush(writer._take_batch())
+        batch = [writer.submit(row('a')), writer.submit(row('dup', id=first.row['id'])),
+                 writer.submit(row('b'))]
+        writer._flush(writer._take_batch())
+
+        assert [p.error is None for p in batch] == [True, False, True]
+        assert writer.rows_written == 3
+        db.session.expire_all()
+        contents = {m.content for m in Message.query.filter_by(channel_id=channel_id)}
+        assert contents == {'first', 'a', 'b'}
+
+
+class TestPresence:
+    """Presence tracking tests."""
+
+    def test_second_tab_keeps_user_present(self, app, client):
+        alice_token, alice_id = signup_user(client, 'Alice')
+        bob_token, _ = signup_user(client, 'Bob')
+        channel_id = create_channel(client, alice_token)
+        tabs = [socketio.test_client(app, flask_test_client=client, auth={'token': alice_token})
+                for _ in range(2)]
+        bob = socketio.test_client(app, flask_test_client=client, auth={'token': bob_token})
+        bob.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        bob.get_received()
+        for sio in tabs:
+            sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        # Only the first tab announces Alice
+        assert [p['action'] for p in received(bob, 'presence_update')] == ['joined']
+
+        tabs[0].disconnect()
+        assert received(bob, 'presence_update') == []
+        tabs[1].emit('leave_channel', {'channel_id': channel_id}, callback=True)
+        updates = received(bob, 'presence_update')
+        assert [(p['user_id'], p['action']) for p in updates] == [(alice_id, 'left')]
+        tabs[1].disconnect()
+        bob.disconnect()
+
+
+    def test_presence_renewed_by_worker_until_it_stops(self, app, client):
+        import time
+        from app.presence import presence_renewer
+        app.config.update(PRESENCE_TTL=0.3, PRESENCE_HEARTBEAT_INTERVAL=0.1)
+        presence_renewer.stop()  # restart with this interval on the next connect
+        alice_token, alice_id = signup_user(client, 'Alice')
+        bob_token, bob_id = signup_user(client, 'Bob')
+        channel_id = create_channel(client, alice_token)
+        alice = socketio.test_client(app, flask_test_client=client, auth={'token': alice_token})
+        bob = socketio.test_client(app, flask_test_client=client, auth={'token': bob_token})
+        try:
+            alice.emit('join_channel', {'channel_id': channel_id}, callback=True)
+            # Alice never sends 'heartbeat'; her worker keeps her entry alive
+            time.sleep(0.5)
+            bob.emit('join_channel', {'channel_id': channel_id}, callback=True)
+            assert set(received(bob, 'online_users_list')[0]['users']) == {alice_id, bob_id}
+
+            # A worker that stops renewing (e.g. it crashed) drops out after the TTL
+            presence_renewer.stop()
+            time.sleep(0.4)
+            bob.emit('join_channel', {'channel_id': channel_id}, callback=True)
+            assert list(received(bob, 'online_users_list')[0]['users']) == [bob_id]
+            assert alice.emit('heartbeat', {}, callback=True) == {'ok': True}
+            bob.emit('join_channel', {'channel_id': channel_id}, callback=True)
+            assert set(received(bob, 'online_users_list')[0]['users']) == {alice_id, bob_id}
+        finally:
+            presence_renewer.stop()
+        alice.disconnect()
+        bob.disconnect()
+
+    def test_local_store_shared_between_workers(self):
+        from app.presence import LocalPresenceStore
+        from app.socket_queue import LocalBroker
+        broker = LocalBroker().start()
+        try:
+            worker_a, worker_b = LocalPresenceStore(broker.url), LocalPresenceStore(broker.url)
+            worker_a.touch('c1', 'sid-a', 'alice', 60)
+            worker_b.touch('c1', 'sid-b', 'bob', 60)
+            assert worker_b.online_users('c1') == ['alice', 'bob']
+            worker_a.remove('c1', 'sid-a', 'alice')
+            worker_b.touch('c1', 'sid-c', 'carol', 0)
+            assert worker_a.online_users('c1') == ['bob']
+        finally:
+            broker.stop()
+
+
+class TestMessageQueue:
+    """Cross-worker fan-out through the local broker."""
+
+    def test_emit_published_to_other_workers(self, monkeypatch):
+        import queue, threading, time
+        from app.socket_queue import LocalBroker, LocalManager
+        broker = LocalBroker().start()
+        monkeypatch.setenv('SOCKETIO_MESSAGE_QUEUE_URL', broker.url)
+        create_app()
+        # The flask-socketio test client refuses queue-backed servers, so
+        # stand in for a second worker by listening on the broker directly
+        assert isinstance(socketio.server.manager, LocalManager)
+        other_worker = LocalManager(broker.url, channel='flask-socketio')
+        inbox = queue.Queue()
+        threading.Thread(target=lambda: [inbox.put(m) for m in other_worker._listen()],
+                         daemon=True).start()
+        try:
+            for _ in range(50):
+                if broker._subscribers.get('flask-socketio'):
+                    break
+                time.sleep(0.02)
+            socketio.emit('message', {'id': 'm1'}, room='channel:c1')
+            published = json.loads(inbox.get(timeout=5))
+            assert published['method'] == 'emit'
+            assert published['room'] == 'channel:c1'
+            assert published['data'] == [{'id': 'm1'}]
+        finally:
+            other_worker.close()
+            socketio.server.manager.close()
+            broker.stop()
+
+
+    def test_queue_managers_encode_raw_json(self):
+        from app.serialization import RawJSON
+        from app.socket_queue import client_manager_for
+        # Write-only emitters are never attached to a server, so they use
+        # the encoder they were built with
+        manager = client_manager_for('local://127.0.0.1:6380')
+        assert json.loads(manager.json.dumps({'data': RawJSON(b'{"id":"m1"}')})) == {'data': {'id': 'm1'}}
+
+    def test_sent_message_published_to_other_workers(self, monkeypatch):
+        import queue, threading, time
+        from app.socket_queue import LocalBroker, LocalManager
+        broker = LocalBroker().start()
+        monkeypatch.setenv('SOCKETIO_MESSAGE_QUEUE_URL', broker.url)
+        monkeypatch.setenv('DATABASE_URL', 'sqlite:///:memory:')
+        app = create_app()
+        # The test client only refuses PubSubManager instances; the local
+        # worker's manager still publishes every emit to the broker
+        monkeypatch.setattr('flask_socketio.test_client.PubSubManager', type('NoQueue', (), {}))
+        other_worker = LocalManager(broker.url, channel='flask-socketio')
+        inbox = queue.Queue()
+        threading.Thread(target=lambda: [inbox.put(m) for m in other_worker._listen()],
+                         daemon=True).start()
+        with app.app_context():
+            db.create_all()
+            try:
+                client = app.test_client()
+                token, user_id = signup_user(client, 'Alice')
+                channel_id = create_channel(client, token)
+                sio = socketio.test_client(app, flask_test_client=client, auth={'token': token})
+                sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+                for _ in range(50):
+                    if broker._subscribers.get('flask-socketio'):
+                        break
+                    time.sleep(0.02)
+                ack = sio.emit('send_message', {'channel_id': channel_id, 'content': 'hi', 'temp_id': 't1'},
+                               callback=True)
+                assert ack['ok'] is True
+                message = json.loads(inbox.get(timeout=5))
+                while message['event'] != 'message':
+                    message = json.loads(inbox.get(timeout=5))
+                assert message['room'] == f'channel:{channel_id}'
+                assert message['data'][0]['id'] == ack['id']
+                assert message['data'][0]['temp_id'] == 't1'
+                sio.disconnect()
+            finally:
+                other_worker.close()
+                socketio.server.manager.close()
+                broker.stop()
+                db.session.remove()
+                db.drop_all()
+
+
+class TestTyping:
+    """Typing indicator coalescing."""
+
+    def test_typing_events_coalesced_per_room(self, app, client):
+        import time
+        from app.typing_indicators import typing_state, typing_worker
+        app.config['TYPING_COALESCE_INTERVAL_MS'] = 50
+        alice_token, alice_id = signup_user(client, 'Alice')
+        bob_token, _ = signup_user(client, 'Bob')
+        channel_id = create_channel(client, alice_token)
+        alice = socketio.test_client(app, flask_test_client=client, auth={'token': alice_token})
+        bob = socketio.test_client(app, flask_test_client=client, auth={'token': bob_token})
+        for sio in (alice, bob):
+            sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        bob.get_received()
+        typing_state.clear()
+        inbound, outbound = typing_state.inbound, typing_state.outbound
+        try:
+            for _ in range(20):
+                alice.emit('typing', {'channel_id': channel_id, 'is_typing': True})
+            time.sleep(0.2)
+            alice.emit('typing', {'channel_id': channel_id, 'is_typing': False})
+            time.sleep(0.2)
+        finally:
+            typing_worker.stop()
+        frames = received(bob, 'typing_users')
+        assert [f['user_ids'] for f in frames] == [[alice_id], []]
+        assert typing_state.inbound - inbound == 21
+        assert typing_state.outbound - outbound == 2
+        alice.disconnect()
+        bob.disconnect()
+
+
+    def test_typing_frames_merge_other_workers(self, app, client):
+        import time
+        from app.presence import presence_store
+        from app.typing_indicators import typing_worker
+        app.config['TYPING_COALESCE_INTERVAL_MS'] = 50
+        alice_token, alice_id = signup_user(client, 'Alice')
+        bob_token, _ = signup_user(client, 'Bob')
+        channel_id = create_channel(client, alice_token)
+        alice = socketio.test_client(app, flask_test_client=client, auth={'token': alice_token})
+        bob = socketio.test_client(app, flask_test_client=client, auth={'token': bob_token})
+        for sio in (alice, bob):
+            sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        bob.get_received()
+        # Carol is typing on a socket held by another worker
+        presence_store.touch(f'typing:{channel_id}', 'carol', 'carol', 5)
+        try:
+            alice.emit('typing', {'channel_id': channel_id, 'is_typing': True})
+            time.sleep(0.2)
+        finally:
+            typing_worker.stop()
+        assert [f['user_ids'] for f in received(bob, 'typing_users')] == [sorted([alice_id, 'carol'])]
+        alice.disconnect()
+        bob.disconnect()
+
+    def test_typing_relayed_per_event_by_default(self, app, client):
+        alice_token, alice_id = signup_user(client, 'Alice')
+        bob_token, _ = signup_user(client, 'Bob')
+        channel_id = create_channel(client, alice_token)
+        alice = socketio.test_client(app, flask_test_client=client, auth={'token': alice_token})
+        bob = socketio.test_client(app, flask_test_client=client, auth={'token': bob_token})
+        for sio in (alice, bob):
+            sio.emit('join_channel', {'channel_id': channel_id}, callback=True)
+        bob.get_received()
+        alice.emit('typing', {'channel_id': channel_id, 'is_typing': True})
+        assert received(bob, 'typing') == [{'user_id': alice_id, 'is_typing': True}]
+        assert received(alice, 'typing') == []
+        alice.disconnect()
+        bob.disconnect()
+
+class TestAsyncMode:
+    """SOCKETIO_ASYNC_MODE selection."""
+
+    def test_unsupported_async_mode_rejected(self, monkeypatch):
+        monkeypatch.setenv('SOCKETIO_ASYNC_MODE', 'asgi')
+        with pytest.raises(ValueError):
+            create_app()